@@ -0,0 +1,66 @@
+#!env python3
+
+import argparse
+import runpy
+import sys
+import lib.profiling_lite as pl
+from lib.auto_tracer import AutoTracer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a Python script, tracing all its functions into a binary trace "
+        "(requires Python 3.12+)."
+    )
+    parser.add_argument("script", type=str, help="The Python script to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="The arguments of the script")
+    parser.add_argument(
+        "-o",
+        "--out",
+        type=str,
+        help="The output filename (binary trace)",
+        default="capture.bin-trace",
+    )
+    parser.add_argument(
+        "--allow",
+        action="append",
+        default=[],
+        help="Only trace the functions of this module (and submodules); can be repeated",
+    )
+    parser.add_argument(
+        "--deny",
+        action="append",
+        default=[],
+        help="Don't trace the functions of this module (and submodules); can be repeated",
+    )
+    parser.add_argument(
+        "--min-duration-us",
+        type=float,
+        default=0.0,
+        help="Drop the zones shorter than this (microseconds)",
+    )
+    parser.add_argument(
+        "--sample-rate",
+        type=float,
+        default=1.0,
+        help="The fraction of the outermost calls to trace, with all the calls they make",
+    )
+    args = parser.parse_args()
+
+    tracer = AutoTracer(
+        allow=args.allow,
+        deny=args.deny,
+        min_duration_ns=int(args.min_duration_us * 1000),
+        sample_rate=args.sample_rate,
+    )
+    sys.argv = [args.script] + args.args
+    pl.start(args.out)
+    try:
+        with tracer:
+            runpy.run_path(args.script, run_name="__main__")
+    finally:
+        pl.stop()
+
+
+if __name__ == "__main__":
+    main()
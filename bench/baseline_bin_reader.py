@@ -0,0 +1,210 @@
+# The reader of binary traces that the memory-mapped reader replaced, as it was (without the
+# dependencies of the packets), so that `bench_bin_reader` measures the speedup against it.
+from enum import Enum, auto
+import struct
+
+
+class PacketType(Enum):
+    free = 0
+    init = 16
+    static_string = auto()
+    location = auto()
+
+    stack = auto()
+    thread_name = auto()
+
+    zone_start = auto()
+    zone_end = auto()
+    zone_dynamic_name = auto()
+    zone_param_bool = auto()
+    zone_param_int = auto()
+    zone_param_uint = auto()
+    zone_param_double = auto()
+    zone_param_string = auto()
+    zone_flow = auto()
+    zone_flow_terminate = auto()
+    zone_category = auto()
+
+    counter_track = auto()
+    counter_value_int = auto()
+    counter_value_double = auto()
+
+
+class _InitPacket:
+    def __init__(self, f):
+        self.magic, self.version = _read_and_unpack("4sI", f)
+
+
+class _StaticStringPacket:
+    def __init__(self, f):
+        self.string_id = _read_and_unpack("Q", f)[0]
+        size = _read_and_unpack("H", f)[0]
+        self.string = f.read(size).decode("utf-8")
+
+
+class _LocationPacket:
+    def __init__(self, f):
+        self.loc_id, self.name_id, self.function_id, self.file_id, self.line = (
+            _read_and_unpack("4QI", f)
+        )
+
+
+class _StackPacket:
+    def __init__(self, f):
+        self.begin, self.end, size = _read_and_unpack("QQH", f)
+        self.name = f.read(size).decode("utf-8")
+
+
+class _ThreadNamePacket:
+    def __init__(self, f):
+        self.tid, size = _read_and_unpack("QH", f)
+        self.thread_name = f.read(size).decode("utf-8")
+
+
+class _ZoneStartPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.tid, self.timestamp, self.loc_id = _read_and_unpack(
+            "4Q", f
+        )
+
+
+class _ZoneEndPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.timestamp = _read_and_unpack("QQ", f)
+
+
+class _ZoneDynamicNamePacket:
+    def __init__(self, f):
+        self.stack_ptr, size = _read_and_unpack("QH", f)
+        self.name = f.read(size).decode("utf-8")
+
+
+class _ZoneParamBoolPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQB", f)
+
+
+class _ZoneParamIntPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQq", f)
+
+
+class _ZoneParamUIntPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQQ", f)
+
+
+class _ZoneParamDoublePacket:
+    def __init__(self, f):
+        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQd", f)
+
+
+class _ZoneParamStringPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.param_name_id, size = _read_and_unpack("QQH", f)
+        self.value = f.read(size).decode("utf-8")
+
+
+class _ZoneFlowPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.flowid = _read_and_unpack("QQ", f)
+
+
+class _ZoneFlowTerminatePacket:
+    def __init__(self, f):
+        self.stack_ptr, self.flowid = _read_and_unpack("QQ", f)
+
+
+class _ZoneCategoryPacket:
+    def __init__(self, f):
+        self.stack_ptr, self.category_name_id = _read_and_unpack("QQ", f)
+
+
+class _CounterTrackPacket:
+    def __init__(self, f):
+        self.tid, size = _read_and_unpack("QH", f)
+        self.track_name = f.read(size).decode("utf-8")
+
+
+class _CounterValueIntPacket:
+    def __init__(self, f):
+        self.tid, self.timestamp, self.value = _read_and_unpack("QQq", f)
+
+
+class _CounterValueDoublePacket:
+    def __init__(self, f):
+        self.tid, self.timestamp, self.value = _read_and_unpack("QQd", f)
+
+
+def _read_and_unpack(format, f):
+    size = struct.calcsize(format)
+    data = f.read(size)
+    if not data:
+        return None
+    return struct.unpack(format, data)
+
+
+def _parse_packet(type, f):
+    if type == PacketType.init:
+        return _InitPacket(f)
+    elif type == PacketType.static_string:
+        return _StaticStringPacket(f)
+    elif type == PacketType.location:
+        return _LocationPacket(f)
+
+    elif type == PacketType.stack:
+        return _StackPacket(f)
+    elif type == PacketType.thread_name:
+        return _ThreadNamePacket(f)
+
+    elif type == PacketType.zone_start:
+        return _ZoneStartPacket(f)
+    elif type == PacketType.zone_end:
+        return _ZoneEndPacket(f)
+    elif type == PacketType.zone_dynamic_name:
+        return _ZoneDynamicNamePacket(f)
+    elif type == PacketType.zone_param_bool:
+        return _ZoneParamBoolPacket(f)
+    elif type == PacketType.zone_param_int:
+        return _ZoneParamIntPacket(f)
+    elif type == PacketType.zone_param_uint:
+        return _ZoneParamUIntPacket(f)
+    elif type == PacketType.zone_param_double:
+        return _ZoneParamDoublePacket(f)
+    elif type == PacketType.zone_param_string:
+        return _ZoneParamStringPacket(f)
+    elif type == PacketType.zone_flow:
+        return _ZoneFlowPacket(f)
+    elif type == PacketType.zone_flow_terminate:
+        return _ZoneFlowTerminatePacket(f)
+    elif type == PacketType.zone_category:
+        return _ZoneCategoryPacket(f)
+
+    elif type == PacketType.counter_track:
+        return _CounterTrackPacket(f)
+    elif type == PacketType.counter_value_int:
+        return _CounterValueIntPacket(f)
+    elif type == PacketType.counter_value_double:
+        return _CounterValueDoublePacket(f)
+
+    elif type == PacketType.free:
+        return None
+    else:
+        raise ValueError(f"Unknown packet type {type}")
+
+
+def _parse_next_packet(f):
+    tuple = _read_and_unpack("B", f)
+    if tuple == None:
+        return None
+    type = PacketType(tuple[0])
+    return _parse_packet(type, f)
+
+
+def baseline_packets(f):
+    """Yields the packets of the binary trace `f`, reading them like the original reader."""
+    while True:
+        p = _parse_next_packet(f)
+        if not p:
+            break
+        yield p
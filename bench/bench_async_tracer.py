@@ -0,0 +1,63 @@
+#!env python3
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from lib import profiling_lite as pl
+from lib.async_tracer import AsyncTracer
+
+
+async def _task(steps):
+    for _ in range(steps):
+        await asyncio.sleep(0)
+
+
+async def _run(tasks, steps, traced):
+    """Runs `tasks` tasks of `steps` steps each; returns the time taken, in ns."""
+    tracer = AsyncTracer() if traced else None
+    if tracer:
+        tracer.start()
+    start = time.perf_counter_ns()
+    await asyncio.gather(*(_task(steps) for _ in range(tasks)))
+    elapsed = time.perf_counter_ns() - start
+    if tracer:
+        tracer.stop()
+    return elapsed
+
+
+def _best_ns(tasks, steps, repeat, traced):
+    """The best time of `repeat` runs, per task step, in ns."""
+    best = float("inf")
+    for _ in range(repeat):
+        best = min(best, asyncio.run(_run(tasks, steps, traced)))
+        pl.flush()
+    # Each task also has a first and a last step.
+    return best / (tasks * (steps + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the overhead of tracing the asyncio tasks, per task step."
+    )
+    parser.add_argument("--tasks", type=int, default=1000, help="Tasks per run")
+    parser.add_argument("--steps", type=int, default=100, help="Suspensions per task")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.bin-trace")
+        pl.start(filename)
+        plain = _best_ns(args.tasks, args.steps, args.repeat, False)
+        traced = _best_ns(args.tasks, args.steps, args.repeat, True)
+        pl.stop()
+        size = os.path.getsize(filename)
+
+    print(f"Untraced: {plain:.0f} ns per step")
+    print(f"  Traced: {traced:.0f} ns per step (+{traced - plain:.0f} ns)")
+    print(f"Wrote {size / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!env python3
+
+import argparse
+import os
+import tempfile
+import time
+from lib import profiling_lite as pl
+from lib.auto_tracer import AutoTracer
+
+
+def _empty():
+    pass
+
+
+def _run_calls(n):
+    for _ in range(n):
+        _empty()
+
+
+def _best_ns(run, n, repeat, tracer=None):
+    """The best time of `repeat` runs of `run(n)`, per iteration, in ns."""
+    best = float("inf")
+    for _ in range(repeat):
+        if tracer:
+            tracer.start()
+        start = time.perf_counter_ns()
+        run(n)
+        elapsed = time.perf_counter_ns() - start
+        if tracer:
+            tracer.stop()
+        best = min(best, elapsed)
+        pl.flush()
+    return best / n
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the overhead of the automatic tracer (Python 3.12+), per call."
+    )
+    parser.add_argument("-n", type=int, default=200_000, help="Calls per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.bin-trace")
+        pl.start(filename)
+        plain = _best_ns(_run_calls, args.n, args.repeat)
+        tracers = [
+            ("traced", AutoTracer()),
+            ("min duration 1µs", AutoTracer(min_duration_ns=1000)),
+            ("sampled 1%", AutoTracer(sample_rate=0.01)),
+            ("denied module", AutoTracer(deny=[__name__])),
+        ]
+        results = [
+            (name, _best_ns(_run_calls, args.n, args.repeat, tracer) - plain)
+            for name, tracer in tracers
+        ]
+        pl.stop()
+        size = os.path.getsize(filename)
+
+    for name, ns in results:
+        print(f"{name:>16}: {ns:6.0f} ns per call")
+    print(f"Untraced call: {plain:.0f} ns; wrote {size / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!env python3
+
+import argparse
+import time
+from bench.baseline_bin_reader import baseline_packets
+from bench.synthetic import ensure_synthetic_trace
+from lib.parse_bin_trace import _mmap_packets, _stream_packets
+
+
+def _measure(name, packets_fun, filename):
+    start = time.perf_counter()
+    count = 0
+    with open(filename, "rb") as f:
+        for _ in packets_fun(f):
+            count += 1
+    elapsed = time.perf_counter() - start
+    print(f"{name:>8}: {count:,} packets in {elapsed:.2f}s ({count / elapsed:,.0f} packets/s)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the readers of binary traces with the original reader."
+    )
+    parser.add_argument(
+        "--size-mb", type=int, default=2048, help="Size of the synthetic trace, in MB"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default="synthetic.bin-trace",
+        help="The synthetic trace file (created if missing)",
+    )
+    args = parser.parse_args()
+
+    filename = ensure_synthetic_trace(args.trace, args.size_mb * 1024 * 1024)
+    baseline_time = _measure("baseline", baseline_packets, filename)
+    stream_time = _measure("stream", _stream_packets, filename)
+    mmap_time = _measure("mmap", _mmap_packets, filename)
+    print(f"Speedup of the stream reader: {baseline_time / stream_time:.2f}x")
+    print(f"Speedup of the mmap reader: {baseline_time / mmap_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!env python3
+
+import argparse
+import contextlib
+import io
+import resource
+import subprocess
+import sys
+from bench.synthetic import ensure_synthetic_trace
+
+_STAGES = ["packets", "parse", "emit"]
+
+
+def _load(stage, filename):
+    """Holds all the objects produced by `stage` in memory; returns their number."""
+    from lib.parse_bin_trace import _packet_generator, parse_bin_trace
+    from lib.emit_trace import emit_trace
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage == "packets":
+            items = list(_packet_generator(filename))
+        elif stage == "parse":
+            items = list(parse_bin_trace(filename))
+        elif stage == "emit":
+            items = list(emit_trace(parse_bin_trace(filename)))
+        else:
+            items = []
+    return len(items)
+
+
+def _measure(stage, filename):
+    """Runs `stage` in a fresh process; returns the number of objects and the peak RSS, in KB."""
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.bench_memory", "--trace", filename, "--child", stage],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    count, peak_rss = out.split()
+    return int(count), int(peak_rss)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the peak memory used to hold the packets and the DTOs of a trace."
+    )
+    parser.add_argument(
+        "--size-mb", type=int, default=64, help="Size of the synthetic trace, in MB"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default="synthetic.bin-trace",
+        help="The synthetic trace file (created if missing)",
+    )
+    parser.add_argument("--child", choices=["none"] + _STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        count = _load(args.child, args.trace)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(count, peak_rss)
+        return
+
+    filename = ensure_synthetic_trace(args.trace, args.size_mb * 1024 * 1024)
+    _, base_rss = _measure("none", filename)
+    print(f"Baseline: peak RSS {base_rss / 1024:.1f} MB")
+    for stage in _STAGES:
+        count, peak_rss = _measure(stage, filename)
+        extra = (peak_rss - base_rss) * 1024
+        print(
+            f"{stage:>8}: {count:,} objects, peak RSS {peak_rss / 1024:.1f} MB "
+            f"({extra / max(count, 1):.0f} bytes/object)"
+        )
+
+
+if __name__ == "__main__":
+    main()
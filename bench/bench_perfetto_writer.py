@@ -0,0 +1,52 @@
+#!env python3
+
+import argparse
+import time
+from bench.synthetic import ensure_synthetic_trace
+from lib.parse_bin_trace import parse_bin_trace
+from lib.emit_trace import emit_trace
+from lib.perfetto_writer import PerfettoWriter
+from lib.perfetto_direct_writer import DirectPerfettoWriter
+
+
+def _measure(name, writer_class, items, out):
+    start = time.perf_counter()
+    writer = writer_class(out)
+    for obj in items:
+        writer.add(obj)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>6}: {len(items):,} items in {elapsed:.2f}s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the pb2-based Perfetto writer with the direct encoder."
+    )
+    parser.add_argument(
+        "--size-mb", type=int, default=16, help="Size of the synthetic trace, in MB"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default="synthetic.bin-trace",
+        help="The synthetic trace file (created if missing)",
+    )
+    args = parser.parse_args()
+
+    filename = ensure_synthetic_trace(args.trace, args.size_mb * 1024 * 1024)
+    items = list(emit_trace(parse_bin_trace(filename)))
+
+    pb2_time = _measure("pb2", PerfettoWriter, items, "bench-pb2.perfetto-trace")
+    direct_time = _measure(
+        "direct", DirectPerfettoWriter, items, "bench-direct.perfetto-trace"
+    )
+    with open("bench-pb2.perfetto-trace", "rb") as a:
+        with open("bench-direct.perfetto-trace", "rb") as b:
+            identical = a.read() == b.read()
+    print(f"Speedup: {pb2_time / direct_time:.2f}x (identical output: {identical})")
+
+
+if __name__ == "__main__":
+    main()
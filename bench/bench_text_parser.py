@@ -0,0 +1,62 @@
+#!env python3
+
+import argparse
+import csv
+import time
+import tracemalloc
+from bench.synthetic import ensure_synthetic_text_trace
+from lib.parse_text_trace import parse_text_trace, _PARSERS
+
+
+def _csv_parse(filename):
+    """Reference parser: reads the whole file, and parses every line with the csv reader."""
+    with open(filename, "r") as file:
+        lines = [line.strip() for line in file.readlines()]
+    lines = (line for line in lines if line and not line.startswith("#"))
+    rows = csv.reader(lines, delimiter=",", quotechar='"', skipinitialspace=True, strict=True)
+    for row in rows:
+        yield _PARSERS[row[0].upper()](row[1:])
+
+
+def _measure(name, parse, filename, size):
+    """Times `parse`, then measures its peak memory in a separate run."""
+    start = time.perf_counter()
+    count = sum(1 for _ in parse(filename))
+    elapsed = time.perf_counter() - start
+
+    # Tracing the allocations slows down the parsing, so it is not timed.
+    tracemalloc.start()
+    sum(1 for _ in parse(filename))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>6}: {count:,} items in {elapsed:.2f}s ({size / elapsed / 1024 / 1024:.1f} MB/s), "
+        f"peak traced memory {peak / 1024 / 1024:.1f} MB"
+    )
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the streaming text trace parser with a csv-only parser."
+    )
+    parser.add_argument(
+        "--size-mb", type=int, default=64, help="Size of the synthetic text trace, in MB"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default="synthetic.text-trace",
+        help="The synthetic text trace file (created if missing)",
+    )
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    filename = ensure_synthetic_text_trace(args.trace, size)
+    csv_time = _measure("csv", _csv_parse, filename, size)
+    fast_time = _measure("fast", parse_text_trace, filename, size)
+    print(f"Speedup: {csv_time / fast_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
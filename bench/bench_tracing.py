@@ -0,0 +1,97 @@
+#!env python3
+
+import argparse
+import os
+import tempfile
+import time
+from lib import profiling_lite as pl
+
+# The overhead we aim for, per zone (start and end).
+_TARGET_NS = 1000
+
+_ZONE = pl.zone("Zone")
+
+
+def _empty():
+    pass
+
+
+@pl.zone()
+def _traced():
+    pass
+
+
+def _run_plain(n):
+    for _ in range(n):
+        pass
+
+
+def _run_zone(n):
+    for _ in range(n):
+        with _ZONE:
+            pass
+
+
+def _run_zone_per_use(n):
+    for _ in range(n):
+        with pl.zone("Zone"):
+            pass
+
+
+def _run_zone_with_param(n):
+    for i in range(n):
+        with _ZONE as z:
+            z.set_param("i", i)
+
+
+def _run_call(n):
+    for _ in range(n):
+        _empty()
+
+
+def _run_decorated(n):
+    for _ in range(n):
+        _traced()
+
+
+def _best_ns(run, n, repeat):
+    """The best time of `repeat` runs of `run(n)`, per iteration, in ns."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        run(n)
+        best = min(best, time.perf_counter_ns() - start)
+        pl.flush()
+    return best / n
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the overhead of the zones of the Python tracing library."
+    )
+    parser.add_argument("-n", type=int, default=200_000, help="Zones per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.bin-trace")
+        pl.start(filename)
+        loop = _best_ns(_run_plain, args.n, args.repeat)
+        call = _best_ns(_run_call, args.n, args.repeat)
+        results = [
+            ("with zone (reused)", _best_ns(_run_zone, args.n, args.repeat) - loop),
+            ("with zone(name)", _best_ns(_run_zone_per_use, args.n, args.repeat) - loop),
+            ("zone + set_param", _best_ns(_run_zone_with_param, args.n, args.repeat) - loop),
+            ("@zone function", _best_ns(_run_decorated, args.n, args.repeat) - call),
+        ]
+        pl.stop()
+        size = os.path.getsize(filename)
+
+    for name, ns in results:
+        verdict = "ok" if ns < _TARGET_NS else "above target"
+        print(f"{name:>20}: {ns:6.0f} ns per zone ({verdict})")
+    print(f"Target: {_TARGET_NS} ns per zone; wrote {size / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import struct
+import os
+
+_NUM_LOCATIONS = 16
+_NUM_THREADS = 4
+_STACK_SIZE = 1024 * 1024
+
+
+def _packet(type, format, *args):
+    return bytes([type]) + struct.pack("<" + format, *args)
+
+
+def _dyn_packet(type, format, *args, text):
+    data = text.encode("utf-8")
+    return bytes([type]) + struct.pack("<" + format + "H", *args, len(data)) + data
+
+
+def _header():
+    """The packets that define the strings, locations, stacks and threads."""
+    out = bytearray(_packet(16, "4sI", b"PROF", 1))
+    for i in range(_NUM_LOCATIONS):
+        loc_id = 0x1000 + i
+        name_id, function_id, file_id = loc_id * 8, loc_id * 8 + 1, loc_id * 8 + 2
+        out += _dyn_packet(17, "Q", name_id, text=f"zone_{i}")
+        out += _dyn_packet(17, "Q", function_id, text=f"function_{i}()")
+        out += _dyn_packet(17, "Q", file_id, text=f"file_{i % 4}.cpp")
+        out += _packet(18, "4QI", loc_id, name_id, function_id, file_id, 10 + i)
+    out += _dyn_packet(17, "Q", 0x100, text="param")
+    for t in range(_NUM_THREADS):
+        stack_end = (t + 1) * _STACK_SIZE
+        out += _dyn_packet(19, "QQ", stack_end - _STACK_SIZE, stack_end, text=f"Stack {t}")
+        out += _dyn_packet(20, "Q", t, text=f"Thread {t}")
+    out += _dyn_packet(32, "Q", 1, text="Counter")
+    return out
+
+
+def _block(first_timestamp, num_zones=1000):
+    """A block of balanced zones, with some parameters and counter values."""
+    out = bytearray()
+    timestamp = first_timestamp
+    for z in range(num_zones):
+        tid = z % _NUM_THREADS
+        stack_end = (tid + 1) * _STACK_SIZE
+        loc_id = 0x1000 + z % _NUM_LOCATIONS
+        outer, inner = stack_end - 64, stack_end - 128
+        out += _packet(21, "4Q", outer, tid, timestamp, loc_id)
+        out += _packet(21, "4Q", inner, tid, timestamp + 10, loc_id)
+        if z % 8 == 0:
+            out += _packet(25, "QQq", inner, 0x100, z)
+        out += _packet(22, "QQ", inner, timestamp + 20)
+        out += _packet(22, "QQ", outer, timestamp + 30)
+        if z % 4 == 0:
+            out += _packet(33, "QQq", 1, timestamp + 30, z)
+        timestamp += 40
+    return out, timestamp
+
+
+def write_synthetic_trace(filename, size_bytes):
+    """Writes a synthetic binary trace of (at least) `size_bytes` bytes.
+
+    The same block of zones is repeated until the file reaches the requested size; only the
+    timestamps differ between blocks, so that the trace stays monotonic."""
+    with open(filename, "wb") as f:
+        f.write(_header())
+        written = f.tell()
+        timestamp = 1000
+        while written < size_bytes:
+            block, timestamp = _block(timestamp)
+            f.write(block)
+            written += len(block)
+
+
+def ensure_synthetic_trace(filename, size_bytes):
+    """Creates the synthetic trace, unless a file of the right size already exists."""
+    if not os.path.exists(filename) or os.stat(filename).st_size < size_bytes:
+        print(f"Generating {size_bytes // (1024 * 1024)} MB synthetic trace: {filename}")
+        write_synthetic_trace(filename, size_bytes)
+    return filename
+
+
+def _text_header():
+    """The lines that define the stacks, threads, locations and counters of a text trace."""
+    out = []
+    for i in range(_NUM_LOCATIONS):
+        out.append(f'LOCATION, {0x1000 + i}, zone_{i}, "function_{i}(int, int)", file_{i % 4}.cpp, {10 + i}\n')
+    for t in range(_NUM_THREADS):
+        stack_end = (t + 1) * _STACK_SIZE
+        out.append(f"STACK, {stack_end - _STACK_SIZE}, {stack_end}, Stack {t}\n")
+        out.append(f"THREAD, {t}, Thread {t}\n")
+    out.append("COUNTER_TRACK, 1, Counter\n")
+    return "".join(out)
+
+
+def _text_block(first_timestamp, num_zones=1000):
+    """The text version of `_block`."""
+    out = []
+    timestamp = first_timestamp
+    for z in range(num_zones):
+        tid = z % _NUM_THREADS
+        stack_end = (tid + 1) * _STACK_SIZE
+        loc_id = 0x1000 + z % _NUM_LOCATIONS
+        outer, inner = stack_end - 64, stack_end - 128
+        out.append(f"ZONE_START, {outer}, {tid}, {timestamp}, {loc_id}\n")
+        out.append(f"ZONE_START, {inner}, {tid}, {timestamp + 10}, {loc_id}\n")
+        if z % 8 == 0:
+            out.append(f"ZONE_PARAM, {inner}, param, {z}\n")
+        out.append(f"ZONE_END, {inner}, {timestamp + 20}\n")
+        out.append(f"ZONE_END, {outer}, {timestamp + 30}\n")
+        if z % 4 == 0:
+            out.append(f"COUNTER_VALUE, 1, {timestamp + 30}, {z}\n")
+        timestamp += 40
+    return "".join(out), timestamp
+
+
+def write_synthetic_text_trace(filename, size_bytes):
+    """Writes a synthetic text trace of (at least) `size_bytes` bytes; see `write_synthetic_trace`."""
+    with open(filename, "w") as f:
+        f.write(_text_header())
+        written = f.tell()
+        timestamp = 1000
+        while written < size_bytes:
+            block, timestamp = _text_block(timestamp)
+            f.write(block)
+            written += len(block)
+
+
+def ensure_synthetic_text_trace(filename, size_bytes):
+    """Creates the synthetic text trace, unless a file of the right size already exists."""
+    if not os.path.exists(filename) or os.stat(filename).st_size < size_bytes:
+        print(f"Generating {size_bytes // (1024 * 1024)} MB synthetic text trace: {filename}")
+        write_synthetic_text_trace(filename, size_bytes)
+    return filename
@@ -1,26 +1,115 @@
 #!env python3
 
 import argparse
+from functools import partial
 from lib.perfetto_writer import PerfettoWriter
-from lib.parse_bin_trace import parse_bin_trace
-from lib.emit_trace import emit_trace
+from lib.perfetto_direct_writer import DirectPerfettoWriter
+from lib.parse_bin_trace import parse_bin_trace_batches
+from lib.bin_trace_index import parse_bin_trace_window_batches
+from lib.emit_trace import emit_trace_batches
+from lib.merge_traces import emit_merged_trace_batches
+from lib.pipeline import run_pipeline
+from lib.reorder_trace import ReorderStats, reorder_parse_batches
+from lib.zone_sampling import parse_sampling_policy
 import cProfile
 
+_WRITERS = {"pb2": PerfettoWriter, "direct": DirectPerfettoWriter}
 
-def run(filename, out):
-    parse_items = parse_bin_trace(filename)
-    emit_dtos = emit_trace(parse_items)
-    writer = PerfettoWriter(out)
-    for obj in emit_dtos:
-        writer.add(obj)
-    writer.close()
+
+def _parse_batches(filename, follow, time_from, time_to, on_idle):
+    if time_from is not None or time_to is not None:
+        time_from = time_from if time_from is not None else 0
+        time_to = time_to if time_to is not None else 2**64 - 1
+        return parse_bin_trace_window_batches(filename, time_from, time_to)
+    return parse_bin_trace_batches(filename, follow=follow, on_idle=on_idle)
+
+
+def _reordered(parse_batches, reorder_delay_ns, reorder_items, reorder_stats):
+    """Adds the reorder window, if any, after the parsing; its stats go to `reorder_stats`."""
+    if reorder_delay_ns is None and reorder_items is None:
+        return parse_batches
+    stats = ReorderStats()
+    reorder_stats.append(stats)
+    return reorder_parse_batches(parse_batches, reorder_delay_ns, reorder_items, stats)
+
+
+def _location_sampling(text):
+    """Parses a LOCATION=POLICY argument; the location is a name, or a numeric location id."""
+    location, separator, spec = text.rpartition("=")
+    try:
+        if not separator or not location:
+            raise ValueError(f"Invalid location sampling '{text}'")
+        return (int(location) if location.isdigit() else location), parse_sampling_policy(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def run(
+    filenames,
+    out,
+    follow=False,
+    time_from=None,
+    time_to=None,
+    writer_class=PerfettoWriter,
+    delta_timestamps=False,
+    pipeline=False,
+    reorder_delay_ns=None,
+    reorder_items=None,
+    min_zone_duration_ns=0,
+    sampling=None,
+):
+    writer = writer_class(out, delta_timestamps=delta_timestamps)
+    reorder_stats = []
+    parse_streams = [
+        _reordered(
+            _parse_batches(filename, follow, time_from, time_to, writer.flush),
+            reorder_delay_ns,
+            reorder_items,
+            reorder_stats,
+        )
+        for filename in filenames
+    ]
+    try:
+        if len(filenames) > 1:
+            # One process per capture, merged on timestamp.
+            for batch in emit_merged_trace_batches(
+                parse_streams,
+                labels=filenames,
+                min_zone_duration_ns=min_zone_duration_ns,
+                sampling=sampling,
+            ):
+                writer.add_batch(batch)
+        elif pipeline:
+            emit_batches = partial(
+                emit_trace_batches, min_zone_duration_ns=min_zone_duration_ns, sampling=sampling
+            )
+            for stage in run_pipeline(parse_streams[0], emit_batches, writer):
+                print(stage)
+        else:
+            for batch in emit_trace_batches(
+                parse_streams[0], min_zone_duration_ns=min_zone_duration_ns, sampling=sampling
+            ):
+                writer.add_batch(batch)
+    except KeyboardInterrupt:
+        # Ctrl+C is how --follow stops: keep the part of the trace converted so far.
+        if not follow:
+            raise
+    finally:
+        writer.close()
+    for filename, stats in zip(filenames, reorder_stats):
+        print(f"{filename}: {stats}")
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Transform a binary trace to a perfetto trace."
     )
-    parser.add_argument("filename", type=str, help="The filename of the binary trace")
+    parser.add_argument(
+        "filenames",
+        type=str,
+        nargs="+",
+        help="The filename of the binary trace; several captures are merged into one trace",
+    )
     parser.add_argument(
         "-o",
         "--out",
@@ -28,9 +117,93 @@ def main():
         help="The output filename (Perfetto trace)",
         default="out.perfetto-trace",
     )
+    parser.add_argument(
+        "-f",
+        "--follow",
+        action="store_true",
+        help="Keep converting the binary trace while it is being written, until interrupted",
+    )
+    parser.add_argument(
+        "--from",
+        dest="time_from",
+        type=int,
+        help="Only convert the events from this timestamp (ns); uses a sidecar time index",
+    )
+    parser.add_argument(
+        "--to",
+        dest="time_to",
+        type=int,
+        help="Only convert the events up to this timestamp (ns); uses a sidecar time index",
+    )
+    parser.add_argument(
+        "--writer",
+        choices=["pb2", "direct"],
+        default="pb2",
+        help="How to encode the Perfetto trace: through the pb2 classes, or directly",
+    )
+    parser.add_argument(
+        "--delta-timestamps",
+        action="store_true",
+        help="Encode the timestamps as deltas on an incremental clock (smaller traces)",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run parsing, emitting and writing as concurrent stages, and report their utilization",
+    )
+    parser.add_argument(
+        "--reorder-window-us",
+        type=float,
+        help="Reorder the events on timestamp, holding each one until it is this old (us)",
+    )
+    parser.add_argument(
+        "--reorder-window-items",
+        type=int,
+        help="Reorder the events on timestamp, holding at most this many items",
+    )
+    parser.add_argument(
+        "--min-zone-duration-us",
+        type=float,
+        default=0.0,
+        help="Drop the zones shorter than this (us), with their nested zones",
+    )
+    parser.add_argument(
+        "--sample",
+        dest="sampling",
+        metavar="LOCATION=POLICY",
+        type=_location_sampling,
+        action="append",
+        default=[],
+        help="Only emit some zones of a location (name or id), counting them all on a counter "
+        "track; POLICY is every:N, rate:PER_SECOND or capped:SIZE (at most SIZE random zones "
+        "per second); can be repeated",
+    )
     args = parser.parse_args()
+    if args.pipeline and args.follow:
+        parser.error("--pipeline cannot be used with --follow")
+    if len(args.filenames) > 1 and (args.pipeline or args.follow):
+        parser.error("--pipeline and --follow take a single binary trace")
+    if (args.time_from is not None or args.time_to is not None) and args.follow:
+        parser.error("--from and --to cannot be used with --follow")
 
-    run(args.filename, args.out)
+    run(
+        args.filenames,
+        args.out,
+        args.follow,
+        args.time_from,
+        args.time_to,
+        _WRITERS[args.writer],
+        args.delta_timestamps,
+        args.pipeline,
+        (
+            int(args.reorder_window_us * 1000)
+            if args.reorder_window_us is not None
+            else None
+        ),
+        args.reorder_window_items,
+        int(args.min_zone_duration_us * 1000),
+        dict(args.sampling),
+    )
     # cProfile.run(f'run("{args.filename}", "{args.out}")')
 
 
@@ -0,0 +1,178 @@
+import asyncio
+import collections.abc
+import struct
+import lib.profiling_lite as pl
+from lib.profiling_lite import _ZONE_END, _ZONE_START, _ZONE_STEP, _local, _now
+from lib.profiling_lite import _pack_zone_end, _pack_zone_start
+
+# A zone without duration, in a single packing: zone start, then zone end.
+_pack_instant = struct.Struct("<B4QBQQ").pack_into
+_INSTANT_SIZE = 50
+
+# The instants marking the switches between the stack of a thread and the stack of a task.
+_RESUMED = pl.location("Task resumed", "asyncio", "asyncio", 0)
+_SUSPENDED = pl.location("Task suspended", "asyncio", "asyncio", 0)
+
+# The ends of the stacks of the finished tasks, reused by the next tasks.
+_free_stacks = []
+
+
+class _TaskCoroutine(collections.abc.Coroutine):
+    """Wraps the coroutine of a task, tracing each of its steps.
+
+    The task runs on a synthetic stack of its own: while a step runs, the zones of the thread go
+    to this stack. The whole coroutine is a zone on the stack; each resumption is an instant on
+    the stack of the task, and each suspension an instant on the stack of the thread, so the
+    trace shows which task each thread runs."""
+
+    __slots__ = ("_coro", "_loc_id", "_stack_end", "_ptr")
+
+    def __init__(self, coro):
+        self._coro = coro
+        code = getattr(coro, "cr_code", None)
+        if code is not None:
+            self._loc_id = pl._implicit_location_id(
+                code.co_qualname, code.co_qualname, code.co_filename, code.co_firstlineno
+            )
+        else:
+            name = type(coro).__qualname__
+            self._loc_id = pl._implicit_location_id(name, name, "asyncio", 0)
+        self._stack_end = None
+        self._ptr = None  # the stack pointer of the task while suspended; None if not running
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        if self._ptr is None:
+            self._coro.close()
+            return
+        # Like `coroutine.close()`, but traced as a step.
+        try:
+            self._step(self._coro.throw, GeneratorExit)
+        except (GeneratorExit, StopIteration):
+            return
+        raise RuntimeError("coroutine ignored GeneratorExit")
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def _step(self, method, *args):
+        state = _local.state
+        thread_ptr = state.ptr
+        ptr = self._ptr
+        if ptr is None:
+            # First step: take a stack, and start the zone of the coroutine on it.
+            try:
+                self._stack_end = _free_stacks.pop()  # atomic, unlike a check then a pop
+            except IndexError:
+                self._stack_end = pl._new_stack("Task")
+            ptr = self._stack_end - _ZONE_STEP
+            pos = state.pos
+            _pack_zone_start(state.buf, pos, _ZONE_START, ptr, state.tid, _now(), self._loc_id)
+            state.pos = pos + 33
+            state.ptr = ptr
+            task = asyncio.current_task()
+            if task is not None:
+                pl._pack_zone_param(state, pl._string_id("task"), task.get_name())
+        else:
+            timestamp = _now()
+            _pack_instant(
+                state.buf,
+                state.pos,
+                _ZONE_START,
+                ptr - _ZONE_STEP,
+                state.tid,
+                timestamp,
+                _RESUMED.id,
+                _ZONE_END,
+                ptr - _ZONE_STEP,
+                timestamp,
+            )
+            state.pos += _INSTANT_SIZE
+            state.ptr = ptr
+        if state.pos > state.limit:
+            state.next_chunk()
+
+        try:
+            result = method(*args)
+        except BaseException:
+            # The coroutine finished: end the zones left open on its stack (innermost first), then
+            # its own zone. Its stack is given back only if no zone was left open on it.
+            ptr = self._stack_end - _ZONE_STEP
+            timestamp = _now()
+            for open_ptr in range(state.ptr, ptr + 1, _ZONE_STEP):
+                pos = state.pos
+                _pack_zone_end(state.buf, pos, _ZONE_END, open_ptr, timestamp)
+                state.pos = pos + 17
+                if state.pos > state.limit:
+                    state.next_chunk()
+            if state.ptr == ptr:
+                _free_stacks.append(self._stack_end)
+            self._ptr = None
+            self._suspend(state, thread_ptr)
+            raise
+        self._ptr = state.ptr
+        self._suspend(state, thread_ptr)
+        return result
+
+    def _suspend(self, state, thread_ptr):
+        """Goes back to the stack of the thread, marking the switch with an instant."""
+        state.ptr = thread_ptr
+        timestamp = _now()
+        _pack_instant(
+            state.buf,
+            state.pos,
+            _ZONE_START,
+            thread_ptr - _ZONE_STEP,
+            state.tid,
+            timestamp,
+            _SUSPENDED.id,
+            _ZONE_END,
+            thread_ptr - _ZONE_STEP,
+            timestamp,
+        )
+        state.pos += _INSTANT_SIZE
+        if state.pos > state.limit:
+            state.next_chunk()
+
+
+class AsyncTracer:
+    """Traces the tasks of an asyncio event loop, on top of the current `profiling_lite` capture.
+
+    Each task gets a synthetic stack, holding a zone for its coroutine and the zones opened by
+    its code (including the ones left open across an `await`). The threads switch to the stack
+    of a task each time they resume it, and back to their own stack when it suspends.
+
+    Only the tasks created after `start()` are traced; the events are packed straight into the
+    buffer of the thread, like the other zones."""
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._previous_factory = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Starts tracing the new tasks of the loop (by default, the running loop)."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self._previous_factory = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._create_task)
+
+    def stop(self):
+        self._loop.set_task_factory(self._previous_factory)
+
+    def _create_task(self, loop, coro, **kwargs):
+        coro = _TaskCoroutine(coro)
+        if self._previous_factory is not None:
+            return self._previous_factory(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
@@ -0,0 +1,172 @@
+import random
+import sys
+import threading
+import lib.profiling_lite as pl
+from lib.profiling_lite import _ZONE_END, _ZONE_START, _ZONE_STEP, _local, _now
+from lib.profiling_lite import _pack_zone_end, _pack_zone_start
+
+# What the callbacks return to stop receiving the events of a code object.
+_DISABLE = sys.monitoring.DISABLE if hasattr(sys, "monitoring") else object()
+
+# Modules never traced: the tracers themselves (the asyncio tracer switches the stack pointer of
+# the thread inside its functions), and the code writing the capture.
+_ALWAYS_DENIED = ("lib.auto_tracer", "lib.async_tracer", "lib.profiling_lite", "threading")
+
+
+def _matches(module, prefixes):
+    """Checks if `module` is one of `prefixes`, or a submodule of one of them."""
+    return any(module == p or module.startswith(p + ".") for p in prefixes)
+
+
+class _Local(threading.local):
+    def __init__(self):
+        # The functions running on this thread, since tracing started, innermost last:
+        # (code, recorded, buffer, position of the zone start, timestamp of the zone start).
+        self.stack = []
+
+
+class AutoTracer:
+    """Traces all the Python functions as zones, using `sys.monitoring` (Python 3.12+).
+
+    Each function call (or resumption, for generators and coroutines) becomes a zone, written to
+    the current `profiling_lite` capture; each code object is written once, as a location.
+
+    Filters, to keep the overhead low:
+    - `allow`: if given, only the functions of these modules (and their submodules) are traced;
+    - `deny`: the functions of these modules are not traced; the events of filtered functions are
+      disabled in the interpreter, so they cost nothing after the first call;
+    - `min_duration_ns`: zones shorter than this are dropped (unless they have traced children);
+    - `sample_rate`: the fraction of the outermost calls traced, with all the calls they make."""
+
+    def __init__(self, allow=None, deny=(), min_duration_ns=0, sample_rate=1.0):
+        if not hasattr(sys, "monitoring"):
+            raise RuntimeError("Automatic tracing requires Python 3.12 or later")
+        assert 0.0 < sample_rate <= 1.0, f"Invalid sample rate {sample_rate}"
+        self._allow = tuple(allow) if allow else None
+        self._deny = tuple(deny) + _ALWAYS_DENIED
+        self._min_duration_ns = min_duration_ns
+        self._sample_rate = sample_rate
+        self._locations = {}  # code -> location id, or _DISABLE if the code is not traced
+        self._local = _Local()
+        self._tool_id = sys.monitoring.PROFILER_ID
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _callbacks(self):
+        """The callbacks for the monitored events: a zone starts when a function starts or
+        resumes, and ends when the function returns, yields or exits with an exception."""
+        events = sys.monitoring.events
+        return {
+            events.PY_START: self._on_start,
+            events.PY_RESUME: self._on_start,
+            events.PY_THROW: self._on_start,
+            events.PY_RETURN: self._on_end,
+            events.PY_YIELD: self._on_end,
+            events.PY_UNWIND: self._on_unwind,
+        }
+
+    def start(self):
+        """Starts tracing the functions, on all threads."""
+        monitoring = sys.monitoring
+        monitoring.use_tool_id(self._tool_id, "profiling-lite")
+        all_events = 0
+        for event, callback in self._callbacks().items():
+            monitoring.register_callback(self._tool_id, event, callback)
+            all_events |= event
+        # Enable the events disabled by a previous tracer, maybe with other filters.
+        monitoring.restart_events()
+        monitoring.set_events(self._tool_id, all_events)
+
+    def stop(self):
+        """Stops tracing; the zones still open on the calling thread are ended."""
+        monitoring = sys.monitoring
+        monitoring.set_events(self._tool_id, 0)
+        for event in self._callbacks():
+            monitoring.register_callback(self._tool_id, event, None)
+        monitoring.free_tool_id(self._tool_id)
+        stack = self._local.stack
+        while stack:
+            self._end_zone(stack.pop(), keep=True)
+
+    def _location_id(self, code):
+        """Returns the location id of `code`, or `_DISABLE` if its functions are not traced."""
+        # Called from the callback, so the caller of the callback is the traced function.
+        module = sys._getframe(2).f_globals.get("__name__", "")
+        if _matches(module, self._deny) or (self._allow and not _matches(module, self._allow)):
+            loc_id = _DISABLE
+        else:
+            loc_id = pl._implicit_location_id(
+                code.co_qualname, code.co_qualname, code.co_filename, code.co_firstlineno
+            )
+        self._locations[code] = loc_id
+        return loc_id
+
+    def _on_start(self, code, offset, exception=None):
+        loc_id = self._locations.get(code)
+        if loc_id is None:
+            loc_id = self._location_id(code)
+        if loc_id is _DISABLE:
+            # PY_THROW cannot be disabled.
+            return _DISABLE if exception is None else None
+
+        stack = self._local.stack
+        if stack:
+            recorded = stack[-1][1]
+        else:
+            recorded = self._sample_rate >= 1.0 or random.random() < self._sample_rate
+        if not recorded:
+            stack.append((code, False, None, 0, 0))
+            return
+
+        state = _local.state
+        ptr = state.ptr - _ZONE_STEP
+        state.ptr = ptr
+        timestamp = _now()
+        pos = state.pos
+        _pack_zone_start(state.buf, pos, _ZONE_START, ptr, state.tid, timestamp, loc_id)
+        state.pos = pos + 33
+        stack.append((code, True, state.buf, pos, timestamp))
+        if state.pos > state.limit:
+            state.next_chunk()
+
+    def _on_end(self, code, offset, retval):
+        stack = self._local.stack
+        if stack and stack[-1][0] is code:
+            self._end_zone(stack.pop())
+        elif self._locations.get(code) is _DISABLE:
+            return _DISABLE
+        # Otherwise, the function started before tracing.
+
+    def _on_unwind(self, code, offset, exception):
+        stack = self._local.stack
+        if stack and stack[-1][0] is code:
+            self._end_zone(stack.pop())
+
+    def _end_zone(self, entry, keep=False):
+        _, recorded, buf, start_pos, start_timestamp = entry
+        if not recorded:
+            return
+        state = _local.state
+        ptr = state.ptr
+        state.ptr = ptr + _ZONE_STEP
+        timestamp = _now()
+        if (
+            not keep
+            and timestamp - start_timestamp < self._min_duration_ns
+            and state.buf is buf
+            and state.chunk[1] <= start_pos
+            and state.pos == start_pos + 33
+        ):
+            # Too short, and nothing was written since the zone start: take it back.
+            state.pos = start_pos
+            return
+        pos = state.pos
+        _pack_zone_end(state.buf, pos, _ZONE_END, ptr, timestamp)
+        state.pos = pos + 17
+        if state.pos > state.limit:
+            state.next_chunk()
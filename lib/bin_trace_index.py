@@ -0,0 +1,194 @@
+from dataclasses import dataclass
+import mmap
+import os
+import struct
+from lib.parse_bin_trace import (
+    _decode_batch,
+    _decode_packets,
+    _scan_packet_offsets,
+    _batched,
+    _ensure_ordering_batches,
+    _packets_to_dtos_batches,
+    DEFAULT_BATCH_SIZE,
+    _EVENT_CLASSES,
+    _TIMESTAMP_CLASSES,
+    _ZONE_START_CLASSES,
+)
+
+_MAGIC = b"PLIX"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIQI")  # magic, version, size of the indexed trace, number of entries
+_ENTRY = struct.Struct("<QQQI")  # offset, min timestamp, max timestamp, size of definitions
+
+_NO_TIMESTAMP_MIN = 2**64 - 1
+_NO_TIMESTAMP_MAX = 0
+
+
+@dataclass
+class IndexEntry:
+    """Describes a block of consecutive packets in a binary trace."""
+
+    offset: int
+    min_timestamp: int
+    max_timestamp: int
+    definitions: bytes  # the raw definition packets (strings, locations, threads...) in the block
+
+
+@dataclass
+class TimeIndex:
+    """Index of a binary trace, allowing to seek to a timestamp range."""
+
+    trace_size: int
+    entries: list[IndexEntry]
+
+
+def index_filename_for(filename):
+    """The name of the sidecar index file for the binary trace `filename`."""
+    return filename + ".idx"
+
+
+def build_time_index(filename, packets_per_entry=100_000):
+    """Builds the time index of the binary trace `filename`.
+
+    Adds an entry every `packets_per_entry` packets."""
+    entries = []
+    with open(filename, "rb") as file:
+        trace_size = os.fstat(file.fileno()).st_size
+        if trace_size == 0:
+            return TimeIndex(trace_size=0, entries=[])
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                cursor = [0]
+                more = True
+                while more:
+                    start = cursor[0]
+                    packets = []
+                    more = _decode_batch(view, cursor, packets, packets_per_entry)
+                    if not packets:
+                        break
+                    entry = IndexEntry(start, _NO_TIMESTAMP_MIN, _NO_TIMESTAMP_MAX, bytearray())
+                    entries.append(entry)
+                    offsets, end = _scan_packet_offsets(view, start, cursor[0])
+                    offsets.append(end)
+                    for i, packet in enumerate(packets):
+                        if packet.__class__ in _TIMESTAMP_CLASSES:
+                            entry.min_timestamp = min(entry.min_timestamp, packet.timestamp)
+                            entry.max_timestamp = max(entry.max_timestamp, packet.timestamp)
+                        elif packet.__class__ not in _EVENT_CLASSES:
+                            entry.definitions += view[offsets[i] : offsets[i + 1]]
+    for entry in entries:
+        entry.definitions = bytes(entry.definitions)
+    return TimeIndex(trace_size=trace_size, entries=entries)
+
+
+def write_time_index(index: TimeIndex, index_filename):
+    """Writes the time index to `index_filename`."""
+    with open(index_filename, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, index.trace_size, len(index.entries)))
+        for e in index.entries:
+            size = len(e.definitions)
+            f.write(_ENTRY.pack(e.offset, e.min_timestamp, e.max_timestamp, size))
+            f.write(e.definitions)
+
+
+def read_time_index(index_filename):
+    """Reads a time index written by `write_time_index`."""
+    with open(index_filename, "rb") as f:
+        data = f.read()
+    magic, version, trace_size, num_entries = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"{index_filename} is not a valid time index")
+    offset = _HEADER.size
+    entries = []
+    for _ in range(num_entries):
+        entry_offset, min_ts, max_ts, size = _ENTRY.unpack_from(data, offset)
+        offset += _ENTRY.size
+        definitions = data[offset : offset + size]
+        entries.append(IndexEntry(entry_offset, min_ts, max_ts, definitions))
+        offset += size
+    return TimeIndex(trace_size=trace_size, entries=entries)
+
+
+def ensure_time_index(filename):
+    """Returns the time index of `filename`; builds the sidecar index file if missing or stale."""
+    index_filename = index_filename_for(filename)
+    trace_size = os.stat(filename).st_size
+    if os.path.exists(index_filename):
+        index = read_time_index(index_filename)
+        if index.trace_size == trace_size:
+            return index
+    print(f"Building time index: {index_filename}")
+    index = build_time_index(filename)
+    write_time_index(index, index_filename)
+    return index
+
+
+def _window_packets(view, index: TimeIndex, time_from, time_to):
+    """Yields the definitions known up to the window, followed by the event packets of the window."""
+    entries = index.entries
+    n = len(entries)
+    first = next((i for i in range(n) if entries[i].max_timestamp >= time_from), n)
+    # The blocks without timestamps (only definitions) don't end the window.
+    last = next(
+        (
+            i
+            for i in range(first, n)
+            if entries[i].min_timestamp != _NO_TIMESTAMP_MIN
+            and entries[i].min_timestamp > time_to
+        ),
+        n,
+    )
+    begin = entries[first].offset if first < n else len(view)
+    end = entries[last].offset if last < n else len(view)
+
+    definitions = b"".join(e.definitions for e in entries[:last])
+    yield from _decode_packets(definitions, [0])
+    for packet in _decode_packets(view, [begin], end):
+        if packet.__class__ in _EVENT_CLASSES:
+            yield packet
+
+
+def _window_filter(packets, time_from, time_to):
+    """Keeps the zones starting in the window, and the other timed events in the window."""
+    open_zones = set()  # stack pointers of the zones started in the window
+    for packet in packets:
+        cls = packet.__class__
+        if cls not in _EVENT_CLASSES:
+            yield packet
+        elif cls in _ZONE_START_CLASSES:
+            if time_from <= packet.timestamp <= time_to:
+                open_zones.add(packet.stack_ptr)
+                yield packet
+        elif not hasattr(packet, "stack_ptr"):
+            # Events outside zones, e.g. counter values.
+            if cls not in _TIMESTAMP_CLASSES or time_from <= packet.timestamp <= time_to:
+                yield packet
+        elif packet.stack_ptr in open_zones:
+            if cls in _TIMESTAMP_CLASSES:
+                open_zones.remove(packet.stack_ptr)  # the end of the zone
+            yield packet
+
+
+def parse_bin_trace_window(filename, time_from, time_to):
+    """Parses the part of the binary trace between the timestamps `time_from` and `time_to`.
+
+    Uses the sidecar time index to seek to the window, building it if needed."""
+    for batch in parse_bin_trace_window_batches(filename, time_from, time_to):
+        yield from batch
+
+
+def parse_bin_trace_window_batches(
+    filename, time_from, time_to, batch_size=DEFAULT_BATCH_SIZE
+):
+    """Batched version of `parse_bin_trace_window`, yielding lists of parse DTOs."""
+    index = ensure_time_index(filename)
+    if index.trace_size == 0:
+        return
+    with open(filename, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                packets = _window_packets(view, index, time_from, time_to)
+                packets = _window_filter(packets, time_from, time_to)
+                batches = _batched(packets, batch_size)
+                batches = _ensure_ordering_batches(batches)
+                yield from _packets_to_dtos_batches(batches)
@@ -0,0 +1,164 @@
+from functools import partial
+import struct
+import lib.parse_dto as dto
+import lib.registry as registry
+from lib.parse_bin_trace import PacketType
+from lib.parse_text_trace import parse_text_trace_batches
+
+
+def _packer(packet_type: PacketType):
+    """Returns the function packing the fixed-size fields of a packet, after its type byte."""
+    layout = registry.PACKET_KINDS[packet_type.value].layout
+    return partial(struct.Struct("<B" + layout.format.lstrip("<")).pack, packet_type.value)
+
+
+class BinTraceWriter:
+    """Writes parse DTOs as a binary trace, in the layout read by `parse_bin_trace`.
+
+    Strings referenced by id (location names, parameter names, categories) are written as
+    `static_string` packets before their first use; their ids are given in order of first use,
+    so the same input always produces the same file."""
+
+    def __init__(self, filename):
+        self._file = open(filename, "wb")
+        self._string_ids = {}
+        self._buffer = bytearray(_packer(PacketType.init)(b"PROF", 1))
+        self._handlers = {
+            dto.Stack: self._add_stack,
+            dto.Thread: self._add_thread,
+            dto.Location: self._add_location,
+            dto.ZoneStart: self._add_zone_start,
+            dto.ZoneEnd: self._add_zone_end,
+            dto.ZoneName: self._add_zone_name,
+            dto.ZoneParam: self._add_zone_param,
+            dto.ZoneFlow: self._add_zone_flow,
+            dto.ZoneFlowTerminate: self._add_zone_flow_terminate,
+            dto.ZoneCategory: self._add_zone_category,
+            dto.CounterTrack: self._add_counter_track,
+            dto.CounterValue: self._add_counter_value,
+        }
+
+    def add(self, item):
+        self.add_batch([item])
+
+    def add_batch(self, items):
+        """Adds a list of parse DTOs to the trace."""
+        handlers = self._handlers
+        for item in items:
+            handler = handlers.get(type(item))
+            if handler is None:
+                raise ValueError(f"Unknown parse DTO type {type(item).__name__}")
+            handler(item)
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self):
+        self._file.write(self._buffer)
+        self._buffer.clear()
+        self._file.close()
+
+    def _add_string_packet(self, pack, *fields, text):
+        data = text.encode("utf-8")
+        self._buffer += pack(*fields, len(data))
+        self._buffer += data
+
+    def _string_id(self, text):
+        """Returns the id of `text`, writing its `static_string` packet on first use."""
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = self._string_ids[text] = len(self._string_ids) + 1
+            self._add_string_packet(_PACK_STATIC_STRING, string_id, text=text)
+        return string_id
+
+    def _add_stack(self, item: dto.Stack):
+        self._add_string_packet(_PACK_STACK, item.begin, item.end, text=item.name)
+
+    def _add_thread(self, item: dto.Thread):
+        self._add_string_packet(_PACK_THREAD_NAME, item.tid, text=item.thread_name)
+
+    def _add_location(self, item: dto.Location):
+        name_id = self._string_id(item.name)
+        function_id = self._string_id(item.function_name)
+        file_id = self._string_id(item.file_name)
+        self._buffer += _PACK_LOCATION(
+            item.locid, name_id, function_id, file_id, item.line_number
+        )
+
+    def _add_zone_start(self, item: dto.ZoneStart):
+        self._buffer += _PACK_ZONE_START(item.stack_ptr, item.tid, item.timestamp, item.locid)
+
+    def _add_zone_end(self, item: dto.ZoneEnd):
+        self._buffer += _PACK_ZONE_END(item.stack_ptr, item.timestamp)
+
+    def _add_zone_name(self, item: dto.ZoneName):
+        self._add_string_packet(_PACK_ZONE_DYNAMIC_NAME, item.stack_ptr, text=item.name)
+
+    def _add_zone_param(self, item: dto.ZoneParam):
+        name_id = self._string_id(item.name)
+        value = item.value
+        if isinstance(value, bool):
+            self._buffer += _PACK_ZONE_PARAM_BOOL(item.stack_ptr, name_id, value)
+        elif isinstance(value, int):
+            pack = _PACK_ZONE_PARAM_INT if value < 2**63 else _PACK_ZONE_PARAM_UINT
+            self._buffer += pack(item.stack_ptr, name_id, value)
+        elif isinstance(value, float):
+            self._buffer += _PACK_ZONE_PARAM_DOUBLE(item.stack_ptr, name_id, value)
+        else:
+            self._add_string_packet(
+                _PACK_ZONE_PARAM_STRING, item.stack_ptr, name_id, text=str(value)
+            )
+
+    def _add_zone_flow(self, item: dto.ZoneFlow):
+        self._buffer += _PACK_ZONE_FLOW(item.stack_ptr, item.flowid)
+
+    def _add_zone_flow_terminate(self, item: dto.ZoneFlowTerminate):
+        self._buffer += _PACK_ZONE_FLOW_TERMINATE(item.stack_ptr, item.flowid)
+
+    def _add_zone_category(self, item: dto.ZoneCategory):
+        category_id = self._string_id(item.category_name)
+        self._buffer += _PACK_ZONE_CATEGORY(item.stack_ptr, category_id)
+
+    def _add_counter_track(self, item: dto.CounterTrack):
+        self._add_string_packet(_PACK_COUNTER_TRACK, item.tid, text=item.name)
+
+    def _add_counter_value(self, item: dto.CounterValue):
+        if isinstance(item.value, int) and -(2**63) <= item.value < 2**63:
+            self._buffer += _PACK_COUNTER_VALUE_INT(item.tid, item.timestamp, item.value)
+        else:
+            self._buffer += _PACK_COUNTER_VALUE_DOUBLE(item.tid, item.timestamp, item.value)
+
+
+_PACK_STATIC_STRING = _packer(PacketType.static_string)
+_PACK_LOCATION = _packer(PacketType.location)
+_PACK_STACK = _packer(PacketType.stack)
+_PACK_THREAD_NAME = _packer(PacketType.thread_name)
+_PACK_ZONE_START = _packer(PacketType.zone_start)
+_PACK_ZONE_END = _packer(PacketType.zone_end)
+_PACK_ZONE_DYNAMIC_NAME = _packer(PacketType.zone_dynamic_name)
+_PACK_ZONE_PARAM_BOOL = _packer(PacketType.zone_param_bool)
+_PACK_ZONE_PARAM_INT = _packer(PacketType.zone_param_int)
+_PACK_ZONE_PARAM_UINT = _packer(PacketType.zone_param_uint)
+_PACK_ZONE_PARAM_DOUBLE = _packer(PacketType.zone_param_double)
+_PACK_ZONE_PARAM_STRING = _packer(PacketType.zone_param_string)
+_PACK_ZONE_FLOW = _packer(PacketType.zone_flow)
+_PACK_ZONE_FLOW_TERMINATE = _packer(PacketType.zone_flow_terminate)
+_PACK_ZONE_CATEGORY = _packer(PacketType.zone_category)
+_PACK_COUNTER_TRACK = _packer(PacketType.counter_track)
+_PACK_COUNTER_VALUE_INT = _packer(PacketType.counter_value_int)
+_PACK_COUNTER_VALUE_DOUBLE = _packer(PacketType.counter_value_double)
+
+
+def text_to_bin(text_filename, bin_filename, jobs=1):
+    """Converts the text trace `text_filename` into the binary trace `bin_filename`.
+
+    The text trace is streamed; with `jobs` > 1, it is parsed in `jobs` processes.
+    Returns the number of parse DTOs written."""
+    writer = BinTraceWriter(bin_filename)
+    count = 0
+    try:
+        for batch in parse_text_trace_batches(text_filename, jobs):
+            writer.add_batch(batch)
+            count += len(batch)
+    finally:
+        writer.close()
+    return count
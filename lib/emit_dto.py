@@ -1,7 +1,7 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class ProcessTrack:
     """Describes a process track in a profiling trace."""
 
@@ -10,7 +10,7 @@ class ProcessTrack:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Thread:
     """Describes a thread in a profiling trace."""
 
@@ -20,7 +20,7 @@ class Thread:
     thread_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class CounterTrack:
     """Describes a track for counter."""
 
@@ -29,7 +29,7 @@ class CounterTrack:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Location:
     """Describes a location in the source code."""
 
@@ -39,7 +39,7 @@ class Location:
     line_number: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneInstant:
     """Describes an instant execution zone."""
 
@@ -47,13 +47,14 @@ class ZoneInstant:
     timestamp: int
     loc: Location
     name: str
-    params: dict = field(default_factory=dict)
-    flows: list[int] = field(default_factory=list)
-    flows_terminating: list[int] = field(default_factory=list)
-    categories: list[str] = field(default_factory=list)
+    # Created when the first param, flow or category is attached.
+    params: dict | None = None
+    flows: list[int] | None = None
+    flows_terminating: list[int] | None = None
+    categories: list[str] | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneStart:
     """Describes the start of an execution zone."""
 
@@ -61,13 +62,14 @@ class ZoneStart:
     timestamp: int
     loc: Location
     name: str
-    params: dict = field(default_factory=dict)
-    flows: list[int] = field(default_factory=list)
-    flows_terminating: list[int] = field(default_factory=list)
-    categories: list[str] = field(default_factory=list)
+    # Created when the first param, flow or category is attached.
+    params: dict | None = None
+    flows: list[int] | None = None
+    flows_terminating: list[int] | None = None
+    categories: list[str] | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneEnd:
     """Describes the start of an execution zone."""
 
@@ -75,7 +77,7 @@ class ZoneEnd:
     timestamp: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneParam:
     """Describes a parameter for a zone."""
 
@@ -83,7 +85,7 @@ class ZoneParam:
     value: str
 
 
-@dataclass
+@dataclass(slots=True)
 class CounterValue:
     """Describes a value for a counter."""
 
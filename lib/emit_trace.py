@@ -1,120 +1,243 @@
 import bisect
 import lib.parse_dto as parse_dto
 import lib.emit_dto as emit_dto
+import lib.registry as registry
+
+
+def emit_trace(parse_items, min_zone_duration_ns=0, sampling=None):
+    """Generates the emit DTO objects for the given parse items.
+
+    With `min_zone_duration_ns`, the zones shorter than this are dropped, with their nested
+    zones; instant zones and zones with flows are kept.
+
+    `sampling` maps locations (by id, or by name) to sampling policies (see `zone_sampling`):
+    only the zones kept by the policy of their location are emitted, with their nested zones.
+    The number of zones of each sampled location is shown on a counter track."""
+    for batch in emit_trace_batches(
+        ([item] for item in parse_items),
+        min_zone_duration_ns=min_zone_duration_ns,
+        sampling=sampling,
+    ):
+        yield from batch
+
+
+def emit_trace_batches(
+    parse_batches, namespace=0, label=None, min_zone_duration_ns=0, sampling=None
+):
+    """Batched version of `emit_trace`: consumes lists of parse items, yields lists of emit DTOs.
+
+    When merging several captures into one trace, each capture is emitted with its own
+    `namespace` (0, 1, ...): its tracks, processes and locations get ids that don't collide with
+    the ones of the other captures. `label` is prefixed to the names of its process tracks."""
+    emitter = _TraceEmitter(namespace, label, min_zone_duration_ns, sampling)
+    out = []
+    emitter.start(out)
+    for batch in parse_batches:
+        emitter.add_items(batch, out)
+        if out:
+            yield out
+            out = []
+    emitter.finish(out)
+    if out:
+        yield out
+
+
+class _TraceEmitter:
+    """Converts parse items into emit DTOs, appending them to output lists."""
+
+    def __init__(self, namespace=0, label=None, min_zone_duration_ns=0, sampling=None):
+        self._track_emitter = _TrackEmitter(namespace, label)
+        # Location ids are only used as keys; they are unique among captures above 64 bits.
+        self._locid_base = namespace << 64
+        self._stacks = _Stacks(self._track_emitter, min_zone_duration_ns)
+        self._threads = {}  # tid -> _ThreadData
+        self._counter_tracks = {}  # tid -> track_uuid
+        self._locations = {}  # locid -> (emit_dto.Location, name)
+        self._open_zones = {}  # stack_ptr -> _StackData
+        self._stats = _StacksStats(self._track_emitter)
+        self._sampling = sampling or {}  # locid or location name -> sampling policy
+        self._sampled_locations = {}  # locid -> _SampledLocation
+
+    def start(self, out):
+        """Emits the two process tracks."""
+        self._track_emitter.emit_process_tracks(out)
+
+    def add_items(self, items, out):
+        """Processes the parse `items`, appending the resulting emit DTOs to `out`."""
+        handlers = registry.EMIT_HANDLERS
+        for item in items:
+            handler = handlers.get(type(item))
+            if handler is None:
+                raise ValueError(f"Unknown object {item}")
+            handler(self, item, out)
+
+    def _on_stack(self, item: parse_dto.Stack, out):
+        self._stacks.add_stack(end=item.end, begin=item.begin, name=item.name)
+        self._stacks.emit_pending_tracks(out)
+
+    def _on_thread(self, item: parse_dto.Thread, out):
+        threads = self._threads
+        if item.tid not in threads:
+            uuid = self._track_emitter.next_uuid()
+            threads[item.tid] = _ThreadData(uuid)
+        out.append(
+            self._track_emitter.thread_mapping_track(threads[item.tid].uuid, item.thread_name)
+        )
 
+    def _on_location(self, item: parse_dto.Location, out):
+        loc = emit_dto.Location(
+            locid=self._locid_base + item.locid,
+            function_name=item.function_name,
+            file_name=item.file_name,
+            line_number=item.line_number,
+        )
+        self._locations[item.locid] = (loc, item.name)
+        out.append(loc)
+
+        if self._sampling:
+            policy = self._sampling.get(item.locid) or self._sampling.get(item.name)
+            if policy:
+                sampled = _SampledLocation(policy, self._track_emitter.next_uuid())
+                self._sampled_locations[item.locid] = sampled
+                out.append(
+                    emit_dto.CounterTrack(
+                        track_uuid=sampled.track_uuid,
+                        parent_track=self._track_emitter.stacks_track_uuid,
+                        name=f"{item.name}: zones per ms",
+                    )
+                )
+
+    def _on_zone_start(self, item: parse_dto.ZoneStart, out):
+        # If this zone announces a new thread, ensure we add the thread.
+        thread = self._threads.get(item.tid)
+        if thread is None:
+            uuid = self._track_emitter.next_uuid()
+            out.append(self._track_emitter.thread_mapping_track(uuid, "Unknown"))
+            thread = self._threads[item.tid] = _ThreadData(uuid)
+
+        # Check the stack and the thread of the zone
+        stack = thread.last_stack()
+        if not stack or not stack.contains(item.stack_ptr):
+            stack = self._stacks.stack_for_ptr(item.stack_ptr)
+            self._stacks.emit_pending_tracks(out)
+        thread.mark_stack(stack, item.timestamp, out)
+
+        if self._sampled_locations and self._drop_zone(item, stack, out):
+            return
+
+        # Add the zone to the stack.
+        loc_pair = self._locations[item.locid]
+        stack.start_zone(item.stack_ptr, item.timestamp, loc_pair[0], loc_pair[1], out)
+        self._open_zones[item.stack_ptr] = stack
+
+        # Update the stats
+        self._stats.on_start_zone(stack, item.stack_ptr, item.timestamp)
+        self._stats.emit(out)
+
+    def _drop_zone(self, item: parse_dto.ZoneStart, stack, out):
+        """Counts the zone if its location is sampled; returns True if the zone is dropped."""
+        sampled = self._sampled_locations.get(item.locid)
+        if sampled is not None:
+            sampled.count(item.timestamp, out)
+        dropped = stack.dropped_zones
+        if dropped.depth or (sampled is not None and not sampled.keep(item.timestamp)):
+            # The zones nested in a dropped zone are dropped too.
+            dropped.depth += 1
+            self._open_zones[item.stack_ptr] = dropped
+            return True
+        return False
+
+    def _on_zone_end(self, item: parse_dto.ZoneEnd, out):
+        stack = self._open_zones.pop(item.stack_ptr)
+        if stack.__class__ is _DroppedZones:
+            stack.depth -= 1
+            return
+        stack.end_zone(item.timestamp, out)
+        self._stats.on_end_zone(stack, item.stack_ptr, item.timestamp)
+        self._stats.emit(out)
+
+    def _on_zone_name(self, item: parse_dto.ZoneName, out):
+        dto = self._open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
+        if dto:
+            dto.name = item.name
+
+    def _on_zone_flow(self, item: parse_dto.ZoneFlow, out):
+        dto = self._open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
+        if dto:
+            if dto.flows is None:
+                dto.flows = []
+            dto.flows.append(item.flowid)
+
+    def _on_zone_flow_terminate(self, item: parse_dto.ZoneFlowTerminate, out):
+        dto = self._open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
+        if dto:
+            if dto.flows_terminating is None:
+                dto.flows_terminating = []
+            dto.flows_terminating.append(item.flowid)
+
+    def _on_zone_category(self, item: parse_dto.ZoneCategory, out):
+        dto = self._open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
+        if dto:
+            if dto.categories is None:
+                dto.categories = []
+            dto.categories.append(item.category_name)
+
+    def _on_zone_param(self, item: parse_dto.ZoneParam, out):
+        dto = self._open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
+        if dto:
+            value, name = adjust_parameter(item.value, item.name)
+            if dto.params is None:
+                dto.params = {}
+            dto.params[name] = value
+
+    def _counter_track_uuid(self, tid):
+        uuid = self._counter_tracks.get(tid)
+        if uuid is None:
+            uuid = self._counter_tracks[tid] = self._track_emitter.next_uuid()
+        return uuid
+
+    def _on_counter_track(self, item: parse_dto.CounterTrack, out):
+        uuid = self._counter_track_uuid(item.tid)
+        out.append(self._track_emitter.counter_track(uuid, item.name))
+
+    def _on_counter_value(self, item: parse_dto.CounterValue, out):
+        value = emit_dto.CounterValue(
+            track_uuid=self._counter_track_uuid(item.tid),
+            timestamp=item.timestamp,
+            value=item.value,
+        )
+        out.append(value)
+
+    def finish(self, out):
+        """Emits the pending objects, after all the parse items were processed."""
+        # If we have open zones, make sure we emit at least their start.
+        for stack in set(self._open_zones.values()):
+            stack.pending_zone_dto(out)
+
+        # Close the thread mapping tracks
+        for t in self._threads.values():
+            t.close(out)
+
+        for sampled in self._sampled_locations.values():
+            sampled.finish(out)
+
+
+for _dto_class, _handler in (
+    (parse_dto.Stack, _TraceEmitter._on_stack),
+    (parse_dto.Thread, _TraceEmitter._on_thread),
+    (parse_dto.Location, _TraceEmitter._on_location),
+    (parse_dto.ZoneStart, _TraceEmitter._on_zone_start),
+    (parse_dto.ZoneEnd, _TraceEmitter._on_zone_end),
+    (parse_dto.ZoneName, _TraceEmitter._on_zone_name),
+    (parse_dto.ZoneFlow, _TraceEmitter._on_zone_flow),
+    (parse_dto.ZoneFlowTerminate, _TraceEmitter._on_zone_flow_terminate),
+    (parse_dto.ZoneCategory, _TraceEmitter._on_zone_category),
+    (parse_dto.ZoneParam, _TraceEmitter._on_zone_param),
+    (parse_dto.CounterTrack, _TraceEmitter._on_counter_track),
+    (parse_dto.CounterValue, _TraceEmitter._on_counter_value),
+):
+    registry.register_emit_handler(_dto_class, _handler)
 
-def emit_trace(parse_items):
-    """Generates the emit DTO objects for the given parse items."""
-
-    # Emit the two process tracks
-    track_emitter = _TrackEmitter()
-    yield from track_emitter.emit_process_tracks()
-
-    stacks = _Stacks(track_emitter)
-    threads = {}  # tid -> _ThreadData
-    counter_tracks = {}  # tid -> track_uuid
-    locations = {}  # locid -> (emit_dto.Location, name)
-    open_zones = {}  # stack_ptr -> _StackData
-    stats = _StacksStats(track_emitter)
-
-    for item in parse_items:
-        if isinstance(item, parse_dto.Stack):
-            stacks.add_stack(end=item.end, begin=item.begin, name=item.name)
-            yield from stacks.emit_pending_tracks()
-        elif isinstance(item, parse_dto.Thread):
-            if item.tid not in threads:
-                uuid = track_emitter.next_uuid()
-                threads[item.tid] = _ThreadData(uuid)
-            yield track_emitter.thread_mapping_track(threads[item.tid].uuid, item.tid, item.thread_name)
-
-        elif isinstance(item, parse_dto.Location):
-            loc = emit_dto.Location(
-                locid=item.locid,
-                function_name=item.function_name,
-                file_name=item.file_name,
-                line_number=item.line_number,
-            )
-            locations[item.locid] = (loc, item.name)
-            yield loc
-
-        elif isinstance(item, parse_dto.ZoneStart):
-            # If this zone announces a new thread, ensure we add the thread.
-            if item.tid not in threads:
-                uuid = track_emitter.next_uuid()
-                yield track_emitter.thread_mapping_track(uuid, item.tid, "Unknown")
-                threads[item.tid] = _ThreadData(uuid)
-
-            # Check the stack and the thread of the zone
-            thread = threads[item.tid]
-            stack = thread.last_stack()
-            if not stack or not stack.contains(item.stack_ptr):
-                stack = stacks.stack_for_ptr(item.stack_ptr)
-                yield from stacks.emit_pending_tracks()
-            yield from thread.mark_stack(stack, item.timestamp)
-
-            # Add the zone to the stack.
-            loc_pair = locations[item.locid]
-            yield from stack.start_zone(
-                item.stack_ptr, item.timestamp, loc_pair[0], loc_pair[1]
-            )
-            open_zones[item.stack_ptr] = stack
-
-            # Update the stats
-            stats.on_start_zone(stack, item.stack_ptr, item.timestamp)
-            yield from stats.emit()
-
-        elif isinstance(item, parse_dto.ZoneEnd):
-            stack = open_zones.pop(item.stack_ptr)
-            yield from stack.end_zone(item.timestamp)
-            stats.on_end_zone(stack, item.stack_ptr, item.timestamp)
-            yield from stats.emit()
-        elif isinstance(item, parse_dto.ZoneName):
-            dto = open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
-            if dto:
-                dto.name = item.name
-        elif isinstance(item, parse_dto.ZoneFlow):
-            dto = open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
-            if dto:
-                dto.flows.append(item.flowid)
-        elif isinstance(item, parse_dto.ZoneFlowTerminate):
-            dto = open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
-            if dto:
-                dto.flows_terminating.append(item.flowid)
-        elif isinstance(item, parse_dto.ZoneCategory):
-            dto = open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
-            if dto:
-                dto.categories.append(item.category_name)
-        elif isinstance(item, parse_dto.ZoneParam):
-            dto = open_zones[item.stack_ptr].open_zone_dto(item.stack_ptr)
-            if dto:
-                value, name = adjust_parameter(item.value, item.name)
-                dto.params[name] = value
-
-        elif isinstance(item, parse_dto.CounterTrack):
-            if item.tid not in counter_tracks:
-                uuid = track_emitter.next_uuid()
-                counter_tracks[item.tid] = uuid
-            yield track_emitter.counter_track(counter_tracks[item.tid], item.name)
-        elif isinstance(item, parse_dto.CounterValue):
-            if item.tid not in counter_tracks:
-                uuid = track_emitter.next_uuid()
-                counter_tracks[item.tid] = uuid
-            yield emit_dto.CounterValue(
-                track_uuid=counter_tracks[item.tid],
-                timestamp=item.timestamp,
-                value=item.value,
-            )
-
-        else:
-            raise ValueError(f"Unknown object {item}")
-
-    # If we have open zones, make sure we emit at least their start.
-    for stack in set(open_zones.values()):
-        yield from stack.pending_zone_dto()
-
-    # Close the thread mapping tracks
-    for t in threads.values():
-        yield from t.close()
 
 def adjust_parameter(value, param_name):
     """Adjust the value of the parameter to convert to the right type."""
@@ -124,40 +247,69 @@ def adjust_parameter(value, param_name):
         return value, param_name
 
 
+# The number of thread ids of each capture; the thread ids of 128 captures fit in 31 bits.
+_TIDS_PER_NAMESPACE = 1 << 24
+
+
 class _TrackEmitter:
-    def __init__(self):
-        self._track_uuid_gen = _track_id_gen()
+    def __init__(self, namespace=0, label=None):
+        # Each capture has two processes, 2^32 track uuids, and its own range of thread ids.
+        assert 0 <= namespace < 2**31 // _TIDS_PER_NAMESPACE, f"Invalid namespace {namespace}"
+        self._uuid_base = namespace << 32
+        self._tid_base = namespace * _TIDS_PER_NAMESPACE
+        self._track_uuid_gen = _track_id_gen(self._uuid_base)
+        self._stacks_pid = 2 * namespace
+        self._thread_mapping_pid = 2 * namespace + 1
+        self._label = label
         self.stacks_track_uuid = next(self._track_uuid_gen)
         self.thread_mapping_track_uuid = next(self._track_uuid_gen)
 
-    def emit_process_tracks(self):
+    def emit_process_tracks(self, out):
         """Emits the process tracks for the entire capture."""
-        yield emit_dto.ProcessTrack(
-            track_uuid=self.stacks_track_uuid, pid=0, name="Stacks and zones"
+        prefix = f"{self._label}: " if self._label else ""
+        out.append(
+            emit_dto.ProcessTrack(
+                track_uuid=self.stacks_track_uuid,
+                pid=self._stacks_pid,
+                name=f"{prefix}Stacks and zones",
+            )
         )
-        yield emit_dto.ProcessTrack(
-            track_uuid=self.thread_mapping_track_uuid, pid=1, name="Threads mapping"
+        out.append(
+            emit_dto.ProcessTrack(
+                track_uuid=self.thread_mapping_track_uuid,
+                pid=self._thread_mapping_pid,
+                name=f"{prefix}Threads mapping",
+            )
         )
 
     def next_uuid(self):
         """Generates the next track uuid."""
         return next(self._track_uuid_gen)
 
+    def _tid(self, uuid):
+        """The thread id of the track `uuid`, unique among the tracks of all the captures."""
+        index = uuid - self._uuid_base
+        assert index < _TIDS_PER_NAMESPACE, f"Too many thread tracks ({index})"
+        return self._tid_base + index
+
     def stack_track(self, uuid, name):
         """Emits a track for representing zones over stacks."""
         return emit_dto.Thread(
             track_uuid=uuid,
-            tid=uuid,
-            pid=0,
+            tid=self._tid(uuid),
+            pid=self._stacks_pid,
             thread_name=name,
         )
 
-    def thread_mapping_track(self, uuid, tid, name):
-        """Emits a thread-mapping track."""
+    def thread_mapping_track(self, uuid, name):
+        """Emits a thread-mapping track.
+
+        Its thread id is derived from `uuid`, like for the stack tracks: the thread ids of the
+        capture could collide with the ones of the other captures."""
         return emit_dto.Thread(
             track_uuid=uuid,
-            tid=tid,
-            pid=1,
+            tid=self._tid(uuid),
+            pid=self._thread_mapping_pid,
             thread_name=name,
         )
 
@@ -173,9 +325,10 @@ class _TrackEmitter:
 class _Stacks:
     """Keeps track of the stacks we are using in this trace."""
 
-    def __init__(self, track_emitter: _TrackEmitter):
+    def __init__(self, track_emitter: _TrackEmitter, min_zone_duration=0):
         self._stacks = []
         self._track_emitter = track_emitter
+        self._min_zone_duration = min_zone_duration
         self._to_emit = []
 
     def add_stack(self, end, begin=0, name=None):
@@ -204,24 +357,32 @@ class _Stacks:
         else:
             return None
 
-    def emit_pending_tracks(self):
-        """Yields the pending tracks objects."""
-        yield from self._to_emit
-        self._to_emit = []
+    def emit_pending_tracks(self, out):
+        """Emits the pending tracks objects."""
+        if self._to_emit:
+            out.extend(self._to_emit)
+            self._to_emit = []
 
     def _add_stack(self, end, begin=0, name=None):
         """Adds a stack to the list of stacks."""
         uuid = self._track_emitter.next_uuid()
-        stack = _StackData(uuid=uuid, end=end, begin=begin, name=name)
+        stack = _StackData(
+            uuid=uuid, end=end, begin=begin, name=name, min_zone_duration=self._min_zone_duration
+        )
         bisect.insort_left(self._stacks, stack, key=lambda x: x.end)
         self._to_emit.append(self._track_emitter.stack_track(uuid, stack.name))
         return stack
 
 
 class _StackData:
-    """Describes a stack, the zones added to it and its usage."""
+    """Describes a stack, the zones added to it and its usage.
 
-    def __init__(self, uuid, end, begin=0, name=None):
+    With a `min_zone_duration`, the zones are held until they are known to be long enough: the
+    zones ending sooner are dropped, with their nested zones. A zone is released as soon as an
+    event of the stack comes `min_zone_duration` after its start, so the held zones only span
+    the last `min_zone_duration` of the stack."""
+
+    def __init__(self, uuid, end, begin=0, name=None, min_zone_duration=0):
         assert begin < end
         end = _round_up_to_page_size(end)
         self.end = end
@@ -235,16 +396,24 @@ class _StackData:
         self._open_zone_ptr = None
         self._open_zone_dto = None
         self._open_zones_count = 0
+        self._min_zone_duration = min_zone_duration
+        # The innermost open zones that may still be too short, outermost first: their start, and
+        # the emit DTOs of their nested zones.
+        self._held = []
+        self.dropped_zones = _DroppedZones()
 
     def contains(self, ptr):
         """Check if the stack contains the given pointer."""
         lo = self._begin if self._begin > 0 else self._lowest_seen - 10 * 1024
         return ptr >= lo and ptr <= self.end
 
-    def start_zone(self, ptr, timestamp, loc, loc_name):
+    def start_zone(self, ptr, timestamp, loc, loc_name, out):
         """Starts a zone in this stack."""
+        if self._min_zone_duration:
+            self._start_held_zone(ptr, timestamp, loc, loc_name, out)
+            return
         if self._open_zone_dto:
-            yield self._open_zone_dto
+            out.append(self._open_zone_dto)
 
         assert self.contains(ptr)
         self._open_zone_ptr = ptr
@@ -254,14 +423,22 @@ class _StackData:
         self._mark_usage(ptr, timestamp)
         self._open_zones_count += 1
 
-    def end_zone(self, timestamp):
+    def end_zone(self, timestamp, out):
         """Ends the current zone in this stack."""
-        if self._open_zone_dto:
-            yield self._open_zone_dto
+        if self._min_zone_duration:
+            self._end_held_zone(timestamp, out)
+            return
+        self._open_zones_count -= 1
+        start = self._open_zone_dto
+        if start:
             self._open_zone_dto = None
             self._open_zone_ptr = None
-        yield emit_dto.ZoneEnd(track_uuid=self.uuid, timestamp=timestamp)
-        self._open_zones_count -= 1
+            # A zone without nested zones, ending when it starts, is an instant zone.
+            if start.timestamp == timestamp:
+                out.append(_to_instant(start))
+                return
+            out.append(start)
+        out.append(emit_dto.ZoneEnd(track_uuid=self.uuid, timestamp=timestamp))
 
     def open_zone_dto(self, ptr):
         """Returns the DTO object for the open zone, if the open zone is for `ptr`."""
@@ -269,12 +446,60 @@ class _StackData:
             return self._open_zone_dto
         return None
 
-    def pending_zone_dto(self):
-        """Yield the DTO object for the open zone, if any."""
+    def pending_zone_dto(self, out):
+        """Emits the DTO object for the open zone, if any."""
+        if self._min_zone_duration:
+            self._release_held_zones(None, out)
+            self._open_zone_dto = None
+            return
         if self._open_zone_dto:
-            yield self._open_zone_dto
+            out.append(self._open_zone_dto)
             self._open_zone_dto = None
 
+    def _start_held_zone(self, ptr, timestamp, loc, loc_name, out):
+        assert self.contains(ptr)
+        self._release_held_zones(timestamp - self._min_zone_duration, out)
+        self._open_zone_ptr = ptr
+        self._open_zone_dto = emit_dto.ZoneStart(
+            track_uuid=self.uuid, timestamp=timestamp, loc=loc, name=loc_name
+        )
+        self._held.append((self._open_zone_dto, []))
+        self._mark_usage(ptr, timestamp)
+        self._open_zones_count += 1
+
+    def _end_held_zone(self, timestamp, out):
+        self._open_zones_count -= 1
+        self._open_zone_dto = None
+        self._open_zone_ptr = None
+        if self._held:
+            start, nested = self._held.pop()
+            if start.timestamp == timestamp and not nested:
+                # Instant zones are kept.
+                (self._held[-1][1] if self._held else out).append(_to_instant(start))
+                return
+            too_short = timestamp - start.timestamp < self._min_zone_duration
+            if too_short and not start.flows and not start.flows_terminating:
+                return
+            # Long enough (or part of a flow): so are the zones around it.
+            self._release_held_zones(None, out)
+            out.append(start)
+            out.extend(nested)
+        out.append(emit_dto.ZoneEnd(track_uuid=self.uuid, timestamp=timestamp))
+
+    def _release_held_zones(self, started_before, out):
+        """Emits the held zones started at or before `started_before` (all of them, if None)."""
+        held = self._held
+        count = 0
+        while count < len(held) and (
+            started_before is None or held[count][0].timestamp <= started_before
+        ):
+            start, nested = held[count]
+            out.append(start)
+            out.extend(nested)
+            count += 1
+        if count:
+            del held[:count]
+
     def _mark_usage(self, stack_ptr, timestamp):
         """Mark the usage of `stack_ptr` inside this stack."""
         self._used = (timestamp, self.end - stack_ptr)
@@ -294,6 +519,77 @@ class _StackData:
         return self.end - self._begin if self._begin > 0 else 0
 
 
+class _DroppedZones:
+    """Stands for the stack in `_TraceEmitter._open_zones`, for the zones dropped by sampling."""
+
+    def __init__(self):
+        self.depth = 0  # the number of open dropped zones in the stack
+
+    def open_zone_dto(self, ptr):
+        return None
+
+    def pending_zone_dto(self, out):
+        pass
+
+
+# The period over which the zones of a sampled location are counted.
+_SAMPLING_COUNT_INTERVAL_NS = 1_000_000
+
+
+class _SampledLocation:
+    """The sampling state of a location, and the counter track of its zones."""
+
+    def __init__(self, policy, track_uuid):
+        self.keep = policy.sampler()
+        self.track_uuid = track_uuid
+        self._interval = None  # the index of the current counting interval
+        self._count = 0
+
+    def count(self, timestamp, out):
+        """Counts a zone (kept or not) of the location."""
+        interval = timestamp // _SAMPLING_COUNT_INTERVAL_NS
+        if self._interval is None:
+            self._interval = interval
+        elif interval > self._interval:
+            self._emit_count(out)
+            if interval > self._interval + 1:
+                # No zones in between.
+                self._interval += 1
+                self._emit_count(out)
+            self._interval = interval
+        self._count += 1
+
+    def finish(self, out):
+        if self._interval is not None:
+            self._emit_count(out)
+            self._interval += 1
+            self._emit_count(out)
+
+    def _emit_count(self, out):
+        out.append(
+            emit_dto.CounterValue(
+                track_uuid=self.track_uuid,
+                timestamp=self._interval * _SAMPLING_COUNT_INTERVAL_NS,
+                value=self._count,
+            )
+        )
+        self._count = 0
+
+
+def _to_instant(z: emit_dto.ZoneStart):
+    """Converts the start of a zone into an instant zone, keeping all its data."""
+    return emit_dto.ZoneInstant(
+        track_uuid=z.track_uuid,
+        timestamp=z.timestamp,
+        loc=z.loc,
+        name=z.name,
+        params=z.params,
+        flows=z.flows,
+        flows_terminating=z.flows_terminating,
+        categories=z.categories,
+    )
+
+
 def _round_up_to_page_size(x):
     return (x + 4095) & ~4095
 
@@ -311,25 +607,25 @@ class _ThreadData:
         """Returns the last stack used by the thread."""
         return self._current_stack
 
-    def mark_stack(self, stack, timestamp):
+    def mark_stack(self, stack, timestamp, out):
         """Marks the usage of a stack by the thread."""
         if not self._last_switch_timestamp:
             self._last_switch_timestamp = timestamp
             self._last_timestamp = timestamp
             self._current_stack = stack
-            yield self._emit_zone_start(stack, timestamp)
+            out.append(self._emit_zone_start(stack, timestamp))
         elif self._current_stack != stack:
-            yield self._emit_zone_end(timestamp)
-            yield self._emit_zone_start(stack, timestamp)
+            out.append(self._emit_zone_end(timestamp))
+            out.append(self._emit_zone_start(stack, timestamp))
             self._last_switch_timestamp = timestamp
             self._last_timestamp = timestamp
             self._current_stack = stack
         else:
             self._last_timestamp = timestamp
 
-    def close(self):
+    def close(self, out):
         if self._last_timestamp:
-            yield self._emit_zone_end(self._last_timestamp)
+            out.append(self._emit_zone_end(self._last_timestamp))
 
     def _emit_zone_start(self, stack, timestamp):
         return emit_dto.ZoneStart(
@@ -394,15 +690,16 @@ class _StacksStats:
             )
         )
 
-    def emit(self):
+    def emit(self, out):
         """Emit needed statistics, if we have something to report."""
-        yield from self._to_emit
-        self._to_emit = []
+        if self._to_emit:
+            out.extend(self._to_emit)
+            self._to_emit = []
 
 
-def _track_id_gen():
+def _track_id_gen(first=0):
     """Generates unique track ids."""
-    track_uuid = 0
+    track_uuid = first
     while True:
         yield track_uuid
         track_uuid += 1
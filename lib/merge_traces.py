@@ -0,0 +1,97 @@
+import heapq
+from lib.emit_trace import emit_trace_batches
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+class _MergeInput:
+    """An input of the merge: a stream of emit DTO batches, and the position in its current batch.
+
+    The items without timestamp (tracks, locations) take the timestamp of the item before them,
+    so that they stay before the items using them."""
+
+    __slots__ = ("index", "batches", "batch", "pos", "timestamp")
+
+    def __init__(self, index, batches):
+        self.index = index
+        self.batches = iter(batches)
+        self.batch = []
+        self.pos = 0
+        self.timestamp = 0
+
+    def next_batch(self):
+        """Moves to the next non-empty batch; returns False at the end of the stream."""
+        for batch in self.batches:
+            if batch:
+                self.batch = batch
+                self.pos = 0
+                return True
+        return False
+
+    def head_timestamp(self):
+        return getattr(self.batch[self.pos], "timestamp", self.timestamp)
+
+
+def merge_emit_batches(streams, batch_size=DEFAULT_BATCH_SIZE):
+    """Merges streams of emit DTO batches on timestamp; yields lists of emit DTOs.
+
+    A k-way merge with a heap: the input with the earliest next item gives all its items up to
+    the next item of the other inputs, so ordered inputs are merged in runs. The items of each
+    input keep their order. Only the current batch of each input is held in memory."""
+    heap = []
+    for index, batches in enumerate(streams):
+        merge_input = _MergeInput(index, batches)
+        if merge_input.next_batch():
+            heap.append((merge_input.head_timestamp(), index, merge_input))
+    heapq.heapify(heap)
+
+    out = []
+    while heap:
+        _, _, merge_input = heapq.heappop(heap)
+        limit = heap[0][0] if heap else float("inf")
+        batch, pos, timestamp = merge_input.batch, merge_input.pos, merge_input.timestamp
+        while True:
+            if pos == len(batch):
+                merge_input.timestamp = timestamp
+                if not merge_input.next_batch():
+                    break
+                batch, pos = merge_input.batch, 0
+            item = batch[pos]
+            timestamp = getattr(item, "timestamp", timestamp)
+            if timestamp > limit:
+                merge_input.pos = pos
+                merge_input.timestamp = timestamp
+                heapq.heappush(heap, (timestamp, merge_input.index, merge_input))
+                break
+            out.append(item)
+            pos += 1
+            if len(out) >= batch_size:
+                yield out
+                out = []
+    if out:
+        yield out
+
+
+def emit_merged_trace_batches(
+    parse_streams,
+    labels=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    min_zone_duration_ns=0,
+    sampling=None,
+):
+    """Emits several captures as one trace: each stream of parse item batches is emitted in its
+    own namespace (labeled by `labels`), and the results are merged on timestamp."""
+    labels = labels or [None] * len(parse_streams)
+    return merge_emit_batches(
+        [
+            emit_trace_batches(
+                batches,
+                namespace=index,
+                label=label,
+                min_zone_duration_ns=min_zone_duration_ns,
+                sampling=sampling,
+            )
+            for index, (batches, label) in enumerate(zip(parse_streams, labels))
+        ],
+        batch_size,
+    )
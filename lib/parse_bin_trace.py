@@ -1,7 +1,17 @@
+from array import array
+from collections import deque
 from enum import Enum, auto
-import struct
+import mmap
 import os
+import pickle
+import struct
+import tempfile
+import time
 import lib.parse_dto as dto
+import lib.registry as registry
+
+# The number of items in the batches passed between the stages of the batched API.
+DEFAULT_BATCH_SIZE = 4096
 
 
 class PacketType(Enum):
@@ -34,34 +44,42 @@ DepType = Enum("DepType", ["string", "location"])
 
 
 class _InitPacket:
-    def __init__(self, f):
-        self.magic, self.version = _read_and_unpack("4sI", f)
+    __slots__ = ("magic", "version")
+
+    def __init__(self, magic, version):
+        self.magic = magic
+        self.version = version
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
 class _StaticStringPacket:
-    def __init__(self, f):
-        self.string_id = _read_and_unpack("Q", f)[0]
-        size = _read_and_unpack("H", f)[0]
-        self.string = f.read(size).decode("utf-8")
+    __slots__ = ("string_id", "string")
+
+    def __init__(self, string_id, string):
+        self.string_id = string_id
+        self.string = string
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
         return [(DepType.string, self.string_id)]
 
 
 class _LocationPacket:
-    def __init__(self, f):
-        self.loc_id, self.name_id, self.function_id, self.file_id, self.line = (
-            _read_and_unpack("4QI", f)
-        )
+    __slots__ = ("loc_id", "name_id", "function_id", "file_id", "line")
+
+    def __init__(self, loc_id, name_id, function_id, file_id, line):
+        self.loc_id = loc_id
+        self.name_id = name_id
+        self.function_id = function_id
+        self.file_id = file_id
+        self.line = line
 
     def dependencies(self):
         return [
@@ -75,416 +93,867 @@ class _LocationPacket:
 
 
 class _StackPacket:
-    def __init__(self, f):
-        self.begin, self.end, size = _read_and_unpack("QQH", f)
-        self.name = f.read(size).decode("utf-8")
+    __slots__ = ("begin", "end", "name")
+
+    def __init__(self, begin, end, name):
+        self.begin = begin
+        self.end = end
+        self.name = name
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
 class _ThreadNamePacket:
-    def __init__(self, f):
-        self.tid, size = _read_and_unpack("QH", f)
-        self.thread_name = f.read(size).decode("utf-8")
+    __slots__ = ("tid", "thread_name")
+
+    def __init__(self, tid, thread_name):
+        self.tid = tid
+        self.thread_name = thread_name
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
 class _ZoneStartPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.tid, self.timestamp, self.loc_id = _read_and_unpack(
-            "4Q", f
-        )
+    __slots__ = ("stack_ptr", "tid", "timestamp", "loc_id")
+
+    def __init__(self, stack_ptr, tid, timestamp, loc_id):
+        self.stack_ptr = stack_ptr
+        self.tid = tid
+        self.timestamp = timestamp
+        self.loc_id = loc_id
 
     def dependencies(self):
         return [(DepType.location, self.loc_id)]
 
     def provides(self):
-        return []
+        return ()
 
 
 class _ZoneEndPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.timestamp = _read_and_unpack("QQ", f)
+    __slots__ = ("stack_ptr", "timestamp")
+
+    def __init__(self, stack_ptr, timestamp):
+        self.stack_ptr = stack_ptr
+        self.timestamp = timestamp
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
 class _ZoneDynamicNamePacket:
-    def __init__(self, f):
-        self.stack_ptr, size = _read_and_unpack("QH", f)
-        self.name = f.read(size).decode("utf-8")
+    __slots__ = ("stack_ptr", "name")
 
-    def dependencies(self):
-        return []
-
-    def provides(self):
-        return []
-
-
-class _ZoneParamBoolPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQB", f)
+    def __init__(self, stack_ptr, name):
+        self.stack_ptr = stack_ptr
+        self.name = name
 
     def dependencies(self):
-        return [(DepType.string, self.param_name_id)]
+        return ()
 
     def provides(self):
-        return []
+        return ()
+
 
+class _ZoneParamPacket:
+    __slots__ = ("stack_ptr", "param_name_id", "value")
 
-class _ZoneParamIntPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQq", f)
+    def __init__(self, stack_ptr, param_name_id, value):
+        self.stack_ptr = stack_ptr
+        self.param_name_id = param_name_id
+        self.value = value
 
     def dependencies(self):
         return [(DepType.string, self.param_name_id)]
 
     def provides(self):
-        return []
+        return ()
 
 
-class _ZoneParamUIntPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQQ", f)
+class _ZoneParamBoolPacket(_ZoneParamPacket):
+    __slots__ = ()
 
-    def dependencies(self):
-        return [(DepType.string, self.param_name_id)]
 
-    def provides(self):
-        return []
+class _ZoneParamIntPacket(_ZoneParamPacket):
+    __slots__ = ()
 
 
-class _ZoneParamDoublePacket:
-    def __init__(self, f):
-        self.stack_ptr, self.param_name_id, self.value = _read_and_unpack("QQd", f)
-
-    def dependencies(self):
-        return [(DepType.string, self.param_name_id)]
+class _ZoneParamUIntPacket(_ZoneParamPacket):
+    __slots__ = ()
 
-    def provides(self):
-        return []
 
+class _ZoneParamDoublePacket(_ZoneParamPacket):
+    __slots__ = ()
 
-class _ZoneParamStringPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.param_name_id, size = _read_and_unpack("QQH", f)
-        self.value = f.read(size).decode("utf-8")
 
-    def dependencies(self):
-        return [(DepType.string, self.param_name_id)]
-
-    def provides(self):
-        return []
+class _ZoneParamStringPacket(_ZoneParamPacket):
+    __slots__ = ()
 
 
 class _ZoneFlowPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.flowid = _read_and_unpack("QQ", f)
+    __slots__ = ("stack_ptr", "flowid")
+
+    def __init__(self, stack_ptr, flowid):
+        self.stack_ptr = stack_ptr
+        self.flowid = flowid
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
 class _ZoneFlowTerminatePacket:
-    def __init__(self, f):
-        self.stack_ptr, self.flowid = _read_and_unpack("QQ", f)
+    __slots__ = ("stack_ptr", "flowid")
+
+    def __init__(self, stack_ptr, flowid):
+        self.stack_ptr = stack_ptr
+        self.flowid = flowid
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
 class _ZoneCategoryPacket:
-    def __init__(self, f):
-        self.stack_ptr, self.category_name_id = _read_and_unpack("QQ", f)
+    __slots__ = ("stack_ptr", "category_name_id")
+
+    def __init__(self, stack_ptr, category_name_id):
+        self.stack_ptr = stack_ptr
+        self.category_name_id = category_name_id
 
     def dependencies(self):
         return [(DepType.string, self.category_name_id)]
 
     def provides(self):
-        return []
+        return ()
 
 
 class _CounterTrackPacket:
-    def __init__(self, f):
-        self.tid, size = _read_and_unpack("QH", f)
-        self.track_name = f.read(size).decode("utf-8")
+    __slots__ = ("tid", "track_name")
+
+    def __init__(self, tid, track_name):
+        self.tid = tid
+        self.track_name = track_name
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
-class _CounterValueIntPacket:
-    def __init__(self, f):
-        self.tid, self.timestamp, self.value = _read_and_unpack("QQq", f)
+class _CounterValuePacket:
+    __slots__ = ("tid", "timestamp", "value")
+
+    def __init__(self, tid, timestamp, value):
+        self.tid = tid
+        self.timestamp = timestamp
+        self.value = value
 
     def dependencies(self):
-        return []
+        return ()
 
     def provides(self):
-        return []
+        return ()
 
 
-class _CounterValueDoublePacket:
-    def __init__(self, f):
-        self.tid, self.timestamp, self.value = _read_and_unpack("QQd", f)
+class _CounterValueIntPacket(_CounterValuePacket):
+    __slots__ = ()
 
-    def dependencies(self):
-        return []
 
-    def provides(self):
-        return []
-
-
-def _read_and_unpack(format, f):
-    size = struct.calcsize(format)
-    data = f.read(size)
-    if not data:
-        return None
-    return struct.unpack(format, data)
-
-
-def _parse_packet(type, f):
-    if type == PacketType.init:
-        return _InitPacket(f)
-    elif type == PacketType.static_string:
-        return _StaticStringPacket(f)
-    elif type == PacketType.location:
-        return _LocationPacket(f)
-
-    elif type == PacketType.stack:
-        return _StackPacket(f)
-    elif type == PacketType.thread_name:
-        return _ThreadNamePacket(f)
-
-    elif type == PacketType.zone_start:
-        return _ZoneStartPacket(f)
-    elif type == PacketType.zone_end:
-        return _ZoneEndPacket(f)
-    elif type == PacketType.zone_dynamic_name:
-        return _ZoneDynamicNamePacket(f)
-    elif type == PacketType.zone_param_bool:
-        return _ZoneParamBoolPacket(f)
-    elif type == PacketType.zone_param_int:
-        return _ZoneParamIntPacket(f)
-    elif type == PacketType.zone_param_uint:
-        return _ZoneParamUIntPacket(f)
-    elif type == PacketType.zone_param_double:
-        return _ZoneParamDoublePacket(f)
-    elif type == PacketType.zone_param_string:
-        return _ZoneParamStringPacket(f)
-    elif type == PacketType.zone_flow:
-        return _ZoneFlowPacket(f)
-    elif type == PacketType.zone_flow_terminate:
-        return _ZoneFlowTerminatePacket(f)
-    elif type == PacketType.zone_category:
-        return _ZoneCategoryPacket(f)
-
-    elif type == PacketType.counter_track:
-        return _CounterTrackPacket(f)
-    elif type == PacketType.counter_value_int:
-        return _CounterValueIntPacket(f)
-    elif type == PacketType.counter_value_double:
-        return _CounterValueDoublePacket(f)
-
-    elif type == PacketType.free:
-        return None
-    else:
-        raise ValueError(f"Unknown packet type {type}")
+class _CounterValueDoublePacket(_CounterValuePacket):
+    __slots__ = ()
 
 
-def _parse_next_packet(f):
-    tuple = _read_and_unpack("B", f)
-    if tuple == None:
-        return None
-    type = PacketType(tuple[0])
-    return _parse_packet(type, f)
+def _get_string(strings, id):
+    """Returns the string with the given id; unknown strings are empty."""
+    return strings.setdefault(id, "")
 
 
-def _packet_generator(filename):
+def _init_to_dto(packet, strings):
+    assert packet.magic == b"PROF"
+    assert packet.version == 1
+
+
+def _static_string_to_dto(packet, strings):
+    strings[packet.string_id] = packet.string
+
+
+def _location_to_dto(packet, strings):
+    return dto.Location(
+        locid=packet.loc_id,
+        name=_get_string(strings, packet.name_id),
+        function_name=_get_string(strings, packet.function_id),
+        file_name=_get_string(strings, packet.file_id),
+        line_number=packet.line,
+    )
+
+
+def _stack_to_dto(packet, strings):
+    return dto.Stack(begin=packet.begin, end=packet.end, name=packet.name)
+
+
+def _thread_name_to_dto(packet, strings):
+    return dto.Thread(tid=packet.tid, thread_name=packet.thread_name)
+
+
+def _zone_start_to_dto(packet, strings):
+    return dto.ZoneStart(
+        stack_ptr=packet.stack_ptr,
+        tid=packet.tid,
+        timestamp=packet.timestamp,
+        locid=packet.loc_id,
+    )
+
+
+def _zone_end_to_dto(packet, strings):
+    return dto.ZoneEnd(stack_ptr=packet.stack_ptr, timestamp=packet.timestamp)
+
+
+def _zone_dynamic_name_to_dto(packet, strings):
+    return dto.ZoneName(stack_ptr=packet.stack_ptr, name=packet.name)
+
+
+def _zone_param_to_dto(packet, strings):
+    return dto.ZoneParam(
+        stack_ptr=packet.stack_ptr,
+        name=_get_string(strings, packet.param_name_id),
+        value=packet.value,
+    )
+
+
+def _zone_flow_to_dto(packet, strings):
+    return dto.ZoneFlow(stack_ptr=packet.stack_ptr, flowid=packet.flowid)
+
+
+def _zone_flow_terminate_to_dto(packet, strings):
+    return dto.ZoneFlowTerminate(stack_ptr=packet.stack_ptr, flowid=packet.flowid)
+
+
+def _zone_category_to_dto(packet, strings):
+    return dto.ZoneCategory(
+        stack_ptr=packet.stack_ptr,
+        category_name=_get_string(strings, packet.category_name_id),
+    )
+
+
+def _counter_track_to_dto(packet, strings):
+    return dto.CounterTrack(tid=packet.tid, name=packet.track_name)
+
+
+def _counter_value_to_dto(packet, strings):
+    return dto.CounterValue(tid=packet.tid, timestamp=packet.timestamp, value=packet.value)
+
+
+# What a packet carries: a definition (strings, locations, threads, etc.), an event, or an event
+# with a timestamp.
+_DEFINITION, _EVENT, _TIMED_EVENT = range(3)
+
+# The layout of each packet, as written by the C++ code (`#pragma pack(1)`), after the type byte,
+# and what it carries. For dynamic-size packets, the last field is the size of the UTF-8 string
+# that follows.
+_BUILTIN_PACKETS = [
+    (PacketType.init, _InitPacket, "<4sI", False, _init_to_dto, _DEFINITION),
+    (
+        PacketType.static_string,
+        _StaticStringPacket,
+        "<QH",
+        True,
+        _static_string_to_dto,
+        _DEFINITION,
+    ),
+    (PacketType.location, _LocationPacket, "<4QI", False, _location_to_dto, _DEFINITION),
+    (PacketType.stack, _StackPacket, "<QQH", True, _stack_to_dto, _DEFINITION),
+    (PacketType.thread_name, _ThreadNamePacket, "<QH", True, _thread_name_to_dto, _DEFINITION),
+    (PacketType.zone_start, _ZoneStartPacket, "<4Q", False, _zone_start_to_dto, _TIMED_EVENT),
+    (PacketType.zone_end, _ZoneEndPacket, "<QQ", False, _zone_end_to_dto, _TIMED_EVENT),
+    (
+        PacketType.zone_dynamic_name,
+        _ZoneDynamicNamePacket,
+        "<QH",
+        True,
+        _zone_dynamic_name_to_dto,
+        _EVENT,
+    ),
+    (PacketType.zone_param_bool, _ZoneParamBoolPacket, "<QQB", False, _zone_param_to_dto, _EVENT),
+    (PacketType.zone_param_int, _ZoneParamIntPacket, "<QQq", False, _zone_param_to_dto, _EVENT),
+    (PacketType.zone_param_uint, _ZoneParamUIntPacket, "<QQQ", False, _zone_param_to_dto, _EVENT),
+    (
+        PacketType.zone_param_double,
+        _ZoneParamDoublePacket,
+        "<QQd",
+        False,
+        _zone_param_to_dto,
+        _EVENT,
+    ),
+    (
+        PacketType.zone_param_string,
+        _ZoneParamStringPacket,
+        "<QQH",
+        True,
+        _zone_param_to_dto,
+        _EVENT,
+    ),
+    (PacketType.zone_flow, _ZoneFlowPacket, "<QQ", False, _zone_flow_to_dto, _EVENT),
+    (
+        PacketType.zone_flow_terminate,
+        _ZoneFlowTerminatePacket,
+        "<QQ",
+        False,
+        _zone_flow_terminate_to_dto,
+        _EVENT,
+    ),
+    (PacketType.zone_category, _ZoneCategoryPacket, "<QQ", False, _zone_category_to_dto, _EVENT),
+    (
+        PacketType.counter_track,
+        _CounterTrackPacket,
+        "<QH",
+        True,
+        _counter_track_to_dto,
+        _DEFINITION,
+    ),
+    (
+        PacketType.counter_value_int,
+        _CounterValueIntPacket,
+        "<QQq",
+        False,
+        _counter_value_to_dto,
+        _TIMED_EVENT,
+    ),
+    (
+        PacketType.counter_value_double,
+        _CounterValueDoublePacket,
+        "<QQd",
+        False,
+        _counter_value_to_dto,
+        _TIMED_EVENT,
+    ),
+]
+
+# Tables derived from the registered packet kinds, indexed by the raw type byte, to avoid
+# constructing `PacketType` objects:
+# - the decoders: (class, unpack_from, size of the fixed part, has dynamic size)
+# - the size of the fixed part of the packet, including the type byte
+# - for dynamic-size packets, the offset of the string size field, from the packet start
+_DECODERS = [None] * 256
+_PACKET_SIZES = [0] * 256
+_STRING_SIZE_FIELDS = {}
+# Packet class -> function converting it to a parse DTO.
+_TO_DTO = {}
+# The packet classes carrying events, the ones with a timestamp, and the ones starting a zone (the
+# timed events with a `stack_ptr` and a `tid`).
+_EVENT_CLASSES = set()
+_TIMESTAMP_CLASSES = set()
+_ZONE_START_CLASSES = set()
+
+
+def _on_packet_registered(kind: registry.PacketKind):
+    layout = kind.layout
+    _DECODERS[kind.type] = (
+        kind.packet_class,
+        layout.unpack_from,
+        layout.size,
+        kind.has_dynamic_size,
+    )
+    _PACKET_SIZES[kind.type] = 1 + layout.size
+    if kind.has_dynamic_size:
+        _STRING_SIZE_FIELDS[kind.type] = 1 + layout.size - 2
+    else:
+        _STRING_SIZE_FIELDS.pop(kind.type, None)
+    _TO_DTO[kind.packet_class] = kind.to_dto
+    cls = kind.packet_class
+    if kind.is_event:
+        _EVENT_CLASSES.add(cls)
+    if kind.has_timestamp:
+        _TIMESTAMP_CLASSES.add(cls)
+        if hasattr(cls, "stack_ptr") and hasattr(cls, "tid"):
+            _ZONE_START_CLASSES.add(cls)
+
+
+registry.on_packet_registered(_on_packet_registered)
+for _type, _cls, _format, _has_dynamic_size, _to_dto, _role in _BUILTIN_PACKETS:
+    registry.register_packet(
+        registry.PacketKind(
+            _type.value,
+            _cls,
+            struct.Struct(_format),
+            _has_dynamic_size,
+            _to_dto,
+            is_event=_role != _DEFINITION,
+            has_timestamp=_role == _TIMED_EVENT,
+        )
+    )
+
+
+def _check_end_of_packets(type, offset):
+    """Called for a type byte without decoder; a free packet marks the end of the trace."""
+    if type != PacketType.free.value:
+        raise ValueError(f"Unknown packet type {type} at offset {offset}")
+
+
+def _decode_packets(buf, cursor, end=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Decodes the packets from `buf` that start in [`cursor[0]`, `end`), yielding them one by one.
+
+    Decodes them in batches, with `_decode_batch`: `cursor[0]` is updated after each batch."""
+    more = True
+    while more:
+        batch = []
+        try:
+            more = _decode_batch(buf, cursor, batch, batch_size, end)
+        except Exception:
+            yield from batch  # the packets before the invalid one
+            raise
+        yield from batch
+
+
+def _decode_batch(buf, cursor, out, max_count, end=None, decoders=_DECODERS):
+    """Decodes up to `max_count` packets from `buf`, starting at `cursor[0]`, appending them to `out`.
+
+    `cursor[0]` is updated to the offset following the last decoded packet, even if decoding fails.
+    Returns False if the end of the packets (or `end`) was reached."""
+    offset = cursor[0]
+    if end is None:
+        end = len(buf)
+    buf_end = len(buf)
+    append = out.append
+    try:
+        for _ in range(max_count):
+            if offset >= end:
+                return False
+            decoder = decoders[buf[offset]]
+            if not decoder:
+                _check_end_of_packets(buf[offset], offset)
+                return False
+            cls, unpack_from, size, has_dynamic_size = decoder
+            fields = unpack_from(buf, offset + 1)
+            if has_dynamic_size:
+                text_begin = offset + 1 + size
+                text_end = text_begin + fields[-1]
+                if text_end > buf_end:
+                    raise struct.error(f"Truncated packet at offset {text_begin}")
+                append(cls(*fields[:-1], str(buf[text_begin:text_end], "utf-8")))
+                offset = text_end
+            else:
+                append(cls(*fields))
+                offset += 1 + size
+        return offset < end
+    finally:
+        cursor[0] = offset
+
+
+def _mmap_packets(file, cursor=None):
+    """Yields all the packets in `file`, decoding them in place from a memory map."""
+    for batch in _mmap_packet_batches(file, cursor):
+        yield from batch
+
+
+def _mmap_packet_batches(file, cursor=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields all the packets in `file`, in batches, decoding them in place from a memory map."""
+    if cursor is None:
+        cursor = [0]
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            more = True
+            while more:
+                batch = []
+                more = _decode_batch(view, cursor, batch, batch_size)
+                if batch:
+                    yield batch
+
+
+def _stream_packets(file, cursor=None):
+    """Yields all the packets in `file`, reading them one by one.
+
+    Used for files that cannot be memory-mapped (e.g., empty files or pipes)."""
+    if cursor is None:
+        cursor = [0]
+    while True:
+        type = file.read(1)
+        if not type:
+            return
+        decoder = _DECODERS[type[0]]
+        if not decoder:
+            _check_end_of_packets(type[0], cursor[0])
+            return
+        cls, unpack_from, size, has_dynamic_size = decoder
+        fields = unpack_from(file.read(size))
+        cursor[0] += 1 + size
+        if has_dynamic_size:
+            size = fields[-1]
+            text = file.read(size).decode("utf-8")
+            cursor[0] += size
+            yield cls(*fields[:-1], text)
+        else:
+            yield cls(*fields)
+
+
+def _batched(items, batch_size):
+    """Groups `items` into lists of `batch_size` items (the last one may be shorter)."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_unpack_string_size = struct.Struct("<H").unpack_from
+
+
+def _scan_packet_offsets(buf, offset=0, end=None):
+    """Scans the packet boundaries in `buf`, without decoding the packets.
+
+    Returns an array with the offsets of the packets starting in [`offset`, `end`), and the offset
+    where the scan stopped."""
+    if end is None:
+        end = len(buf)
+    sizes = _PACKET_SIZES
+    string_size_fields = _STRING_SIZE_FIELDS
+    offsets = array("q")
+    append = offsets.append
+    while offset < end:
+        type = buf[offset]
+        size = sizes[type]
+        if type in string_size_fields:
+            size += _unpack_string_size(buf, offset + string_size_fields[type])[0]
+        elif not size:
+            _check_end_of_packets(type, offset)
+            break
+        append(offset)
+        offset += size
+    if offset > len(buf):
+        raise struct.error(f"Truncated packet at offset {offsets[-1]}")
+    return offsets, offset
+
+
+def _follow_packet_batches(
+    file, cursor, poll_interval=0.5, on_idle=None, batch_size=DEFAULT_BATCH_SIZE
+):
+    """Yields the packets in `file`, in batches, while the file is still being written.
+
+    A partially written packet at the end of the file is kept until the rest of it is written, and
+    free bytes (type 0) between packets are skipped as padding. When no new data is available,
+    calls `on_idle` and polls again after `poll_interval` seconds. Stops following when
+    interrupted (Ctrl+C) while waiting for new data."""
+    buf = bytearray()
+    while True:
+        data = file.read(1024 * 1024)
+        if not data:
+            if on_idle:
+                on_idle()
+            try:
+                time.sleep(poll_interval)
+            except KeyboardInterrupt:
+                return
+            continue
+
+        buf += data
+        consumed = [0]
+        more = True
+        while more:
+            batch = []
+            try:
+                more = _decode_batch(buf, consumed, batch, batch_size)
+            except struct.error:
+                more = False  # partially written packet; wait for the rest of it
+            if batch:
+                yield batch
+            # Free bytes are padding: skip them, instead of stopping there.
+            offset = consumed[0]
+            if not more and offset < len(buf) and buf[offset] == PacketType.free.value:
+                while offset < len(buf) and buf[offset] == PacketType.free.value:
+                    offset += 1
+                consumed[0] = offset
+                more = True
+        cursor[0] += consumed[0]
+        del buf[: consumed[0]]
+
+
+def _packet_generator(filename, use_mmap=True, follow=False, on_idle=None):
+    for batch in _packet_batches(filename, use_mmap, follow, on_idle):
+        yield from batch
+
+
+def _packet_batches(
+    filename,
+    use_mmap=True,
+    follow=False,
+    on_idle=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+):
     # Check the size of the file
     file_size = os.stat(filename).st_size
-    show_progress = file_size > 1024 * 1024
+    show_progress = file_size > 1024 * 1024 and not follow
     if show_progress:
         print(f"Processing {filename}: 0%", end="")
     counter = 0
     with open(filename, "rb") as file:
-        while True:
-            p = _parse_next_packet(file)
-            if not p:
-                break
-            yield p
-            counter += 1
-            if show_progress and counter % 25_000 == 0:
-                cur_pos = file.tell()
-                print(f"\rProcessing {filename}: {int(100*cur_pos/file_size)}%", end="")
-            # if counter > 1_000_000:
-            #     break
+        cursor = [0]
+        if follow:
+            batches = _follow_packet_batches(
+                file, cursor, on_idle=on_idle, batch_size=batch_size
+            )
+        elif use_mmap and file_size > 0:
+            batches = _mmap_packet_batches(file, cursor, batch_size)
+        else:
+            batches = _batched(_stream_packets(file, cursor), batch_size)
+        for batch in batches:
+            yield batch
+            counter += len(batch)
+            if show_progress and counter >= 25_000:
+                counter = 0
+                print(f"\rProcessing {filename}: {int(100*cursor[0]/file_size)}%", end="")
     if show_progress:
         print(f"\rProcessing {filename}: 100%")
         print("Done.")
 
 
-def _ensure_ordering(packets):
-    # For each packet, check the list of dependencies. If we've already seen the dependency yield the packet, otherwise delay it.
-    # If we've delayed a packet and we've seen all of its dependencies, yield it and all other delayed packets.
-    seen = set()
-    unseen_dependencies = set()
-    delayed_packets = []
-    delayed_locations = []
-    for packet in packets:
-        # Update what we seen with the provides of the packet.
-        provides = set(packet.provides())
-        seen.update(provides)
-        unseen_dependencies.difference_update(provides)
-
-        # Now, check the dependencies of the packet.
-        dependencies = set(packet.dependencies())
-        unseen_dependencies.update(dependencies.difference(seen))
-
-        if unseen_dependencies:
-            if isinstance(packet, _StaticStringPacket):
-                # Always yield strings.
-                yield packet
-            elif isinstance(packet, _LocationPacket):
-                # Keep the locations serarate, we need to process them first.
-                delayed_locations.append(packet)
-            else:
-                # The other packets that are delayed.
-                delayed_packets.append(packet)
-        elif delayed_packets:
-            # This package solves all the dependencies of the delayed packets.
-            yield packet
-            for p in delayed_locations:
-                yield p
-            for p in delayed_packets:
-                yield p
-            delayed_locations = []
-            delayed_packets = []
+class _HeldPacket:
+    """A packet that cannot be yielded yet, either due to missing dependencies or ordering."""
+
+    __slots__ = ("packet", "spill_offset", "missing", "keys")
+
+    def __init__(self, packet, missing, keys):
+        self.packet = packet
+        self.spill_offset = None
+        self.missing = missing
+        self.keys = keys
+
+
+class _SpillFile:
+    """Temporary file holding pickled packets, to bound the memory used by held packets."""
+
+    def __init__(self):
+        self._f = tempfile.TemporaryFile()
+
+    def store(self, packet):
+        """Stores the packet at the end of the file and returns its offset."""
+        self._f.seek(0, os.SEEK_END)
+        offset = self._f.tell()
+        pickle.dump(packet, self._f, protocol=pickle.HIGHEST_PROTOCOL)
+        return offset
+
+    def load(self, offset):
+        self._f.seek(offset)
+        return pickle.load(self._f)
+
+    def close(self):
+        self._f.close()
+
+
+class _DependencyResolver:
+    """Delays packets until the packets they depend on (strings, locations) are seen.
+
+    Every missing dependency has a wait-list of the packets blocked on it; when the dependency
+    appears, only those packets are released. Packets without missing dependencies are held only
+    if they need to stay behind a held packet with the same ordering key (see `_ordering_keys`).
+    If more than `max_held_packets` packets are held, the extra packets are spilled to disk."""
+
+    def __init__(self, max_held_packets=1_000_000):
+        self._max_held_packets = max_held_packets
+        self._seen = set()
+        self._waiters = {}  # (DepType, id) -> list of _HeldPacket
+        self._lanes = {}  # ordering key -> deque of _HeldPacket, in arrival order
+        self._zone_threads = {}  # stack pointer -> tid of the last zone started there
+        self._num_held = 0
+        self._num_in_memory = 0
+        self._spill_file = None
+
+    def add_batch(self, packets, out):
+        """Adds packets; appends to `out` the packets that can be processed now."""
+        seen = self._seen
+        lanes = self._lanes
+        zone_threads = self._zone_threads
+        zone_starts = _ZONE_START_CLASSES
+        for packet in packets:
+            if packet.__class__ in zone_starts:
+                zone_threads[packet.stack_ptr] = packet.tid
+            # Fast path: nothing is held, and all the dependencies are known.
+            if not lanes:
+                dependencies = packet.dependencies()
+                if not dependencies or all(d in seen for d in dependencies):
+                    out.append(packet)
+                    provides = packet.provides()
+                    if provides:
+                        self._on_provided(provides, out)
+                    continue
+            self.add(packet, out)
+
+    def add(self, packet, out):
+        """Adds a packet; appends to `out` the packets that can be processed now (possibly it)."""
+        dependencies = packet.dependencies()
+        if dependencies:
+            seen = self._seen
+            missing = [d for d in dependencies if d not in seen]
         else:
-            yield packet
-
-    assert not unseen_dependencies, f"Unresolved dependencies {unseen_dependencies}"
-    assert not delayed_packets, f"Delayed packets {delayed_packets}"
+            missing = None
+        lanes = self._lanes
+        keys = self._ordering_keys(packet) if missing or lanes else ()
+        if not missing and not any(k in lanes for k in keys):
+            out.append(packet)
+            provides = packet.provides()
+            if provides:
+                self._on_provided(provides, out)
+            return
+
+        # Hold the packet.
+        held = _HeldPacket(packet, len(missing) if missing else 0, keys)
+        if missing:
+            for d in missing:
+                self._waiters.setdefault(d, []).append(held)
+        for k in keys:
+            lane = lanes.get(k)
+            if lane is None:
+                lanes[k] = lane = deque()
+            lane.append(held)
+        self._num_held += 1
+        if self._num_in_memory >= self._max_held_packets:
+            self._spill(held)
+        else:
+            self._num_in_memory += 1
+
+    def _ordering_keys(self, packet):
+        """Returns the keys that a packet shares with the packets it must stay ordered with.
+
+        Zone packets keep their order per zone (stack pointer), and per thread: the thread of a
+        zone packet is the one that started the zone, and its zones must stay nested, even
+        across the stacks it switches between."""
+        stack_ptr = getattr(packet, "stack_ptr", None)
+        if stack_ptr is None:
+            return ()
+        tid = self._zone_threads.get(stack_ptr)
+        if tid is None:
+            return (("stack", stack_ptr),)
+        return (("stack", stack_ptr), ("thread", tid))
+
+    def finish(self):
+        """Checks that all the packets were released."""
+        assert not self._waiters, f"Unresolved dependencies {list(self._waiters)}"
+        assert not self._num_held, f"{self._num_held} delayed packets"
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _spill(self, held):
+        if not self._spill_file:
+            self._spill_file = _SpillFile()
+        held.spill_offset = self._spill_file.store(held.packet)
+        held.packet = None
+
+    def _can_release(self, held):
+        """Check if the held packet has no missing dependencies and is first in all its lanes."""
+        if held.missing:
+            return False
+        lanes = self._lanes
+        return all(lanes[k][0] is held for k in held.keys)
+
+    def _on_provided(self, provides, out):
+        """Registers the provided dependencies and appends to `out` the packets released by them."""
+        ready = deque()
+        for dep in provides:
+            self._seen.add(dep)
+            for held in self._waiters.pop(dep, ()):
+                held.missing -= 1
+                if self._can_release(held):
+                    ready.append(held)
+        while ready:
+            held = ready.popleft()
+            if held.missing < 0:
+                continue  # already released
+            held.missing = -1
+            packet = self._release(held)
+            out.append(packet)
+            for dep in packet.provides():
+                self._seen.add(dep)
+                for waiter in self._waiters.pop(dep, ()):
+                    waiter.missing -= 1
+                    if self._can_release(waiter):
+                        ready.append(waiter)
+            for k in held.keys:
+                lane = self._lanes[k]
+                lane.popleft()
+                if lane:
+                    if self._can_release(lane[0]):
+                        ready.append(lane[0])
+                else:
+                    del self._lanes[k]
+
+    def _release(self, held):
+        self._num_held -= 1
+        if held.packet is None:
+            return self._spill_file.load(held.spill_offset)
+        self._num_in_memory -= 1
+        return held.packet
+
+
+def _ensure_ordering(packets, max_held_packets=1_000_000):
+    """Yields the packets in an order in which dependencies are seen before their use."""
+    for batch in _ensure_ordering_batches(([p] for p in packets), max_held_packets):
+        yield from batch
+
+
+def _ensure_ordering_batches(batches, max_held_packets=1_000_000):
+    """Batched version of `_ensure_ordering`: consumes and yields lists of packets."""
+    resolver = _DependencyResolver(max_held_packets)
+    for batch in batches:
+        out = []
+        resolver.add_batch(batch, out)
+        if out:
+            yield out
+    resolver.finish()
 
 
 def _packets_to_dtos(packets):
-    strings = {}
-
-    def _get_string(id):
-        if id not in strings:
-            strings[id] = ""
-        return strings[id]
-
-    for packet in packets:
-        if isinstance(packet, _InitPacket):
-            assert packet.magic == b"PROF"
-            assert packet.version == 1
-        elif isinstance(packet, _StaticStringPacket):
-            strings[packet.string_id] = packet.string
-        elif isinstance(packet, _LocationPacket):
-            yield dto.Location(
-                locid=packet.loc_id,
-                name=_get_string(packet.name_id),
-                function_name=_get_string(packet.function_id),
-                file_name=_get_string(packet.file_id),
-                line_number=packet.line,
-            )
-
-        elif isinstance(packet, _StackPacket):
-            yield dto.Stack(begin=packet.begin, end=packet.end, name=packet.name)
-        elif isinstance(packet, _ThreadNamePacket):
-            yield dto.Thread(tid=packet.tid, thread_name=packet.thread_name)
-
-        elif isinstance(packet, _ZoneStartPacket):
-            yield dto.ZoneStart(
-                stack_ptr=packet.stack_ptr,
-                tid=packet.tid,
-                timestamp=packet.timestamp,
-                locid=packet.loc_id,
-            )
-        elif isinstance(packet, _ZoneEndPacket):
-            yield dto.ZoneEnd(stack_ptr=packet.stack_ptr, timestamp=packet.timestamp)
-        elif isinstance(packet, _ZoneDynamicNamePacket):
-            yield dto.ZoneName(stack_ptr=packet.stack_ptr, name=packet.name)
-        elif isinstance(packet, _ZoneParamBoolPacket):
-            yield dto.ZoneParam(
-                stack_ptr=packet.stack_ptr,
-                name=_get_string(packet.param_name_id),
-                value=packet.value,
-            )
-        elif isinstance(packet, _ZoneParamIntPacket):
-            yield dto.ZoneParam(
-                stack_ptr=packet.stack_ptr,
-                name=_get_string(packet.param_name_id),
-                value=packet.value,
-            )
-        elif isinstance(packet, _ZoneParamUIntPacket):
-            yield dto.ZoneParam(
-                stack_ptr=packet.stack_ptr,
-                name=_get_string(packet.param_name_id),
-                value=packet.value,
-            )
-        elif isinstance(packet, _ZoneParamDoublePacket):
-            yield dto.ZoneParam(
-                stack_ptr=packet.stack_ptr,
-                name=_get_string(packet.param_name_id),
-                value=packet.value,
-            )
-        elif isinstance(packet, _ZoneParamStringPacket):
-            yield dto.ZoneParam(
-                stack_ptr=packet.stack_ptr,
-                name=_get_string(packet.param_name_id),
-                value=packet.value,
-            )
-        elif isinstance(packet, _ZoneFlowPacket):
-            yield dto.ZoneFlow(stack_ptr=packet.stack_ptr, flowid=packet.flowid)
-        elif isinstance(packet, _ZoneFlowTerminatePacket):
-            yield dto.ZoneFlowTerminate(
-                stack_ptr=packet.stack_ptr, flowid=packet.flowid
-            )
-        elif isinstance(packet, _ZoneCategoryPacket):
-            yield dto.ZoneCategory(
-                stack_ptr=packet.stack_ptr,
-                category_name=_get_string(packet.category_name_id),
-            )
+    for batch in _packets_to_dtos_batches([p] for p in packets):
+        yield from batch
 
-        elif isinstance(packet, _CounterTrackPacket):
-            yield dto.CounterTrack(tid=packet.tid, name=packet.track_name)
-        elif isinstance(packet, _CounterValueIntPacket):
-            yield dto.CounterValue(
-                tid=packet.tid, timestamp=packet.timestamp, value=packet.value
-            )
-        elif isinstance(packet, _CounterValueDoublePacket):
-            yield dto.CounterValue(
-                tid=packet.tid, timestamp=packet.timestamp, value=packet.value
-            )
-        else:
-            raise ValueError(f"Unknown packet {packet}")
 
-
-def parse_bin_trace(filename):
-    packets = _packet_generator(filename)
-    packets = _ensure_ordering(packets)
-    return _packets_to_dtos(packets)
+def _packets_to_dtos_batches(batches):
+    """Batched version of `_packets_to_dtos`: consumes lists of packets, yields lists of DTOs."""
+    strings = {}
+    to_dto = _TO_DTO
+    for packets in batches:
+        dtos = []
+        append = dtos.append
+        for packet in packets:
+            convert = to_dto.get(type(packet))
+            if convert is None:
+                raise ValueError(f"Unknown packet {packet}")
+            item = convert(packet, strings)
+            if item is not None:
+                append(item)
+        yield dtos
+
+
+def parse_bin_trace(filename, max_held_packets=1_000_000, follow=False, on_idle=None):
+    for batch in parse_bin_trace_batches(filename, max_held_packets, follow, on_idle):
+        yield from batch
+
+
+def parse_bin_trace_batches(
+    filename,
+    max_held_packets=1_000_000,
+    follow=False,
+    on_idle=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+):
+    """Parses the binary trace `filename`, yielding lists of (about `batch_size`) parse DTOs."""
+    batches = _packet_batches(filename, follow=follow, on_idle=on_idle, batch_size=batch_size)
+    batches = _ensure_ordering_batches(batches, max_held_packets)
+    return _packets_to_dtos_batches(batches)
@@ -1,7 +1,7 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class Stack:
     """Describes a stack under which we can execute code."""
 
@@ -10,7 +10,7 @@ class Stack:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Thread:
     """Describes a thread in a profiling trace."""
 
@@ -18,7 +18,7 @@ class Thread:
     thread_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Location:
     """Describes a location in the source code."""
 
@@ -29,7 +29,7 @@ class Location:
     line_number: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneStart:
     """Describes the start of an execution zone."""
 
@@ -39,7 +39,7 @@ class ZoneStart:
     locid: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneEnd:
     """Describes the start of an execution zone."""
 
@@ -47,7 +47,7 @@ class ZoneEnd:
     timestamp: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneName:
     """Describes a dynamic name given to an execution zone."""
 
@@ -55,7 +55,7 @@ class ZoneName:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneFlow:
     """Describes a flow ID associated with an execution zone."""
 
@@ -63,7 +63,7 @@ class ZoneFlow:
     flowid: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneFlowTerminate:
     """Describes a flow ID associated with an execution zone; the flow terminates after the zone."""
 
@@ -71,7 +71,7 @@ class ZoneFlowTerminate:
     flowid: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneCategory:
     """Describes a category associated with execution zone."""
 
@@ -79,7 +79,7 @@ class ZoneCategory:
     category_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ZoneParam:
     """Describes a parameter for a zone."""
 
@@ -88,7 +88,7 @@ class ZoneParam:
     value: str | bool | int | float
 
 
-@dataclass
+@dataclass(slots=True)
 class CounterTrack:
     """Describes a track for counter."""
 
@@ -96,7 +96,7 @@ class CounterTrack:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class CounterValue:
     """Describes a value for a counter."""
 
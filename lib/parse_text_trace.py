@@ -1,20 +1,31 @@
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import csv
+import io
+import os
 import lib.parse_dto as dto
 
+# The number of items in the batches returned by `parse_text_trace_batches`.
+DEFAULT_BATCH_SIZE = 4096
 
-def _lines_in_file(filename):
-    with open(filename, "r") as file:
-        for line in file.readlines():
-            yield line.strip()
+# With multiple jobs, the size of the line ranges parsed by each worker.
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
 
 
-def _content_lines(lines):
-    for line in lines:
-        if line == "":
-            continue
-        if line.startswith("#"):
-            continue
-        yield line
+# Text traces are read in blocks of lines of about this size, so memory does not depend on the
+# size of the trace.
+_BLOCK_SIZE = 1024 * 1024
+
+
+def _line_blocks(filename, block_size=_BLOCK_SIZE):
+    """Yields the lines of `filename`, in lists of about `block_size` bytes."""
+    with open(filename, "r", buffering=block_size) as file:
+        while True:
+            lines = file.readlines(block_size)
+            if not lines:
+                return
+            yield lines
 
 
 def _csv_rows(lines):
@@ -96,35 +107,205 @@ def _parse_COUNTER_VALUE(args):
     )
 
 
-def _csv_rows_to_objects(rows):
-    commands = [
-        "STACK",
-        "THREAD",
-        "LOCATION",
-        "ZONE_START",
-        "ZONE_END",
-        "ZONE_NAME",
-        "ZONE_PARAM",
-        "ZONE_FLOW",
-        "ZONE_FLOW_T",
-        "ZONE_CATEGORY",
-        "COUNTER_TRACK",
-        "COUNTER_VALUE",
-    ]
-    for row in rows:
-        command = row[0].upper()
-        args = row[1:]
-
-        if command in commands:
-            fun_name = f"_parse_{command}"
-            yield globals()[fun_name](args)
+_PARSERS = {
+    "STACK": _parse_STACK,
+    "THREAD": _parse_THREAD,
+    "LOCATION": _parse_LOCATION,
+    "ZONE_START": _parse_ZONE_START,
+    "ZONE_END": _parse_ZONE_END,
+    "ZONE_NAME": _parse_ZONE_NAME,
+    "ZONE_PARAM": _parse_ZONE_PARAM,
+    "ZONE_FLOW": _parse_ZONE_FLOW,
+    "ZONE_FLOW_T": _parse_ZONE_FLOW_T,
+    "ZONE_CATEGORY": _parse_ZONE_CATEGORY,
+    "COUNTER_TRACK": _parse_COUNTER_TRACK,
+    "COUNTER_VALUE": _parse_COUNTER_VALUE,
+}
+
+# Commands with only numeric arguments; `int()` ignores the spaces around them.
+_NUMERIC_COMMANDS = {
+    "ZONE_START",
+    "ZONE_END",
+    "ZONE_FLOW",
+    "ZONE_FLOW_T",
+    "COUNTER_VALUE",
+}
+
+
+def _parse_lines(lines, out):
+    """Parses text trace lines, appending the parse DTOs to `out`.
+
+    Lines without quotes are split directly; only lines with quotes go through the csv reader."""
+    parsers = _PARSERS
+    numeric_commands = _NUMERIC_COMMANDS
+    append = out.append
+    ZoneStart, ZoneEnd, CounterValue = dto.ZoneStart, dto.ZoneEnd, dto.CounterValue
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        if '"' in line:
+            row = next(_csv_rows([line]))
+            command = row[0].upper()
+            args = row[1:]
         else:
+            row = line.split(",")
+            command = row[0].upper()
+            # Fast path for the most frequent commands.
+            if command == "ZONE_END" and len(row) == 3:
+                append(ZoneEnd(int(row[1]), int(row[2])))
+                continue
+            elif command == "ZONE_START" and len(row) == 5:
+                append(ZoneStart(int(row[1]), int(row[2]), int(row[3]), int(row[4])))
+                continue
+            elif command == "COUNTER_VALUE" and len(row) == 4:
+                append(CounterValue(int(row[1]), int(row[2]), int(row[3])))
+                continue
+            if command in numeric_commands:
+                args = row[1:]
+            else:
+                # Same as the `skipinitialspace` of the csv dialect.
+                args = [a.lstrip(" ") for a in row[1:]]
+
+        parser = parsers.get(command)
+        if parser is None:
             raise ValueError(f"Unknown command {command}")
-
-
-def parse_text_trace(filename):
-    r = _lines_in_file(filename)
-    r = _content_lines(r)
-    r = _csv_rows(r)
-    r = _csv_rows_to_objects(r)
-    return r
+        append(parser(args))
+
+
+# The fields of the parse DTOs, as sent back by the workers: "i" for integers, "s" for strings.
+# The index in this list identifies the type of the DTO.
+_COLUMN_LAYOUTS = [
+    (dto.ZoneStart, "iiii"),
+    (dto.ZoneEnd, "ii"),
+    (dto.CounterValue, "iii"),
+    (dto.Stack, "iis"),
+    (dto.Thread, "is"),
+    (dto.Location, "isssi"),
+    (dto.ZoneName, "is"),
+    (dto.ZoneParam, "iss"),
+    (dto.ZoneFlow, "ii"),
+    (dto.ZoneFlowTerminate, "ii"),
+    (dto.ZoneCategory, "is"),
+    (dto.CounterTrack, "is"),
+]
+_COLUMN_KINDS = {cls: kind for kind, (cls, _) in enumerate(_COLUMN_LAYOUTS)}
+
+
+def _to_columns(items):
+    """Converts parse DTOs to (kinds, ints, strings) columns, which are much cheaper to pickle.
+
+    Returns the items unchanged if an integer does not fit in the integer column."""
+    kinds = bytearray()
+    ints = array("q")
+    strings = []
+    add_int = ints.append
+    add_string = strings.append
+    for item in items:
+        kind = _COLUMN_KINDS[type(item)]
+        kinds.append(kind)
+        layout = _COLUMN_LAYOUTS[kind][1]
+        try:
+            for name, field in zip(item.__slots__, layout):
+                if field == "i":
+                    add_int(getattr(item, name))
+                else:
+                    add_string(getattr(item, name))
+        except OverflowError:
+            return items
+    return bytes(kinds), ints, strings
+
+
+def _from_columns(columns, out):
+    """Rebuilds the parse DTOs from the columns returned by `_to_columns`, appending them to `out`."""
+    if isinstance(columns, list):
+        out.extend(columns)
+        return
+    kinds, ints, strings = columns
+    next_int = iter(ints).__next__
+    next_string = iter(strings).__next__
+    append = out.append
+    ZoneStart, ZoneEnd, CounterValue = dto.ZoneStart, dto.ZoneEnd, dto.CounterValue
+    for kind in kinds:
+        if kind == 0:
+            append(ZoneStart(next_int(), next_int(), next_int(), next_int()))
+        elif kind == 1:
+            append(ZoneEnd(next_int(), next_int()))
+        elif kind == 2:
+            append(CounterValue(next_int(), next_int(), next_int()))
+        else:
+            cls, layout = _COLUMN_LAYOUTS[kind]
+            append(cls(*[next_int() if f == "i" else next_string() for f in layout]))
+
+
+def _line_ranges(filename, chunk_size):
+    """Splits `filename` into byte ranges of about `chunk_size` bytes, each ending after a newline."""
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as file:
+        begin = 0
+        while begin < size:
+            file.seek(min(begin + chunk_size, size))
+            file.readline()
+            end = min(file.tell(), size)
+            yield begin, end
+            begin = end
+
+
+def _parse_range(filename, begin, end):
+    """Parses the lines in the byte range [`begin`, `end`) of `filename`; used by workers.
+
+    Returns the parse DTOs as columns."""
+    with open(filename, "rb") as file:
+        file.seek(begin)
+        data = file.read(end - begin)
+    # Same newline handling as reading the file in text mode.
+    lines = io.StringIO(data.decode(), newline=None).readlines()
+    items = []
+    _parse_lines(lines, items)
+    return _to_columns(items)
+
+
+def _parallel_text_batches(
+    filename, jobs, chunk_size=DEFAULT_CHUNK_SIZE, batch_size=DEFAULT_BATCH_SIZE
+):
+    """Yields the parse DTOs of `filename`, in batches, parsing ranges of lines in `jobs` processes.
+
+    The parse DTOs are yielded in file order. At most `2 * jobs` ranges are in flight at any time."""
+    ranges = _line_ranges(filename, chunk_size)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+
+        def submit_next_range():
+            r = next(ranges, None)
+            if r:
+                pending.append(executor.submit(_parse_range, filename, *r))
+
+        for _ in range(2 * jobs):
+            submit_next_range()
+        while pending:
+            future = pending.popleft()
+            submit_next_range()
+            items = []
+            _from_columns(future.result(), items)
+            for i in range(0, len(items), batch_size):
+                yield items[i : i + batch_size]
+
+
+def parse_text_trace(filename, jobs=1):
+    for batch in parse_text_trace_batches(filename, jobs):
+        yield from batch
+
+
+def parse_text_trace_batches(filename, jobs=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Parses the text trace `filename`, yielding lists of (at most `batch_size`) parse DTOs.
+
+    With `jobs` > 1, ranges of lines are parsed in parallel, in `jobs` processes."""
+    if jobs > 1:
+        yield from _parallel_text_batches(filename, jobs, batch_size=batch_size)
+        return
+    for lines in _line_blocks(filename):
+        for i in range(0, len(lines), batch_size):
+            batch = []
+            _parse_lines(lines[i : i + batch_size], batch)
+            if batch:
+                yield batch
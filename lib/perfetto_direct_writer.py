@@ -0,0 +1,348 @@
+import struct
+import perfetto_trace_pb2 as pb2
+import lib.emit_dto as dto
+from lib.perfetto_writer import (
+    PerfettoWriter,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_QUEUE_SIZE,
+    INCREMENTAL_CLOCK_ID,
+    PARAMETERS_ANNOTATION,
+    SEQUENCE_ID,
+    TRACE_CLOCK_ID,
+)
+
+# Wire types
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+
+_SMALL_VARINTS = [bytes([i]) for i in range(0x80)]
+
+
+def _varint(value):
+    """Encodes an integer as a protobuf varint; negative values use 64-bit two's complement."""
+    if 0 <= value < 0x80:
+        return _SMALL_VARINTS[value]
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _tag(field_number, wire_type):
+    return _varint((field_number << 3) | wire_type)
+
+
+def _len_field(tag, payload):
+    return tag + _varint(len(payload)) + payload
+
+
+def _string_field(tag, s):
+    return _len_field(tag, s.encode("utf-8"))
+
+
+_pack_double = struct.Struct("<d").pack
+
+# Trace
+_TRACE_PACKET = _tag(1, _LENGTH_DELIMITED)
+
+# TracePacket
+_CLOCK_SNAPSHOT = _tag(6, _LENGTH_DELIMITED)
+_TIMESTAMP = _tag(8, _VARINT)
+_TRUSTED_PACKET_SEQUENCE_ID = _tag(10, _VARINT)
+_TRACK_EVENT = _tag(11, _LENGTH_DELIMITED)
+_INTERNED_DATA = _tag(12, _LENGTH_DELIMITED)
+_SEQUENCE_FLAGS = _tag(13, _VARINT)
+_TRACE_PACKET_DEFAULTS = _tag(59, _LENGTH_DELIMITED)
+_TRACK_DESCRIPTOR = _tag(60, _LENGTH_DELIMITED)
+
+# ClockSnapshot, Clock, TracePacketDefaults
+_CS_CLOCKS = _tag(1, _LENGTH_DELIMITED)
+_CLOCK_ID = _tag(1, _VARINT)
+_CLOCK_TIMESTAMP = _tag(2, _VARINT)
+_CLOCK_IS_INCREMENTAL = _tag(3, _VARINT)
+_TPD_TIMESTAMP_CLOCK_ID = _tag(58, _VARINT)
+
+# TrackEvent
+_TE_CATEGORY_IIDS = _tag(3, _VARINT)
+_TE_DEBUG_ANNOTATIONS = _tag(4, _LENGTH_DELIMITED)
+_TE_TYPE = _tag(9, _VARINT)
+_TE_NAME_IID = _tag(10, _VARINT)
+_TE_TRACK_UUID = _tag(11, _VARINT)
+_TE_COUNTER_VALUE = _tag(30, _VARINT)
+_TE_SOURCE_LOCATION_IID = _tag(34, _VARINT)
+_TE_FLOW_IDS = _tag(36, _VARINT)
+_TE_TERMINATING_FLOW_IDS = _tag(42, _VARINT)
+_TE_DOUBLE_COUNTER_VALUE = _tag(44, _FIXED64)
+
+# TrackDescriptor, ProcessDescriptor, ThreadDescriptor, CounterDescriptor
+_TD_UUID = _tag(1, _VARINT)
+_TD_NAME = _tag(2, _LENGTH_DELIMITED)
+_TD_PROCESS = _tag(3, _LENGTH_DELIMITED)
+_TD_THREAD = _tag(4, _LENGTH_DELIMITED)
+_TD_PARENT_UUID = _tag(5, _VARINT)
+_TD_COUNTER = _tag(8, _LENGTH_DELIMITED)
+_PD_PID = _tag(1, _VARINT)
+_PD_PROCESS_NAME = _tag(6, _LENGTH_DELIMITED)
+_THD_PID = _tag(1, _VARINT)
+_THD_TID = _tag(2, _VARINT)
+_THD_THREAD_NAME = _tag(5, _LENGTH_DELIMITED)
+_CD_UNIT_NAME = _tag(6, _LENGTH_DELIMITED)
+
+# InternedData, EventCategory, EventName, DebugAnnotationName, SourceLocation
+_ID_EVENT_CATEGORIES = _tag(1, _LENGTH_DELIMITED)
+_ID_EVENT_NAMES = _tag(2, _LENGTH_DELIMITED)
+_ID_DEBUG_ANNOTATION_NAMES = _tag(3, _LENGTH_DELIMITED)
+_ID_SOURCE_LOCATIONS = _tag(4, _LENGTH_DELIMITED)
+_IID = _tag(1, _VARINT)
+_NAME = _tag(2, _LENGTH_DELIMITED)
+_SL_IID = _tag(1, _VARINT)
+_SL_FILE_NAME = _tag(2, _LENGTH_DELIMITED)
+_SL_FUNCTION_NAME = _tag(3, _LENGTH_DELIMITED)
+_SL_LINE_NUMBER = _tag(4, _VARINT)
+
+# DebugAnnotation
+_DA_NAME_IID = _tag(1, _VARINT)
+_DA_BOOL_VALUE = _tag(2, _VARINT)
+_DA_INT_VALUE = _tag(4, _VARINT)
+_DA_DOUBLE_VALUE = _tag(5, _FIXED64)
+_DA_STRING_VALUE = _tag(6, _LENGTH_DELIMITED)
+_DA_DICT_ENTRIES = _tag(11, _LENGTH_DELIMITED)
+
+_TYPE_SLICE_BEGIN = _varint(pb2.TrackEvent.Type.TYPE_SLICE_BEGIN)
+_TYPE_SLICE_END = _varint(pb2.TrackEvent.Type.TYPE_SLICE_END)
+_TYPE_INSTANT = _varint(pb2.TrackEvent.Type.TYPE_INSTANT)
+_TYPE_COUNTER = _varint(pb2.TrackEvent.Type.TYPE_COUNTER)
+
+_SEQUENCE_ID_FIELD = _TRUSTED_PACKET_SEQUENCE_ID + _varint(SEQUENCE_ID)
+_INCREMENTAL_STATE_CLEARED_FIELD = _SEQUENCE_FLAGS + _varint(
+    pb2.TracePacket.SequenceFlags.SEQ_INCREMENTAL_STATE_CLEARED
+)
+_NEEDS_INCREMENTAL_STATE_FIELD = _SEQUENCE_FLAGS + _varint(
+    pb2.TracePacket.SequenceFlags.SEQ_NEEDS_INCREMENTAL_STATE
+)
+_INCREMENTAL_CLOCK_DEFAULTS_FIELD = _len_field(
+    _TRACE_PACKET_DEFAULTS, _TPD_TIMESTAMP_CLOCK_ID + _varint(INCREMENTAL_CLOCK_ID)
+)
+_VALUE_UNIT_FIELD = _len_field(_TD_COUNTER, _string_field(_CD_UNIT_NAME, "value"))
+
+
+def _annotation_value(v):
+    if isinstance(v, bool):
+        return _DA_BOOL_VALUE + _varint(int(v))
+    elif isinstance(v, int):
+        return _DA_INT_VALUE + _varint(v)
+    elif isinstance(v, float):
+        return _DA_DOUBLE_VALUE + _pack_double(v)
+    else:
+        return _string_field(_DA_STRING_VALUE, v)
+
+
+def _interned_location(iid, l: dto.Location):
+    location = (
+        _SL_IID
+        + _varint(iid)
+        + _string_field(_SL_FILE_NAME, l.file_name)
+        + _string_field(_SL_FUNCTION_NAME, l.function_name)
+        + _SL_LINE_NUMBER
+        + _varint(l.line_number)
+    )
+    return _len_field(_ID_SOURCE_LOCATIONS, location)
+
+
+def _interned_name(tag, iid, name):
+    return _len_field(tag, _IID + _varint(iid) + _string_field(_NAME, name))
+
+
+class DirectPerfettoWriter(PerfettoWriter):
+    """Writes the same perfetto trace as `PerfettoWriter`, encoding the protobuf bytes directly.
+
+    Only supports the subset of the Perfetto protos used by `PerfettoWriter`; the fields are
+    encoded in field-number order, so the output is byte-identical with the pb2 serialization."""
+
+    def __init__(
+        self,
+        filename,
+        delta_timestamps=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        queue_size=DEFAULT_QUEUE_SIZE,
+    ):
+        self._buf = bytearray()
+        super().__init__(filename, delta_timestamps, chunk_size, queue_size)
+
+    def start_sequence(self):
+        """Adds the first packet of the sequence, clearing the incremental state."""
+        packet = _SEQUENCE_ID_FIELD + _INCREMENTAL_STATE_CLEARED_FIELD
+        if self._delta_timestamps:
+            packet += _INCREMENTAL_CLOCK_DEFAULTS_FIELD
+        self._add_packet(packet)
+
+    def add_clock_snapshot(self, timestamp):
+        """Adds a clock snapshot setting the incremental clock to `timestamp`."""
+        trace_clock = _CLOCK_ID + _varint(TRACE_CLOCK_ID) + _CLOCK_TIMESTAMP + _varint(timestamp)
+        incremental_clock = (
+            _CLOCK_ID
+            + _varint(INCREMENTAL_CLOCK_ID)
+            + _CLOCK_TIMESTAMP
+            + _varint(timestamp)
+            + _CLOCK_IS_INCREMENTAL
+            + _varint(1)
+        )
+        clocks = _len_field(_CS_CLOCKS, trace_clock) + _len_field(_CS_CLOCKS, incremental_clock)
+        self._add_packet(_len_field(_CLOCK_SNAPSHOT, clocks) + _SEQUENCE_ID_FIELD)
+
+    def add_process_track(self, p: dto.ProcessTrack):
+        """Adds a process track to the trace."""
+        process = _PD_PID + _varint(p.pid) + _string_field(_PD_PROCESS_NAME, p.name)
+        descriptor = (
+            _TD_UUID
+            + _varint(p.track_uuid)
+            + _string_field(_TD_NAME, p.name)
+            + _len_field(_TD_PROCESS, process)
+        )
+        self._add_packet(_len_field(_TRACK_DESCRIPTOR, descriptor))
+
+    def add_thread(self, t: dto.Thread):
+        """Adds a thread track to the trace."""
+        thread = (
+            _THD_PID
+            + _varint(t.pid & 0x7FFFFFFF)
+            + _THD_TID
+            + _varint(t.tid & 0x7FFFFFFF)
+            + _string_field(_THD_THREAD_NAME, t.thread_name)
+        )
+        descriptor = _TD_UUID + _varint(t.track_uuid) + _len_field(_TD_THREAD, thread)
+        self._add_packet(_len_field(_TRACK_DESCRIPTOR, descriptor))
+
+    def add_counter_track(self, t: dto.CounterTrack):
+        """Adds a counter track to the trace."""
+        descriptor = _TD_UUID + _varint(t.track_uuid) + _string_field(_TD_NAME, t.name)
+        if t.parent_track != None:
+            descriptor += _TD_PARENT_UUID + _varint(t.parent_track)
+        descriptor += _VALUE_UNIT_FIELD
+        self._add_packet(_len_field(_TRACK_DESCRIPTOR, descriptor))
+
+    def add_location(self, l: dto.Location):
+        """Adds a location to the trace, as interned data."""
+        iid, new = self._source_locations.intern(l.locid)
+        if new:
+            self._add_packet(
+                _SEQUENCE_ID_FIELD
+                + _len_field(_INTERNED_DATA, _interned_location(iid, l))
+                + _NEEDS_INCREMENTAL_STATE_FIELD
+            )
+
+    def add_zone_start(
+        self, z: dto.ZoneStart, type=pb2.TrackEvent.Type.TYPE_SLICE_BEGIN
+    ):
+        """Adds a zone start event (or instant zone event) to the trace."""
+        timestamp = self._packet_timestamp(z.timestamp)
+        # The new interned data, per type (categories, names, annotation names, locations).
+        interned = ([], [], [], [])
+
+        name_iid, new = self._event_names.intern(z.name)
+        if new:
+            interned[1].append(_interned_name(_ID_EVENT_NAMES, name_iid, z.name))
+        location_field = b""
+        if z.loc:
+            iid, new = self._source_locations.intern(z.loc.locid)
+            if new:
+                interned[3].append(_interned_location(iid, z.loc))
+            location_field = _TE_SOURCE_LOCATION_IID + _varint(iid)
+
+        parts = []
+        if z.categories or z.params:
+            annotations = b""
+            if z.params:
+                annotation = [self._annotation_name_field(PARAMETERS_ANNOTATION, interned)]
+                for k, v in z.params.items():
+                    entry = self._annotation_name_field(k, interned) + _annotation_value(v)
+                    annotation.append(_len_field(_DA_DICT_ENTRIES, entry))
+                annotations = _len_field(_TE_DEBUG_ANNOTATIONS, b"".join(annotation))
+            for category in z.categories or ():
+                iid, new = self._categories.intern(category)
+                if new:
+                    interned[0].append(_interned_name(_ID_EVENT_CATEGORIES, iid, category))
+                parts.append(_TE_CATEGORY_IIDS + _varint(iid))
+            parts.append(annotations)
+        if type == pb2.TrackEvent.Type.TYPE_SLICE_BEGIN:
+            parts.append(_TE_TYPE + _TYPE_SLICE_BEGIN)
+        else:
+            parts.append(_TE_TYPE + _varint(type))
+        parts.append(_TE_NAME_IID + _varint(name_iid))
+        parts.append(_TE_TRACK_UUID + _varint(z.track_uuid))
+        parts.append(location_field)
+        if z.flows:
+            for id in z.flows:
+                parts.append(_TE_FLOW_IDS + _varint(id))
+        if z.flows_terminating:
+            for id in z.flows_terminating:
+                parts.append(_TE_TERMINATING_FLOW_IDS + _varint(id))
+        track_event = b"".join(parts)
+
+        packet = (
+            _TIMESTAMP
+            + _varint(timestamp)
+            + _SEQUENCE_ID_FIELD
+            + _len_field(_TRACK_EVENT, track_event)
+        )
+        if interned[0] or interned[1] or interned[2] or interned[3]:
+            interned_data = b"".join(b"".join(entries) for entries in interned)
+            packet += _len_field(_INTERNED_DATA, interned_data)
+        self._add_packet(packet + _NEEDS_INCREMENTAL_STATE_FIELD)
+
+    def _annotation_name_field(self, name, interned):
+        iid, new = self._annotation_names.intern(name)
+        if new:
+            interned[2].append(_interned_name(_ID_DEBUG_ANNOTATION_NAMES, iid, name))
+        return _DA_NAME_IID + _varint(iid)
+
+    def add_zone_end(self, z: dto.ZoneEnd):
+        """Adds a zone end event to the trace."""
+        timestamp = self._packet_timestamp(z.timestamp)
+        track_event = _TE_TYPE + _TYPE_SLICE_END + _TE_TRACK_UUID + _varint(z.track_uuid)
+        self._add_packet(
+            _TIMESTAMP
+            + _varint(timestamp)
+            + _SEQUENCE_ID_FIELD
+            + _len_field(_TRACK_EVENT, track_event)
+        )
+
+    def add_counter_value(self, v: dto.CounterValue):
+        """Adds a counter value to the trace."""
+        timestamp = self._packet_timestamp(v.timestamp)
+        track_event = _TE_TYPE + _TYPE_COUNTER + _TE_TRACK_UUID + _varint(v.track_uuid)
+        if isinstance(v.value, int):
+            track_event += _TE_COUNTER_VALUE + _varint(v.value)
+        elif isinstance(v.value, float):
+            track_event += _TE_DOUBLE_COUNTER_VALUE + _pack_double(v.value)
+        self._add_packet(
+            _TIMESTAMP
+            + _varint(timestamp)
+            + _SEQUENCE_ID_FIELD
+            + _len_field(_TRACK_EVENT, track_event)
+        )
+
+    def _add_packet(self, packet):
+        buf = self._buf
+        buf += _TRACE_PACKET
+        buf += _varint(len(packet))
+        buf += packet
+
+    def _has_pending(self):
+        return len(self._buf) > 0
+
+    def _chunk_full(self):
+        return len(self._buf) >= self._chunk_size
+
+    def _take_chunk(self):
+        chunk = self._buf
+        self._buf = bytearray()
+        return chunk
+
+    def _serialize_chunk(self, chunk):
+        return chunk
@@ -1,44 +1,212 @@
+import queue
+import threading
 import perfetto_trace_pb2 as pb2
 import lib.emit_dto as dto
+import lib.registry as registry
+
+# All the events are written on this sequence; interned data is only valid within a sequence.
+SEQUENCE_ID = 1
+
+_SEQ_INCREMENTAL_STATE_CLEARED = pb2.TracePacket.SequenceFlags.SEQ_INCREMENTAL_STATE_CLEARED
+_SEQ_NEEDS_INCREMENTAL_STATE = pb2.TracePacket.SequenceFlags.SEQ_NEEDS_INCREMENTAL_STATE
+
+# The name of the debug annotation holding the zone parameters.
+PARAMETERS_ANNOTATION = "Parameters"
+
+# With delta timestamps: the sequence-scoped incremental clock, the (default) trace clock it is
+# anchored to, and the maximum number of timestamps between two anchoring clock snapshots.
+INCREMENTAL_CLOCK_ID = 64
+TRACE_CLOCK_ID = pb2.BuiltinClock.BUILTIN_CLOCK_BOOTTIME
+REANCHOR_INTERVAL = 10_000
+
+# The (approximate) size of the chunks handed to the writer thread, and how many chunks can wait
+# to be written before the producer blocks.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_QUEUE_SIZE = 4
+
+
+class InternTable:
+    """Assigns interning ids (iids) to values, for one type of interned data."""
+
+    def __init__(self):
+        self._iids = {}
+
+    def intern(self, key):
+        """Returns the iid for `key`, and whether the key is interned for the first time."""
+        iid = self._iids.get(key)
+        if iid is None:
+            iid = len(self._iids) + 1
+            self._iids[key] = iid
+            return iid, True
+        return iid, False
+
+
+class _BackgroundWriter:
+    """Serializes and writes chunks of packets to a file, on a dedicated thread.
+
+    The chunks are passed through a bounded queue; errors of the writer thread are re-raised on
+    the producer thread, on the next call."""
+
+    def __init__(self, f, serialize, queue_size):
+        self._f = f
+        self._serialize = serialize
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name="perfetto-writer", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, chunk):
+        """Queues `chunk` for writing; blocks while the queue is full."""
+        self._check_error()
+        self._queue.put(chunk)
+
+    def flush(self):
+        """Waits until all the queued chunks are written, and flushes the file."""
+        self._queue.join()
+        self._check_error()
+        self._f.flush()
+
+    def close(self):
+        """Writes the queued chunks and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+        self._check_error()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            try:
+                if chunk is None:
+                    return
+                if self._error is None:
+                    self._f.write(self._serialize(chunk))
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
 
 
 class PerfettoWriter:
-    """Knows how to write a perfetto trace file."""
+    """Knows how to write a perfetto trace file.
+
+    Event names, categories, debug annotation names and source locations are interned: each of
+    them is emitted once, in the `interned_data` of the first packet using it, and then referred
+    by iid.
+
+    With `delta_timestamps`, the packets use an incremental clock: each timestamp is written as the
+    delta from the previous one. The clock is re-anchored with a clock snapshot when time goes
+    backwards, and every `REANCHOR_INTERVAL` timestamps.
 
-    def __init__(self, filename):
+    Packets are grouped in chunks of about `chunk_size` bytes; the chunks are serialized and
+    written by a background thread, so that the file I/O overlaps with producing the events."""
+
+    def __init__(
+        self,
+        filename,
+        delta_timestamps=False,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        queue_size=DEFAULT_QUEUE_SIZE,
+    ):
         self._trace = pb2.Trace()
+        self._packet_size = 64  # average size of a serialized packet, updated by the writer thread
+        self._chunk_size = chunk_size
         self._filename = filename
         self._f = open(filename, "wb")
+        self._writer = _BackgroundWriter(self._f, self._serialize_chunk, queue_size)
+        self._event_names = InternTable()
+        self._categories = InternTable()
+        self._annotation_names = InternTable()
+        self._source_locations = InternTable()
+        self._delta_timestamps = delta_timestamps
+        self._last_timestamp = None
+        self._timestamps_since_anchor = 0
+        # Emit DTO class -> bound method adding it to the trace.
+        self._add_methods = {
+            cls: getattr(self, name) for cls, name in registry.WRITER_METHODS.items()
+        }
+        self.start_sequence()
+
+    def start_sequence(self):
+        """Adds the first packet of the sequence, clearing the incremental state."""
+        packet = self._trace.packet.add()
+        packet.trusted_packet_sequence_id = SEQUENCE_ID
+        packet.sequence_flags = _SEQ_INCREMENTAL_STATE_CLEARED
+        if self._delta_timestamps:
+            packet.trace_packet_defaults.timestamp_clock_id = INCREMENTAL_CLOCK_ID
+
+    def add_clock_snapshot(self, timestamp):
+        """Adds a clock snapshot setting the incremental clock to `timestamp`."""
+        packet = self._trace.packet.add()
+        clock = packet.clock_snapshot.clocks.add()
+        clock.clock_id = TRACE_CLOCK_ID
+        clock.timestamp = timestamp
+        clock = packet.clock_snapshot.clocks.add()
+        clock.clock_id = INCREMENTAL_CLOCK_ID
+        clock.timestamp = timestamp
+        clock.is_incremental = True
+        packet.trusted_packet_sequence_id = SEQUENCE_ID
+
+    def _packet_timestamp(self, timestamp):
+        """Returns the value for the timestamp field of the next packet.
+
+        Must be called before adding the packet, as it may add a clock snapshot."""
+        if not self._delta_timestamps:
+            return timestamp
+        last = self._last_timestamp
+        self._last_timestamp = timestamp
+        if (
+            last is None
+            or timestamp < last
+            or self._timestamps_since_anchor >= REANCHOR_INTERVAL
+        ):
+            self.add_clock_snapshot(timestamp)
+            self._timestamps_since_anchor = 0
+            return 0
+        self._timestamps_since_anchor += 1
+        return timestamp - last
 
     def close(self):
-        self._write_chunk()
-        self._f.close()
+        try:
+            if self._has_pending():
+                self._write_chunk()
+            self._writer.close()
+        finally:
+            self._f.close()
+
+    def flush(self):
+        """Writes the pending packets, so that the file contains a valid trace so far."""
+        if self._has_pending():
+            self._write_chunk()
+        self._writer.flush()
 
     def add(self, item):
         """Add an emit dto object to the trace."""
-        if isinstance(item, dto.ProcessTrack):
-            self.add_process_track(item)
-        elif isinstance(item, dto.Thread):
-            self.add_thread(item)
-        elif isinstance(item, dto.CounterTrack):
-            self.add_counter_track(item)
-        elif isinstance(item, dto.Location):
-            self.add_location(item)
-        elif isinstance(item, dto.ZoneInstant):
-            self.add_zone_start(item, pb2.TrackEvent.Type.TYPE_INSTANT)
-        elif isinstance(item, dto.ZoneStart):
-            self.add_zone_start(item)
-        elif isinstance(item, dto.ZoneEnd):
-            self.add_zone_end(item)
-        elif isinstance(item, dto.CounterValue):
-            self.add_counter_value(item)
-        else:
-            raise ValueError(f"Unknown object {item}")
-        
+        self._add_item(item)
+
         # Stream to the file, instead of accumulating in memory.
-        if len(self._trace.packet) > 100:
+        if self._chunk_full():
+            self._write_chunk()
+
+    def add_batch(self, items):
+        """Add a list of emit dto objects to the trace."""
+        add_item = self._add_item
+        for item in items:
+            add_item(item)
+        if self._chunk_full():
             self._write_chunk()
 
+    def _add_item(self, item):
+        add = self._add_methods.get(type(item))
+        if add is None:
+            raise ValueError(f"Unknown object {item}")
+        add(item)
+
     def add_process_track(self, p: dto.ProcessTrack):
         """Adds a thread track to the trace."""
         packet = self._trace.packet.add()
@@ -65,35 +233,39 @@ class PerfettoWriter:
         packet.track_descriptor.counter.unit_name = "value"
 
     def add_location(self, l: dto.Location):
-        """Adds a location to the trace."""
-        packet = self._trace.packet.add()
-        location = packet.interned_data.source_locations.add()
-        location.iid = l.locid
-        location.file_name = l.file_name
-        location.function_name = l.function_name
-        location.line_number = l.line_number
+        """Adds a location to the trace, as interned data."""
+        iid, new = self._source_locations.intern(l.locid)
+        if new:
+            packet = self._trace.packet.add()
+            packet.trusted_packet_sequence_id = SEQUENCE_ID
+            self._add_interned_location(packet, iid, l)
+            packet.sequence_flags = _SEQ_NEEDS_INCREMENTAL_STATE
 
     def add_zone_start(
         self, z: dto.ZoneStart, type=pb2.TrackEvent.Type.TYPE_SLICE_BEGIN
     ):
         """Adds a zone start event (or instant zone event) to the trace."""
+        timestamp = self._packet_timestamp(z.timestamp)
         packet = self._trace.packet.add()
-        packet.timestamp = z.timestamp
-        packet.trusted_packet_sequence_id = 0
+        packet.timestamp = timestamp
+        packet.trusted_packet_sequence_id = SEQUENCE_ID
+        packet.sequence_flags = _SEQ_NEEDS_INCREMENTAL_STATE
         packet.track_event.type = type
         packet.track_event.track_uuid = z.track_uuid
-        packet.track_event.name = z.name
+        packet.track_event.name_iid = self._intern_name(
+            self._event_names, packet.interned_data.event_names, z.name
+        )
         if z.loc:
-            packet.track_event.source_location.iid = z.loc.locid
-            packet.track_event.source_location.file_name = z.loc.file_name
-            packet.track_event.source_location.function_name = z.loc.function_name
-            packet.track_event.source_location.line_number = z.loc.line_number
+            iid, new = self._source_locations.intern(z.loc.locid)
+            if new:
+                self._add_interned_location(packet, iid, z.loc)
+            packet.track_event.source_location_iid = iid
         if z.params:
             annotation = packet.track_event.debug_annotations.add()
-            annotation.name = "Parameters"
+            annotation.name_iid = self._intern_annotation_name(packet, PARAMETERS_ANNOTATION)
             for k, v in z.params.items():
                 entry = annotation.dict_entries.add()
-                entry.name = k
+                entry.name_iid = self._intern_annotation_name(packet, k)
                 if isinstance(v, bool):
                     entry.bool_value = v
                 elif isinstance(v, int):
@@ -102,26 +274,57 @@ class PerfettoWriter:
                     entry.double_value = v
                 else:
                     entry.string_value = v
-        for id in z.flows:
-            packet.track_event.flow_ids.append(id)
-        for id in z.flows_terminating:
-            packet.track_event.terminating_flow_ids.append(id)
-        for category in z.categories:
-            packet.track_event.categories.append(category)
+        if z.flows:
+            packet.track_event.flow_ids.extend(z.flows)
+        if z.flows_terminating:
+            packet.track_event.terminating_flow_ids.extend(z.flows_terminating)
+        if z.categories:
+            for category in z.categories:
+                iid = self._intern_name(
+                    self._categories, packet.interned_data.event_categories, category
+                )
+                packet.track_event.category_iids.append(iid)
+
+    def _intern_name(self, table, interned_entries, name):
+        """Interns a name (event name, category), adding it to `interned_entries` if new."""
+        iid, new = table.intern(name)
+        if new:
+            entry = interned_entries.add()
+            entry.iid = iid
+            entry.name = name
+        return iid
+
+    def _intern_annotation_name(self, packet, name):
+        return self._intern_name(
+            self._annotation_names, packet.interned_data.debug_annotation_names, name
+        )
+
+    def _add_interned_location(self, packet, iid, l: dto.Location):
+        location = packet.interned_data.source_locations.add()
+        location.iid = iid
+        location.file_name = l.file_name
+        location.function_name = l.function_name
+        location.line_number = l.line_number
+
+    def add_zone_instant(self, z: dto.ZoneInstant):
+        """Adds an instant zone event to the trace."""
+        self.add_zone_start(z, pb2.TrackEvent.Type.TYPE_INSTANT)
 
     def add_zone_end(self, z: dto.ZoneEnd):
         """Adds a zone end event to the trace."""
+        timestamp = self._packet_timestamp(z.timestamp)
         packet = self._trace.packet.add()
-        packet.timestamp = z.timestamp
-        packet.trusted_packet_sequence_id = 0
+        packet.timestamp = timestamp
+        packet.trusted_packet_sequence_id = SEQUENCE_ID
         packet.track_event.type = pb2.TrackEvent.Type.TYPE_SLICE_END
         packet.track_event.track_uuid = z.track_uuid
 
     def add_counter_value(self, v: dto.CounterValue):
         """Adds a counter value to the trace."""
+        timestamp = self._packet_timestamp(v.timestamp)
         packet = self._trace.packet.add()
-        packet.timestamp = v.timestamp
-        packet.trusted_packet_sequence_id = 0
+        packet.timestamp = timestamp
+        packet.trusted_packet_sequence_id = SEQUENCE_ID
         packet.track_event.type = pb2.TrackEvent.Type.TYPE_COUNTER
         packet.track_event.track_uuid = v.track_uuid
         if isinstance(v.value, int):
@@ -130,6 +333,35 @@ class PerfettoWriter:
             packet.track_event.double_counter_value = v.value
 
     def _write_chunk(self):
-        self._f.write(self._trace.SerializeToString())
-        self._f.flush()
+        """Hands the pending packets to the writer thread."""
+        self._writer.put(self._take_chunk())
+
+    def _has_pending(self):
+        return len(self._trace.packet) > 0
+
+    def _chunk_full(self):
+        # Computing the exact size of the packets is expensive; estimate it.
+        return len(self._trace.packet) * self._packet_size >= self._chunk_size
+
+    def _take_chunk(self):
+        chunk = self._trace
         self._trace = pb2.Trace()
+        return chunk
+
+    def _serialize_chunk(self, chunk):
+        data = chunk.SerializeToString()
+        self._packet_size = max(1, len(data) // len(chunk.packet))
+        return data
+
+
+for _dto_class, _method_name in (
+    (dto.ProcessTrack, "add_process_track"),
+    (dto.Thread, "add_thread"),
+    (dto.CounterTrack, "add_counter_track"),
+    (dto.Location, "add_location"),
+    (dto.ZoneInstant, "add_zone_instant"),
+    (dto.ZoneStart, "add_zone_start"),
+    (dto.ZoneEnd, "add_zone_end"),
+    (dto.CounterValue, "add_counter_value"),
+):
+    registry.register_writer_method(_dto_class, _method_name)
@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+import queue
+import threading
+import time
+
+# Marks the end of the items flowing between two stages.
+_END = object()
+
+# How often a blocked stage checks whether the pipeline was aborted (seconds).
+_POLL_INTERVAL = 0.1
+
+
+class _Aborted(Exception):
+    """Raised in a stage when another stage failed."""
+
+
+@dataclass
+class StageStats:
+    """Describes how a pipeline stage spent its time."""
+
+    name: str
+    items: int = 0
+    elapsed: float = 0.0
+    input_wait: float = 0.0  # time spent waiting for the previous stage
+    output_stall: float = 0.0  # time spent blocked on the full queue of the next stage
+
+    @property
+    def utilization(self):
+        """The fraction of the time the stage did actual work."""
+        if self.elapsed <= 0:
+            return 0.0
+        busy = self.elapsed - self.input_wait - self.output_stall
+        return max(0.0, busy / self.elapsed)
+
+    def __str__(self):
+        return (
+            f"{self.name:>6}: {self.utilization:4.0%} busy, {self.items:,} items, "
+            f"waited {self.input_wait:.2f}s for input, "
+            f"stalled {self.output_stall:.2f}s on a full queue"
+        )
+
+
+class _Channel:
+    """A bounded queue of item batches, between two stages."""
+
+    def __init__(self, queue_size, abort: threading.Event):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._abort = abort
+
+    def put(self, batch, stats: StageStats):
+        """Sends a batch to the next stage; blocks while the queue is full."""
+        try:
+            self._queue.put_nowait(batch)
+            return
+        except queue.Full:
+            pass
+        start = time.perf_counter()
+        while True:
+            try:
+                self._queue.put(batch, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                if self._abort.is_set():
+                    raise _Aborted()
+        stats.output_stall += time.perf_counter() - start
+
+    def batches(self, stats: StageStats):
+        """Yields the batches sent by the previous stage."""
+        while True:
+            start = time.perf_counter()
+            while True:
+                try:
+                    batch = self._queue.get(timeout=_POLL_INTERVAL)
+                    break
+                except queue.Empty:
+                    if self._abort.is_set():
+                        raise _Aborted()
+            stats.input_wait += time.perf_counter() - start
+            if batch is _END:
+                return
+            yield batch
+
+
+def _send_batches(batches, channel: _Channel, stats: StageStats):
+    """Sends the lists of items in `batches` to `channel`."""
+    for batch in batches:
+        stats.items += len(batch)
+        channel.put(batch, stats)
+    channel.put(_END, stats)
+
+
+def run_pipeline(parse_batches, emit_batches, writer, queue_size=16):
+    """Runs the conversion as a pipeline of three stages: parse, emit and write.
+
+    The parsing (iterating `parse_batches`) and the emitting (iterating `emit_batches(batches)`)
+    run on their own threads; the emit DTOs are added to `writer` on the calling thread. The stages
+    exchange lists of items over queues holding at most `queue_size` lists, so that a slow stage
+    blocks the ones before it. The items reach the writer in the same order as with the serial
+    conversion.
+
+    Returns the `StageStats` of the three stages."""
+    abort = threading.Event()
+    errors = []
+    parsed = _Channel(queue_size, abort)
+    emitted = _Channel(queue_size, abort)
+    stats = [StageStats("parse"), StageStats("emit"), StageStats("write")]
+
+    def run_stage(stage_stats, batches, channel):
+        start = time.perf_counter()
+        try:
+            _send_batches(batches, channel, stage_stats)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            abort.set()
+        stage_stats.elapsed = time.perf_counter() - start
+
+    threads = [
+        threading.Thread(
+            target=run_stage,
+            args=(stats[0], parse_batches, parsed),
+            name="pipeline-parse",
+            daemon=True,
+        ),
+        threading.Thread(
+            target=run_stage,
+            args=(stats[1], emit_batches(parsed.batches(stats[1])), emitted),
+            name="pipeline-emit",
+            daemon=True,
+        ),
+    ]
+    for t in threads:
+        t.start()
+
+    write_stats = stats[2]
+    start = time.perf_counter()
+    try:
+        for batch in emitted.batches(write_stats):
+            writer.add_batch(batch)
+            write_stats.items += len(batch)
+    except _Aborted:
+        pass
+    except BaseException:
+        abort.set()
+        raise
+    finally:
+        write_stats.elapsed = time.perf_counter() - start
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+    return stats
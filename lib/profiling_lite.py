@@ -0,0 +1,610 @@
+# Low-overhead tracing for Python code, writing the binary traces of `cxx/profiling-lite.hpp`.
+# Only depends on the standard library, so that it can be copied into other projects.
+
+import atexit
+from collections import deque
+import functools
+import struct
+import sys
+import threading
+import time
+
+# Packet types, as in `cxx/profiling-lite.cpp`.
+_INIT = 16
+_STATIC_STRING = 17
+_LOCATION = 18
+_STACK = 19
+_THREAD_NAME = 20
+_ZONE_START = 21
+_ZONE_END = 22
+_ZONE_DYNAMIC_NAME = 23
+_ZONE_PARAM_BOOL = 24
+_ZONE_PARAM_INT = 25
+_ZONE_PARAM_UINT = 26
+_ZONE_PARAM_DOUBLE = 27
+_ZONE_PARAM_STRING = 28
+_ZONE_FLOW = 29
+_ZONE_FLOW_TERMINATE = 30
+_ZONE_CATEGORY = 31
+_COUNTER_TRACK = 32
+_COUNTER_VALUE_INT = 33
+_COUNTER_VALUE_DOUBLE = 34
+
+# The packet layouts (`#pragma pack(1)`), including the type byte. For dynamic-size packets, the
+# last field is the size of the UTF-8 string that follows.
+_PACK_INIT = struct.Struct("<B4sI").pack
+_PACK_STATIC_STRING = struct.Struct("<BQH").pack
+_PACK_LOCATION = struct.Struct("<B4QI").pack
+_PACK_STACK = struct.Struct("<BQQH").pack
+_PACK_THREAD_NAME = struct.Struct("<BQH").pack
+_PACK_COUNTER_TRACK = struct.Struct("<BQH").pack
+_pack_zone_start = struct.Struct("<B4Q").pack_into
+_pack_zone_end = struct.Struct("<BQQ").pack_into
+_pack_zone_param_int = struct.Struct("<BQQq").pack_into
+_pack_zone_param_double = struct.Struct("<BQQd").pack_into
+_ZONE_DYNAMIC_NAME_LAYOUT = struct.Struct("<BQH")
+_ZONE_PARAM_BOOL_LAYOUT = struct.Struct("<BQQB")
+_ZONE_PARAM_INT_LAYOUT = struct.Struct("<BQQq")
+_ZONE_PARAM_UINT_LAYOUT = struct.Struct("<BQQQ")
+_ZONE_PARAM_DOUBLE_LAYOUT = struct.Struct("<BQQd")
+_ZONE_PARAM_STRING_LAYOUT = struct.Struct("<BQQH")
+_ZONE_FLOW_LAYOUT = struct.Struct("<BQQ")
+_ZONE_CATEGORY_LAYOUT = struct.Struct("<BQQ")
+_COUNTER_VALUE_INT_LAYOUT = struct.Struct("<BQQq")
+_COUNTER_VALUE_DOUBLE_LAYOUT = struct.Struct("<BQQd")
+
+# Fixed-size packets are written if there is room for the largest of them; the chunk is replaced
+# right after.
+_MAX_STATIC_PACKET_SIZE = 64
+# Strings are truncated to fit their 16-bit size.
+_MAX_STRING_SIZE = 0xFFFF
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 256 * 1024
+# How often the background thread looks for full chunks to write (seconds).
+_FLUSH_INTERVAL = 0.1
+
+# The synthetic stacks of the threads; zones are `_ZONE_STEP` bytes apart in them.
+_STACK_SIZE = 1024 * 1024
+_ZONE_STEP = 16
+
+_now = time.monotonic_ns  # same clock as `std::chrono::steady_clock`
+_get_ident = threading.get_ident
+
+
+def now():
+    """Returns the current timestamp, in nanoseconds."""
+    return _now()
+
+
+def get_current_thread():
+    """Returns the id of the current thread."""
+    return _get_ident()
+
+
+def _encode(text):
+    data = text.encode("utf-8")
+    if len(data) > _MAX_STRING_SIZE:
+        # Don't cut a character in the middle.
+        data = data[:_MAX_STRING_SIZE].decode("utf-8", "ignore").encode("utf-8")
+    return data
+
+
+# The packets defining strings, locations, threads, stacks and counter tracks, in order. They are
+# kept for the whole life of the process, so that any capture starts with all of them.
+_definitions = []
+_string_ids = {}
+_definitions_lock = threading.Lock()
+
+
+def _define(packet):
+    _definitions.append(packet)
+
+
+def _string_id(text):
+    """Returns the id of a static string, defining it on first use."""
+    string_id = _string_ids.get(text)
+    if string_id is None:
+        with _definitions_lock:
+            string_id = _string_ids.get(text)
+            if string_id is None:
+                string_id = len(_string_ids) + 1
+                data = _encode(text)
+                _define(_PACK_STATIC_STRING(_STATIC_STRING, string_id, len(data)) + data)
+                _string_ids[text] = string_id
+    return string_id
+
+
+class location:
+    """A (static) location in the code; what a zone displays by default.
+
+    The missing fields are taken from the code calling the constructor."""
+
+    __slots__ = ("id", "name", "function", "file", "line")
+
+    _next_id = 1
+
+    def __init__(self, name=None, function=None, file=None, line=None):
+        if function is None or file is None or line is None:
+            frame = sys._getframe(1)
+            function = function or frame.f_code.co_qualname
+            file = file or frame.f_code.co_filename
+            line = line or frame.f_lineno
+        self.name = name or function
+        self.function = function
+        self.file = file
+        self.line = line
+        with _definitions_lock:
+            self.id = location._next_id
+            location._next_id += 1
+        _define(
+            _PACK_LOCATION(
+                _LOCATION,
+                self.id,
+                _string_id(self.name),
+                _string_id(self.function),
+                _string_id(self.file),
+                self.line,
+            )
+        )
+
+
+def define_stack(begin, end, name):
+    """Defines a stack; zones with stack pointers in [`begin`, `end`) belong to it."""
+    data = _encode(name)
+    _define(_PACK_STACK(_STACK, begin, end, len(data)) + data)
+
+
+def set_thread_name(tid, name):
+    data = _encode(name)
+    _define(_PACK_THREAD_NAME(_THREAD_NAME, tid, len(data)) + data)
+
+
+def define_counter_track(tid, name):
+    """Defines a counter track, identified by `tid`."""
+    data = _encode(name)
+    _define(_PACK_COUNTER_TRACK(_COUNTER_TRACK, tid, len(data)) + data)
+
+
+def _new_stack(name):
+    """Defines a new synthetic stack, named `name` and its number; returns its end.
+
+    Zones start at the end of the stack, and move down by `_ZONE_STEP`."""
+    global _num_stacks
+    with _state_lock:
+        _num_stacks += 1
+        number = _num_stacks
+    stack_begin = number * _STACK_SIZE
+    define_stack(stack_begin, stack_begin + _STACK_SIZE, f"{name} {number}")
+    return stack_begin + _STACK_SIZE
+
+
+class _ThreadState:
+    """The chunk of the ring buffer owned by a thread, and the zones open on the thread.
+
+    Python has no stack pointers to identify zones with: each thread gets a synthetic stack, and
+    `ptr` moves down this stack by `_ZONE_STEP` for each open zone."""
+
+    __slots__ = ("profiler", "tid", "chunk", "buf", "pos", "limit", "ptr", "instants")
+
+    def __init__(self):
+        self.tid = _get_ident()
+        with _state_lock:
+            _states.append(self)
+        self.ptr = _new_stack("Stack")
+        set_thread_name(self.tid, threading.current_thread().name)
+        # Not attached to a capture yet: the first event fills this chunk and attaches it.
+        self.profiler = None
+        self._set_chunk((bytearray(_MAX_STATIC_PACKET_SIZE), 0, _MAX_STATIC_PACKET_SIZE))
+        self.instants = []
+
+    def _set_chunk(self, chunk):
+        self.chunk = chunk
+        self.buf, self.pos, end = chunk
+        self.limit = end - _MAX_STATIC_PACKET_SIZE
+
+    def next_chunk(self):
+        """Hands over the current chunk to the background thread, and takes a new one.
+
+        Also called on the first event after the capture started or stopped (`limit` is -1)."""
+        profiler = self.profiler
+        if profiler is None or profiler.closed:
+            profiler = self.profiler = _profiler
+            if profiler is None:
+                profiler = self.profiler = _auto_start()
+            if profiler is None:
+                # Not capturing; drop the events.
+                self._set_chunk((self.buf, 0, len(self.buf)))
+                self.limit = -1
+                return
+        profiler.hand_over(self.chunk, self.pos)
+        self._set_chunk(profiler.take_chunk())
+
+    def detach(self):
+        """Makes the next event call `next_chunk`; the events after `pos` go to the next capture."""
+        self._set_chunk((self.buf, self.pos, self.chunk[2]))
+        self.limit = -1
+
+    def reserve(self, size):
+        """Makes room for a dynamic-size packet of `size` bytes; returns its position."""
+        if self.pos + size > self.chunk[2]:
+            self.next_chunk()
+            if self.pos + size > self.chunk[2]:
+                # Larger than a chunk: gets a buffer of its own, handed over by the next event.
+                if self.profiler is not None:
+                    self.profiler.hand_over(self.chunk, self.pos)
+                self._set_chunk((bytearray(size), 0, size))
+                self.limit = -1
+        pos = self.pos
+        self.pos = pos + size
+        return pos
+
+
+class _Profiler:
+    """Owns the ring buffer, and the background thread writing it to the capture file.
+
+    The ring buffer is split in chunks; each thread packs its events in a chunk it owns, so the
+    threads don't need locks. Full chunks are handed over to the background thread, which writes
+    them and puts them back in the free list."""
+
+    def __init__(self, filename, buffer_size, chunk_size):
+        self._file = open(filename, "wb")
+        self._file.write(_PACK_INIT(_INIT, b"PROF", 1))
+        self._chunk_size = chunk_size
+        self._ring = bytearray(max(buffer_size, chunk_size))
+        self._free = deque(
+            (self._ring, start, start + chunk_size)
+            for start in range(0, len(self._ring) - chunk_size + 1, chunk_size)
+        )
+        self._full = deque()
+        self._num_definitions_written = 0
+        self._wakeup = threading.Event()
+        self._write_lock = threading.Lock()
+        self.closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="profiling-lite-writer", daemon=True
+        )
+        self._thread.start()
+
+    def take_chunk(self):
+        """Returns a free chunk: (buffer, start, end). Allocates one if the ring is full."""
+        try:
+            return self._free.popleft()
+        except IndexError:
+            return bytearray(self._chunk_size), 0, self._chunk_size
+
+    def hand_over(self, chunk, end):
+        """Queues the chunk, used up to `end`, to be written to the capture file."""
+        self._full.append((chunk, end))
+        self._wakeup.set()
+
+    def _write_definitions(self):
+        definitions = _definitions[self._num_definitions_written :]
+        self._num_definitions_written += len(definitions)
+        self._file.write(b"".join(definitions))
+
+    def write_pending(self):
+        """Writes the new definitions and the full chunks to the capture file."""
+        with self._write_lock:
+            if self._file.closed:
+                return
+            while True:
+                # The definitions go first, so that they precede the zones using them.
+                self._write_definitions()
+                try:
+                    chunk, end = self._full.popleft()
+                except IndexError:
+                    break
+                buf, start, _ = chunk
+                with memoryview(buf) as view:
+                    self._file.write(view[start:end])
+                if buf is self._ring:
+                    self._free.append(chunk)
+            self._file.flush()
+
+    def _run(self):
+        while not self.closed:
+            self._wakeup.wait(_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.write_pending()
+
+    def close(self, states):
+        """Hands over the chunks of all the threads, writes everything and closes the file."""
+        self.closed = True
+        for state in states:
+            if state.profiler is self:
+                self.hand_over(state.chunk, state.pos)
+                state.detach()
+        self._wakeup.set()
+        self._thread.join()
+        self.write_pending()
+        with self._write_lock:
+            self._file.close()
+
+
+_profiler = None
+_states = []  # all the `_ThreadState` objects, including the ones of finished threads
+_state_lock = threading.Lock()
+_num_stacks = 0
+_auto_start_enabled = True
+
+
+class _Local(threading.local):
+    def __init__(self):
+        self.state = _ThreadState()
+
+
+_local = _Local()
+
+
+def start(
+    filename="capture.bin-trace", buffer_size=DEFAULT_BUFFER_SIZE, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """Starts a capture, written to `filename`; stops the previous capture, if any.
+
+    Without a call to `start()`, the first event starts a capture to "capture.bin-trace". The
+    events are kept in a ring buffer of `buffer_size` bytes, split in chunks of `chunk_size`
+    bytes; if the background thread falls behind, more chunks are allocated."""
+    global _profiler, _auto_start_enabled
+    stop()
+    with _state_lock:
+        _auto_start_enabled = False
+        _profiler = _Profiler(filename, buffer_size, chunk_size)
+
+
+def _auto_start():
+    """Starts the default capture on the first event; returns the current profiler."""
+    global _profiler, _auto_start_enabled
+    with _state_lock:
+        if _profiler is None and _auto_start_enabled:
+            _auto_start_enabled = False
+            _profiler = _Profiler("capture.bin-trace", DEFAULT_BUFFER_SIZE, DEFAULT_CHUNK_SIZE)
+        return _profiler
+
+
+def stop():
+    """Writes all the pending events, and closes the capture file.
+
+    The capture should be stopped while no zones are open; the events recorded while stopping
+    may be lost. Later events are dropped, until `start()` is called again."""
+    global _profiler, _auto_start_enabled
+    with _state_lock:
+        profiler, _profiler = _profiler, None
+        _auto_start_enabled = False
+        states = list(_states)
+    if profiler:
+        profiler.close(states)
+
+
+def flush():
+    """Writes the full chunks and the chunk of the calling thread to the capture file."""
+    profiler = _profiler
+    if profiler:
+        state = _local.state
+        if state.profiler is profiler:
+            state.next_chunk()
+        profiler.write_pending()
+
+
+atexit.register(stop)
+
+
+# (name, function, file, line) -> location id, for the zones created without a `location`.
+_implicit_locations = {}
+
+
+def _implicit_location_id(name, function, file, line):
+    key = (name, function, file, line)
+    loc_id = _implicit_locations.get(key)
+    if loc_id is None:
+        loc_id = _implicit_locations[key] = location(name, function, file, line).id
+    return loc_id
+
+
+def _pack_zone_param(state, name_id, value):
+    if isinstance(value, bool):
+        _ZONE_PARAM_BOOL_LAYOUT.pack_into(
+            state.buf, state.pos, _ZONE_PARAM_BOOL, state.ptr, name_id, value
+        )
+        state.pos += _ZONE_PARAM_BOOL_LAYOUT.size
+    elif isinstance(value, int) and value >= 2**63:
+        _ZONE_PARAM_UINT_LAYOUT.pack_into(
+            state.buf, state.pos, _ZONE_PARAM_UINT, state.ptr, name_id, value
+        )
+        state.pos += _ZONE_PARAM_UINT_LAYOUT.size
+    elif isinstance(value, (int, float)):
+        layout, packet_type = (
+            (_ZONE_PARAM_INT_LAYOUT, _ZONE_PARAM_INT)
+            if isinstance(value, int)
+            else (_ZONE_PARAM_DOUBLE_LAYOUT, _ZONE_PARAM_DOUBLE)
+        )
+        layout.pack_into(state.buf, state.pos, packet_type, state.ptr, name_id, value)
+        state.pos += layout.size
+    else:
+        data = _encode(str(value))
+        pos = state.reserve(_ZONE_PARAM_STRING_LAYOUT.size + len(data))
+        _ZONE_PARAM_STRING_LAYOUT.pack_into(
+            state.buf, pos, _ZONE_PARAM_STRING, state.ptr, name_id, len(data)
+        )
+        pos += _ZONE_PARAM_STRING_LAYOUT.size
+        state.buf[pos : pos + len(data)] = data
+    if state.pos > state.limit:
+        state.next_chunk()
+
+
+def _pack_zone_id(layout, packet_type, value):
+    """Packs a packet made of the innermost zone and an id (flow, category)."""
+    state = _local.state
+    layout.pack_into(state.buf, state.pos, packet_type, state.ptr, value)
+    state.pos += layout.size
+    if state.pos > state.limit:
+        state.next_chunk()
+
+
+class zone:
+    """Marks a zone of code, as a context manager or as a function decorator.
+
+    `loc` is a `location`, or the name of the zone (by default, the name of the function); the
+    rest of the location is taken from the code creating the zone, or from the decorated
+    function. Zone objects hold no state while open, so they are best created once and reused,
+    from any thread, even recursively.
+
+    The methods adding details (`set_param`, ...) apply to the innermost open zone of the thread."""
+
+    __slots__ = ("_loc_id", "_name")
+
+    def __init__(self, loc=None):
+        if isinstance(loc, location):
+            self._loc_id = loc.id
+            self._name = None
+        else:
+            frame = sys._getframe(1)
+            code = frame.f_code
+            self._loc_id = _implicit_location_id(
+                loc, code.co_qualname, code.co_filename, frame.f_lineno
+            )
+            self._name = loc
+
+    def __call__(self, func):
+        code = func.__code__
+        self._loc_id = _implicit_location_id(
+            self._name or func.__qualname__,
+            func.__qualname__,
+            code.co_filename,
+            code.co_firstlineno,
+        )
+
+        loc_id = self._loc_id
+
+        # `with self`, inlined: saves the calls to `__enter__` and `__exit__`, and a lookup of the
+        # thread state.
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            state = _local.state
+            ptr = state.ptr - _ZONE_STEP
+            state.ptr = ptr
+            pos = state.pos
+            _pack_zone_start(state.buf, pos, _ZONE_START, ptr, state.tid, _now(), loc_id)
+            state.pos = pos = pos + 33
+            if pos > state.limit:
+                state.next_chunk()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                state.ptr = ptr + _ZONE_STEP
+                pos = state.pos
+                _pack_zone_end(state.buf, pos, _ZONE_END, ptr, _now())
+                state.pos = pos = pos + 17
+                if pos > state.limit:
+                    state.next_chunk()
+
+        return wrapper
+
+    def __enter__(self):
+        state = _local.state
+        ptr = state.ptr - _ZONE_STEP
+        state.ptr = ptr
+        pos = state.pos
+        _pack_zone_start(state.buf, pos, _ZONE_START, ptr, state.tid, _now(), self._loc_id)
+        pos += 33
+        state.pos = pos
+        if pos > state.limit:
+            state.next_chunk()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        state = _local.state
+        ptr = state.ptr
+        state.ptr = ptr + _ZONE_STEP
+        pos = state.pos
+        _pack_zone_end(state.buf, pos, _ZONE_END, ptr, _now())
+        pos += 17
+        state.pos = pos
+        if pos > state.limit:
+            state.next_chunk()
+
+    def set_dyn_name(self, name):
+        """Overrides the name of the zone."""
+        state = _local.state
+        data = _encode(name)
+        pos = state.reserve(_ZONE_DYNAMIC_NAME_LAYOUT.size + len(data))
+        _ZONE_DYNAMIC_NAME_LAYOUT.pack_into(
+            state.buf, pos, _ZONE_DYNAMIC_NAME, state.ptr, len(data)
+        )
+        pos += _ZONE_DYNAMIC_NAME_LAYOUT.size
+        state.buf[pos : pos + len(data)] = data
+        if state.pos > state.limit:
+            state.next_chunk()
+
+    def set_param(self, name, value):
+        """Adds a parameter to the zone; `value` is a bool, an int, a float or a string."""
+        state = _local.state
+        name_id = _string_ids.get(name) or _string_id(name)
+        # Fast paths for the most frequent types.
+        value_type = type(value)
+        if value_type is int and -(2**63) <= value < 2**63:
+            pos = state.pos
+            _pack_zone_param_int(state.buf, pos, _ZONE_PARAM_INT, state.ptr, name_id, value)
+            state.pos = pos = pos + 25
+            if pos > state.limit:
+                state.next_chunk()
+        elif value_type is float:
+            pos = state.pos
+            _pack_zone_param_double(state.buf, pos, _ZONE_PARAM_DOUBLE, state.ptr, name_id, value)
+            state.pos = pos = pos + 25
+            if pos > state.limit:
+                state.next_chunk()
+        else:
+            _pack_zone_param(state, name_id, value)
+
+    def add_flow(self, flow_id):
+        _pack_zone_id(_ZONE_FLOW_LAYOUT, _ZONE_FLOW, flow_id)
+
+    def add_flow_terminate(self, flow_id):
+        _pack_zone_id(_ZONE_FLOW_LAYOUT, _ZONE_FLOW_TERMINATE, flow_id)
+
+    def set_category(self, name):
+        _pack_zone_id(_ZONE_CATEGORY_LAYOUT, _ZONE_CATEGORY, _string_id(name))
+
+
+class zone_instant(zone):
+    """A zone without duration: it ends with the timestamp it started with."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        state = _local.state
+        ptr = state.ptr - _ZONE_STEP
+        state.ptr = ptr
+        timestamp = _now()
+        state.instants.append(timestamp)
+        _pack_zone_start(state.buf, state.pos, _ZONE_START, ptr, state.tid, timestamp, self._loc_id)
+        state.pos += 33
+        if state.pos > state.limit:
+            state.next_chunk()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        state = _local.state
+        ptr = state.ptr
+        state.ptr = ptr + _ZONE_STEP
+        _pack_zone_end(state.buf, state.pos, _ZONE_END, ptr, state.instants.pop())
+        state.pos += 17
+        if state.pos > state.limit:
+            state.next_chunk()
+
+
+def emit_counter_value(tid, timestamp, value):
+    """Adds a value to the counter track `tid`; `value` is an int or a float."""
+    state = _local.state
+    if isinstance(value, int) and -(2**63) <= value < 2**63:
+        _COUNTER_VALUE_INT_LAYOUT.pack_into(
+            state.buf, state.pos, _COUNTER_VALUE_INT, tid, timestamp, value
+        )
+    else:
+        _COUNTER_VALUE_DOUBLE_LAYOUT.pack_into(
+            state.buf, state.pos, _COUNTER_VALUE_DOUBLE, tid, timestamp, value
+        )
+    state.pos += 25
+    if state.pos > state.limit:
+        state.next_chunk()
@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+import struct
+
+
+@dataclass
+class PacketKind:
+    """Describes a type of packet in binary traces: how to decode it, and how to convert it."""
+
+    type: int  # the type byte
+    packet_class: type  # built from the decoded fields; has `dependencies()` and `provides()`
+    layout: struct.Struct  # the fields after the type byte (for strings, ends with their size)
+    has_dynamic_size: bool  # whether a UTF-8 string follows the fixed-size fields
+    to_dto: object  # function(packet, strings) -> parse DTO, or None if nothing is produced
+    is_event: bool = False  # carries an event (zones, counter values), not a definition
+    has_timestamp: bool = False  # has the `timestamp` of its event
+
+
+# Type byte -> PacketKind.
+PACKET_KINDS = {}
+
+# Parse DTO class -> function(emitter, item, out), appending the emit DTOs for `item` to `out`.
+EMIT_HANDLERS = {}
+
+# Emit DTO class -> name of the `PerfettoWriter` method adding it to the trace.
+WRITER_METHODS = {}
+
+# Called with each registered `PacketKind`, to update the tables derived from `PACKET_KINDS`.
+_packet_listeners = []
+
+
+def register_packet(kind: PacketKind):
+    """Registers a type of packet, replacing any previous registration for its type byte."""
+    assert 0 < kind.type < 256, f"Invalid packet type {kind.type}"
+    PACKET_KINDS[kind.type] = kind
+    for listener in _packet_listeners:
+        listener(kind)
+
+
+def on_packet_registered(listener):
+    """Calls `listener` for all the registered packet kinds, and for the ones registered later."""
+    _packet_listeners.append(listener)
+    for kind in PACKET_KINDS.values():
+        listener(kind)
+
+
+def register_emit_handler(parse_dto_class, handler):
+    """Registers the function that converts parse DTOs of the given class into emit DTOs."""
+    EMIT_HANDLERS[parse_dto_class] = handler
+
+
+def register_writer_method(emit_dto_class, method_name):
+    """Registers the name of the writer method that adds emit DTOs of the given class."""
+    WRITER_METHODS[emit_dto_class] = method_name
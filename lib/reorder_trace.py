@@ -0,0 +1,132 @@
+from collections import deque
+from dataclasses import dataclass
+import heapq
+import lib.parse_dto as dto
+
+# The items ordered by their own timestamp.
+_TIMED = (dto.ZoneStart, dto.ZoneEnd, dto.CounterValue)
+# The items attached to the last zone started at their stack pointer; they follow that zone.
+_ZONE_DETAILS = (
+    dto.ZoneName,
+    dto.ZoneParam,
+    dto.ZoneFlow,
+    dto.ZoneFlowTerminate,
+    dto.ZoneCategory,
+)
+
+
+@dataclass
+class ReorderStats:
+    """Describes how out of order the events of a trace arrived."""
+
+    events: int = 0  # items with a timestamp
+    late: int = 0  # events older than an event before them
+    max_lateness: int = 0  # ns
+    total_lateness: int = 0  # ns
+    unfixed: int = 0  # events older than an event already released: still out of order
+    max_held: int = 0  # the most items held in the window at once
+
+    def __str__(self):
+        mean = self.total_lateness / self.late if self.late else 0
+        return (
+            f"Reorder window: {self.late:,} of {self.events:,} events late "
+            f"(mean {mean / 1000:.1f}us, max {self.max_lateness / 1000:.1f}us), "
+            f"{self.unfixed:,} still out of order, at most {self.max_held:,} items held"
+        )
+
+
+def _oldest(queue, heap):
+    if heap and (not queue or heap[0] < queue[0]):
+        return heap[0]
+    return queue[0]
+
+
+def _pop_oldest(queue, heap):
+    if heap and (not queue or heap[0] < queue[0]):
+        return heapq.heappop(heap)
+    return queue.popleft()
+
+
+def reorder_parse_batches(parse_batches, max_delay_ns=None, max_items=None, stats=None):
+    """Reorders the parse items on timestamp, within a bounded window.
+
+    The events (zone starts and ends, counter values) are held, and released in timestamp order
+    once they are `max_delay_ns` older than the newest event, or when more than `max_items` items
+    are held. Most events arrive in order: they are queued, and only the late ones go to a
+    min-heap; the window releases the smaller of the two heads.
+
+    The details of a zone (name, parameters, flows, categories) stay right after the zone start;
+    the definitions (stacks, threads, locations, counter tracks) are not delayed. Events later
+    than the window are released right away, and counted as unfixed in `stats`."""
+    assert max_delay_ns is not None or max_items is not None, "The window needs a bound"
+    if stats is None:
+        stats = ReorderStats()
+    max_delay = max_delay_ns if max_delay_ns is not None else float("inf")
+    max_items = max_items if max_items is not None else float("inf")
+    heappush = heapq.heappush
+    zone_start, zone_end = dto.ZoneStart, dto.ZoneEnd
+    queue = deque()  # the held items arriving in order, as (timestamp, seq, detail seq, item)
+    heap = []  # the held items arriving out of order
+    seq = 0
+    newest = -1  # the timestamp of the newest event
+    released = -1  # the timestamp of the last released event
+    zone_keys = {}  # stack_ptr -> the heap key of the last zone started there
+    for batch in parse_batches:
+        out = []
+        for item in batch:
+            seq += 1
+            item_type = type(item)
+            if item_type in _TIMED:
+                timestamp = item.timestamp
+                if timestamp >= newest:
+                    newest = timestamp
+                else:
+                    lateness = newest - timestamp
+                    stats.late += 1
+                    stats.total_lateness += lateness
+                    if lateness > stats.max_lateness:
+                        stats.max_lateness = lateness
+                    if timestamp < released:
+                        stats.unfixed += 1
+                if item_type is zone_start:
+                    zone_keys[item.stack_ptr] = (timestamp, seq)
+                elif item_type is zone_end:
+                    zone_keys.pop(item.stack_ptr, None)
+                entry = (timestamp, seq, 0, item)
+                stats.events += 1
+            elif item_type in _ZONE_DETAILS and item.stack_ptr in zone_keys:
+                timestamp, start_seq = zone_keys[item.stack_ptr]
+                entry = (timestamp, start_seq, seq, item)
+            else:
+                out.append(item)
+                continue
+            if not queue or entry > queue[-1]:
+                queue.append(entry)
+            else:
+                heappush(heap, entry)
+
+            held = len(queue) + len(heap)
+            oldest = queue[0][0] if queue else heap[0][0]
+            if heap and heap[0][0] < oldest:
+                oldest = heap[0][0]
+            if held > max_items or oldest <= newest - max_delay:
+                if held > stats.max_held:
+                    stats.max_held = held
+                while held and (
+                    held > max_items or _oldest(queue, heap)[0] <= newest - max_delay
+                ):
+                    entry = _pop_oldest(queue, heap)
+                    released = entry[0]
+                    out.append(entry[3])
+                    held -= 1
+        held = len(queue) + len(heap)
+        if held > stats.max_held:
+            stats.max_held = held
+        if out:
+            yield out
+
+    out = []
+    while queue or heap:
+        out.append(_pop_oldest(queue, heap)[3])
+    if out:
+        yield out
@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+import random
+
+
+@dataclass(frozen=True)
+class EveryNth:
+    """Keeps the first zone of every `n` zones."""
+
+    n: int
+
+    def __post_init__(self):
+        if self.n < 1:
+            raise ValueError(f"Invalid sampling period {self.n}")
+
+    def sampler(self):
+        """Returns a new `keep(timestamp)` function, with its own state."""
+        count = -1
+        n = self.n
+
+        def keep(timestamp):
+            nonlocal count
+            count += 1
+            return count % n == 0
+
+        return keep
+
+
+@dataclass(frozen=True)
+class MaxRate:
+    """Keeps at most `per_second` zones per second, at least 1/`per_second` seconds apart."""
+
+    per_second: float
+
+    def __post_init__(self):
+        if self.per_second <= 0:
+            raise ValueError(f"Invalid sampling rate {self.per_second}")
+
+    def sampler(self):
+        """Returns a new `keep(timestamp)` function, with its own state."""
+        interval = int(1_000_000_000 / self.per_second)
+        next_timestamp = None
+
+        def keep(timestamp):
+            nonlocal next_timestamp
+            if next_timestamp is not None and timestamp < next_timestamp:
+                return False
+            next_timestamp = timestamp + interval
+            return True
+
+        return keep
+
+
+@dataclass(frozen=True)
+class CappedRandom:
+    """Keeps at most `size` random zones per window of `window_ns`.
+
+    The zones are emitted as they come, so the number of zones of a window isn't known when its
+    zones are kept: each zone is kept with probability `size / n`, `n` being the number of zones of
+    the previous window, until `size` zones of the window are kept. This is not reservoir sampling,
+    and the kept zones are biased: the first window keeps its first `size` zones, and a window with
+    more zones than the previous one reaches `size` early, keeping none of its last zones. The
+    random generator is seeded, so the same trace is always sampled the same way."""
+
+    size: int
+    window_ns: int = 1_000_000_000
+    seed: int = 0
+
+    def __post_init__(self):
+        if self.size < 1 or self.window_ns < 1:
+            raise ValueError(f"Invalid cap of {self.size} zones per {self.window_ns} ns")
+
+    def sampler(self):
+        """Returns a new `keep(timestamp)` function, with its own state."""
+        size = self.size
+        window_ns = self.window_ns
+        rand = random.Random(self.seed).random
+        window = None
+        count = 0
+        expected = size  # the number of zones of the previous window
+        kept = 0
+
+        def keep(timestamp):
+            nonlocal window, count, expected, kept
+            if timestamp // window_ns != window:
+                if window is not None:
+                    expected = max(count, size)
+                window = timestamp // window_ns
+                count = kept = 0
+            count += 1
+            if kept >= size or rand() * expected >= size:
+                return False
+            kept += 1
+            return True
+
+        return keep
+
+
+_POLICIES = {"every": (EveryNth, int), "rate": (MaxRate, float), "capped": (CappedRandom, int)}
+
+
+def parse_sampling_policy(spec):
+    """Parses a sampling policy: "every:N", "rate:PER_SECOND" or "capped:SIZE"."""
+    kind, _, value = spec.partition(":")
+    if kind not in _POLICIES or not value:
+        raise ValueError(f"Invalid sampling policy '{spec}'")
+    policy_class, value_type = _POLICIES[kind]
+    return policy_class(value_type(value))
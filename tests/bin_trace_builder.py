@@ -0,0 +1,12 @@
+import struct
+
+
+def packet(type, format, *args):
+    """A fixed-size packet: the type byte, then the fields packed with `format`."""
+    return bytes([type]) + struct.pack("<" + format, *args)
+
+
+def dyn_packet(type, format, *args, text):
+    """A dynamic-size packet: like `packet`, followed by the size of `text` and its UTF-8 bytes."""
+    data = text.encode("utf-8")
+    return bytes([type]) + struct.pack("<" + format + "H", *args, len(data)) + data
@@ -0,0 +1,52 @@
+from bin_trace_builder import dyn_packet, packet
+import bin_to_perfetto
+from lib.parse_bin_trace import parse_bin_trace_batches
+import perfetto_trace_pb2 as pb2
+import pytest
+
+
+def _interrupted_parse_batches(filename, follow=False, on_idle=None):
+    """Parses `filename`, then raises KeyboardInterrupt, like a Ctrl+C during the conversion."""
+    yield from parse_bin_trace_batches(filename)
+    raise KeyboardInterrupt()
+
+
+@pytest.fixture
+def interrupted_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(bin_to_perfetto, "parse_bin_trace_batches", _interrupted_parse_batches)
+    out = bytearray(packet(16, "4sI", b"PROF", 1))
+    for string_id, text in [(1, "zone"), (2, "f()"), (3, "file.cpp")]:
+        out += dyn_packet(17, "Q", string_id, text=text)
+    out += packet(18, "4QI", 10, 1, 2, 3, 1)
+    out += dyn_packet(19, "QQ", 0, 4096, text="Stack")
+    out += packet(21, "4Q", 4064, 7, 100, 10)
+    out += packet(22, "QQ", 4064, 110)
+    path = tmp_path / "capture.bin-trace"
+    path.write_bytes(bytes(out))
+    return str(path)
+
+
+def _slice_timestamps(filename):
+    trace = pb2.Trace()
+    with open(filename, "rb") as f:
+        trace.ParseFromString(f.read())
+    slice_types = (pb2.TrackEvent.TYPE_SLICE_BEGIN, pb2.TrackEvent.TYPE_SLICE_END)
+    return [p.timestamp for p in trace.packet if p.track_event.type in slice_types]
+
+
+@pytest.mark.parametrize("writer", ["pb2", "direct"])
+def test_interrupted_follow_writes_the_converted_part(interrupted_trace, tmp_path, writer):
+    out = str(tmp_path / "out.perfetto-trace")
+    bin_to_perfetto.run(
+        [interrupted_trace], out, follow=True, writer_class=bin_to_perfetto._WRITERS[writer]
+    )
+    # The zone (100-110), and the use of the stack by its thread, from 100.
+    assert _slice_timestamps(out) == [100, 100, 110]
+
+
+def test_interrupted_conversion_closes_the_trace(interrupted_trace, tmp_path):
+    out = str(tmp_path / "out.perfetto-trace")
+    with pytest.raises(KeyboardInterrupt):
+        bin_to_perfetto.run([interrupted_trace], out)
+    # The zone (100-110), and the use of the stack by its thread, from 100.
+    assert _slice_timestamps(out) == [100, 100, 110]
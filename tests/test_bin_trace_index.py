@@ -0,0 +1,80 @@
+from bin_trace_builder import dyn_packet, packet
+import lib.parse_dto as dto
+from lib.bin_trace_index import _window_packets, build_time_index, parse_bin_trace_window
+
+
+def test_window_spans_blocks_without_timestamps(tmp_path):
+    out = bytearray(packet(16, "4sI", b"PROF", 1))
+    out += dyn_packet(17, "Q", 3, text="f()")
+    out += packet(21, "4Q", 4064, 7, 100, 10)
+    out += packet(22, "QQ", 4064, 110)
+    # A block with only definitions, in the middle of the window.
+    out += dyn_packet(17, "Q", 1, text="zone")
+    out += dyn_packet(17, "Q", 2, text="file.cpp")
+    out += packet(21, "4Q", 4064, 7, 200, 10)
+    out += packet(22, "QQ", 4064, 210)
+    path = tmp_path / "window.bin-trace"
+    path.write_bytes(bytes(out))
+
+    data = path.read_bytes()
+    index = build_time_index(str(path), packets_per_entry=2)
+    assert [e.min_timestamp for e in index.entries][2] == 2**64 - 1
+    timestamps = [
+        p.timestamp for p in _window_packets(data, index, 0, 300) if hasattr(p, "timestamp")
+    ]
+    assert timestamps == [100, 110, 200, 210]
+
+
+def _straddling_zones_trace(path):
+    """Zones across the start (100-250) and the end (300-500) of the window 200-400."""
+    out = bytearray(packet(16, "4sI", b"PROF", 1))
+    for string_id, text in [(1, "zone"), (2, "f()"), (3, "file.cpp"), (4, "param")]:
+        out += dyn_packet(17, "Q", string_id, text=text)
+    out += packet(18, "4QI", 10, 1, 2, 3, 1)
+    out += dyn_packet(32, "Q", 7, text="Counter")
+    out += packet(21, "4Q", 4064, 7, 100, 10)
+    out += packet(25, "QQq", 4064, 4, 1)
+    out += packet(33, "QQq", 7, 150, 1)
+    out += packet(22, "QQ", 4064, 250)
+    out += packet(21, "4Q", 4064, 7, 300, 10)
+    out += packet(25, "QQq", 4064, 4, 2)
+    out += packet(33, "QQq", 7, 350, 2)
+    out += packet(33, "QQq", 7, 450, 3)
+    out += packet(22, "QQ", 4064, 500)
+    out += packet(21, "4Q", 4064, 7, 600, 10)
+    out += packet(22, "QQ", 4064, 700)
+    path.write_bytes(bytes(out))
+    return str(path)
+
+
+def _events(items):
+    return [
+        (type(item).__name__, getattr(item, "timestamp", getattr(item, "value", None)))
+        for item in items
+        if isinstance(item, (dto.ZoneStart, dto.ZoneEnd, dto.ZoneParam, dto.CounterValue))
+    ]
+
+
+def test_window_keeps_the_zones_starting_in_it(tmp_path):
+    filename = _straddling_zones_trace(tmp_path / "straddling.bin-trace")
+    # The zone started before the window is dropped with its end and its param, while the zone
+    # started in the window is kept with its end, after the window.
+    assert _events(parse_bin_trace_window(filename, 200, 400)) == [
+        ("ZoneStart", 300),
+        ("ZoneParam", 2),
+        ("CounterValue", 350),
+        ("ZoneEnd", 500),
+    ]
+
+
+def test_window_limits_are_inclusive(tmp_path):
+    filename = _straddling_zones_trace(tmp_path / "straddling.bin-trace")
+    assert _events(parse_bin_trace_window(filename, 100, 300)) == [
+        ("ZoneStart", 100),
+        ("ZoneParam", 1),
+        ("CounterValue", 150),
+        ("ZoneEnd", 250),
+        ("ZoneStart", 300),
+        ("ZoneParam", 2),
+        ("ZoneEnd", 500),
+    ]
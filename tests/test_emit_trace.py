@@ -0,0 +1,161 @@
+import lib.emit_dto as emit_dto
+import lib.parse_dto as parse_dto
+from lib.emit_trace import emit_trace
+from lib.zone_sampling import EveryNth
+
+_OUTER, _INNER = 4064, 4032
+
+
+def _start(stack_ptr, timestamp, locid=1):
+    return parse_dto.ZoneStart(stack_ptr=stack_ptr, tid=1, timestamp=timestamp, locid=locid)
+
+
+def _end(stack_ptr, timestamp):
+    return parse_dto.ZoneEnd(stack_ptr=stack_ptr, timestamp=timestamp)
+
+
+def _items(events):
+    """The parse items of `events`, after the definitions of their stack, thread and locations."""
+    items = [
+        parse_dto.Stack(begin=0, end=4096, name="Stack"),
+        parse_dto.Thread(tid=1, thread_name="Main"),
+    ]
+    for locid, name in [(1, "outer"), (2, "inner")]:
+        items.append(parse_dto.Location(locid, name, f"{name}()", "file.cpp", locid))
+    return items + events
+
+
+def _zones(events, **kwargs):
+    """Emits `events` on a stack, returning the zones of the stack track."""
+    out = list(emit_trace(_items(events), **kwargs))
+    stack_uuid = next(
+        item.track_uuid
+        for item in out
+        if isinstance(item, emit_dto.Thread) and item.thread_name == "Stack"
+    )
+    zones = []
+    for item in out:
+        if getattr(item, "track_uuid", None) != stack_uuid:
+            continue
+        if isinstance(item, emit_dto.ZoneStart):
+            zones.append(("start", item.timestamp, item.name))
+        elif isinstance(item, emit_dto.ZoneInstant):
+            zones.append(("instant", item.timestamp, item.name))
+        elif isinstance(item, emit_dto.ZoneEnd):
+            zones.append(("end", item.timestamp))
+    return zones
+
+
+def test_min_duration_drops_short_leaves():
+    events = [_start(_OUTER, 0), _start(_INNER, 100, 2), _end(_INNER, 150), _end(_OUTER, 1000)]
+    assert _zones(events, min_zone_duration_ns=500) == [("start", 0, "outer"), ("end", 1000)]
+
+
+def test_min_duration_drops_short_zones_with_their_nested_zones():
+    events = [_start(_OUTER, 0), _start(_INNER, 100, 2), _end(_INNER, 200), _end(_OUTER, 300)]
+    assert _zones(events, min_zone_duration_ns=500) == []
+
+
+def test_min_duration_keeps_the_parents_of_long_zones():
+    events = [_start(_OUTER, 0), _start(_INNER, 100, 2), _end(_INNER, 900), _end(_OUTER, 950)]
+    assert _zones(events, min_zone_duration_ns=500) == [
+        ("start", 0, "outer"),
+        ("start", 100, "inner"),
+        ("end", 900),
+        ("end", 950),
+    ]
+
+
+def test_min_duration_releases_held_zones_once_long_enough():
+    # The outer zone is emitted when a zone of its stack starts 500 after it, before its end.
+    events = [
+        _start(_OUTER, 0),
+        _start(_INNER, 100, 2),
+        _end(_INNER, 110),
+        _start(_INNER, 500, 2),
+        _end(_INNER, 510),
+        _end(_OUTER, 1000),
+    ]
+    consumed = []
+
+    def items():
+        for item in _items(events):
+            consumed.append(item)
+            yield item
+
+    for item in emit_trace(items(), min_zone_duration_ns=500):
+        if isinstance(item, emit_dto.ZoneStart) and item.name == "outer":
+            break
+    assert consumed[-1] is events[3]
+
+
+def test_min_duration_keeps_instant_and_flow_zones():
+    events = [
+        _start(_OUTER, 0),
+        _start(_INNER, 100, 2),
+        _end(_INNER, 100),
+        _start(_INNER, 200, 2),
+        parse_dto.ZoneFlow(stack_ptr=_INNER, flowid=7),
+        _end(_INNER, 210),
+        _end(_OUTER, 300),
+    ]
+    assert _zones(events, min_zone_duration_ns=500) == [
+        ("start", 0, "outer"),
+        ("instant", 100, "inner"),
+        ("start", 200, "inner"),
+        ("end", 210),
+        ("end", 300),
+    ]
+
+
+def test_sampling_drops_the_nested_zones_of_dropped_zones():
+    events = []
+    for timestamp in (0, 1000, 2000):
+        events += [
+            _start(_OUTER, timestamp),
+            _start(_INNER, timestamp + 100, 2),
+            parse_dto.ZoneParam(stack_ptr=_INNER, name="param", value=1),
+            _end(_INNER, timestamp + 200),
+            _end(_OUTER, timestamp + 300),
+        ]
+    zones = _zones(events, sampling={"outer": EveryNth(2)})
+    assert zones == [
+        ("start", 0, "outer"),
+        ("start", 100, "inner"),
+        ("end", 200),
+        ("end", 300),
+        ("start", 2000, "outer"),
+        ("start", 2100, "inner"),
+        ("end", 2200),
+        ("end", 2300),
+    ]
+
+
+def test_zero_duration_leaf_zones_are_instants():
+    events = [_start(_OUTER, 0), _start(_INNER, 100, 2), _end(_INNER, 100), _end(_OUTER, 200)]
+    assert _zones(events) == [("start", 0, "outer"), ("instant", 100, "inner"), ("end", 200)]
+
+
+def test_zero_duration_zones_with_nested_zones_are_not_instants():
+    events = [_start(_OUTER, 100), _start(_INNER, 100, 2), _end(_INNER, 100), _end(_OUTER, 100)]
+    assert _zones(events) == [("start", 100, "outer"), ("instant", 100, "inner"), ("end", 100)]
+
+
+def test_instants_keep_the_data_of_their_zone():
+    events = [
+        _start(_OUTER, 100),
+        parse_dto.ZoneName(stack_ptr=_OUTER, name="renamed"),
+        parse_dto.ZoneParam(stack_ptr=_OUTER, name="count", value=3),
+        parse_dto.ZoneParam(stack_ptr=_OUTER, name="address,x", value=255),
+        parse_dto.ZoneFlow(stack_ptr=_OUTER, flowid=7),
+        parse_dto.ZoneFlowTerminate(stack_ptr=_OUTER, flowid=8),
+        parse_dto.ZoneCategory(stack_ptr=_OUTER, category_name="io"),
+        _end(_OUTER, 100),
+    ]
+    out = list(emit_trace(_items(events)))
+    instants = [item for item in out if isinstance(item, emit_dto.ZoneInstant)]
+    assert len(instants) == 1
+    instant = instants[0]
+    assert (instant.timestamp, instant.name, instant.loc.line_number) == (100, "renamed", 1)
+    assert instant.params == {"count": 3, "address": "0xff"}
+    assert (instant.flows, instant.flows_terminating, instant.categories) == ([7], [8], ["io"])
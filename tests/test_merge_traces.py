@@ -0,0 +1,38 @@
+from bin_trace_builder import dyn_packet, packet
+import lib.emit_dto as emit_dto
+from lib.merge_traces import emit_merged_trace_batches
+from lib.parse_bin_trace import parse_bin_trace_batches
+
+
+def _capture(path, first_timestamp):
+    """A capture with two stacks, and two threads with the same ids in all the captures."""
+    out = bytearray(packet(16, "4sI", b"PROF", 1))
+    for string_id, text in [(1, "zone"), (2, "f()"), (3, "file.cpp")]:
+        out += dyn_packet(17, "Q", string_id, text=text)
+    out += packet(18, "4QI", 10, 1, 2, 3, 1)
+    for stack in range(2):
+        out += dyn_packet(19, "QQ", stack * 4096, (stack + 1) * 4096, text=f"Stack {stack}")
+    out += dyn_packet(20, "Q", 4, text="Main")
+    for tid, stack_ptr in [(4, 4064), (5, 8160)]:
+        timestamp = first_timestamp + tid
+        out += packet(21, "4Q", stack_ptr, tid, timestamp, 10)
+        out += packet(22, "QQ", stack_ptr, timestamp + 10)
+    path.write_bytes(bytes(out))
+    return str(path)
+
+
+def test_merged_captures_have_distinct_tids(tmp_path):
+    filenames = [_capture(tmp_path / f"{i}.bin-trace", 100 * i) for i in range(3)]
+    streams = [parse_bin_trace_batches(filename) for filename in filenames]
+    threads = [
+        item
+        for batch in emit_merged_trace_batches(streams, labels=filenames)
+        for item in batch
+        if isinstance(item, emit_dto.Thread)
+    ]
+    # Per capture: 2 stack tracks, and 2 thread-mapping tracks (one of them for an unnamed thread).
+    assert len(threads) == 3 * 4
+    tids = [thread.tid for thread in threads]
+    assert len(set(tids)) == len(tids)
+    assert all(0 < tid < 2**31 for tid in tids)
+    assert len({thread.pid for thread in threads}) == 3 * 2
@@ -0,0 +1,79 @@
+from bin_trace_builder import dyn_packet, packet
+import lib.parse_dto as dto
+from lib.parse_bin_trace import _follow_packet_batches, parse_bin_trace
+
+
+def _late_location_trace(path):
+    """A zone (100-130) with a nested zone (110-120) whose location is defined at the end."""
+    out = bytearray(packet(16, "4sI", b"PROF", 1))
+    for string_id, text in [(1, "parent"), (2, "child"), (3, "f()"), (4, "file.cpp")]:
+        out += dyn_packet(17, "Q", string_id, text=text)
+    out += dyn_packet(19, "QQ", 0, 4096, text="Stack")
+    out += dyn_packet(20, "Q", 7, text="Thread")
+    out += packet(18, "4QI", 10, 1, 3, 4, 1)
+    out += packet(21, "4Q", 4064, 7, 100, 10)
+    out += packet(21, "4Q", 4032, 7, 110, 11)
+    out += packet(22, "QQ", 4032, 120)
+    out += packet(22, "QQ", 4064, 130)
+    out += packet(18, "4QI", 11, 2, 3, 4, 2)
+    path.write_bytes(bytes(out))
+    return str(path)
+
+
+def test_late_location_keeps_the_nesting(tmp_path):
+    items = list(parse_bin_trace(_late_location_trace(tmp_path / "late.bin-trace")))
+    events = [
+        (type(item).__name__, getattr(item, "timestamp", getattr(item, "locid", None)))
+        for item in items
+        if isinstance(item, (dto.ZoneStart, dto.ZoneEnd, dto.Location))
+    ]
+    assert events == [
+        ("Location", 10),
+        ("ZoneStart", 100),
+        ("Location", 11),
+        ("ZoneStart", 110),
+        ("ZoneEnd", 120),
+        ("ZoneEnd", 130),
+    ]
+
+
+def test_late_param_name_keeps_the_nesting(tmp_path):
+    out = bytearray(packet(16, "4sI", b"PROF", 1))
+    for string_id, text in [(1, "zone"), (3, "f()"), (4, "file.cpp")]:
+        out += dyn_packet(17, "Q", string_id, text=text)
+    out += packet(18, "4QI", 10, 1, 3, 4, 1)
+    out += packet(21, "4Q", 4064, 7, 100, 10)
+    out += packet(21, "4Q", 4032, 7, 110, 10)
+    out += packet(25, "QQq", 4032, 5, 42)
+    out += packet(22, "QQ", 4032, 120)
+    out += packet(22, "QQ", 4064, 130)
+    out += dyn_packet(17, "Q", 5, text="param")
+    path = tmp_path / "late.bin-trace"
+    path.write_bytes(bytes(out))
+    items = [item for item in parse_bin_trace(str(path)) if hasattr(item, "stack_ptr")]
+    assert [type(item).__name__ for item in items] == [
+        "ZoneStart",
+        "ZoneStart",
+        "ZoneParam",
+        "ZoneEnd",
+        "ZoneEnd",
+    ]
+    assert [item.stack_ptr for item in items] == [4064, 4032, 4032, 4032, 4064]
+
+
+def _fail_when_idle():
+    raise AssertionError("Waiting for more data")
+
+
+def test_follow_skips_free_bytes(tmp_path):
+    path = tmp_path / "follow.bin-trace"
+    out = bytearray(packet(16, "4sI", b"PROF", 1))
+    out += bytes(16)  # padding
+    out += dyn_packet(17, "Q", 1, text="zone")
+    out += bytes(3)
+    out += dyn_packet(17, "Q", 2, text="f()")
+    path.write_bytes(bytes(out))
+    with open(path, "rb") as file:
+        batches = _follow_packet_batches(file, [0], on_idle=_fail_when_idle)
+        packets = [packet for _ in range(3) for packet in next(batches)]
+    assert [getattr(packet, "string", None) for packet in packets] == [None, "zone", "f()"]
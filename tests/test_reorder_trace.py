@@ -0,0 +1,70 @@
+import lib.parse_dto as dto
+from lib.reorder_trace import ReorderStats, reorder_parse_batches
+
+
+def _counter(timestamp, value=0):
+    return dto.CounterValue(tid=1, timestamp=timestamp, value=value)
+
+
+def _reorder(items, **kwargs):
+    """Reorders `items`, passed in batches of one item; returns the batches, and the stats."""
+    stats = ReorderStats()
+    batches = list(reorder_parse_batches(([item] for item in items), stats=stats, **kwargs))
+    return batches, stats
+
+
+def _timestamps(batches):
+    return [item.timestamp for batch in batches for item in batch]
+
+
+def test_late_events_are_reordered():
+    batches, stats = _reorder([_counter(t) for t in (10, 30, 20, 40, 25)], max_delay_ns=100)
+    assert _timestamps(batches) == [10, 20, 25, 30, 40]
+    assert (stats.events, stats.late, stats.unfixed) == (5, 2, 0)
+    assert (stats.max_lateness, stats.total_lateness) == (15, 25)
+    assert stats.max_held == 5
+
+
+def test_ties_keep_the_arrival_order():
+    items = [_counter(20, 1), _counter(10, 2), _counter(20, 3), _counter(10, 4)]
+    batches, _ = _reorder(items, max_delay_ns=100)
+    assert [item.value for batch in batches for item in batch] == [2, 4, 1, 3]
+
+
+def test_zone_details_follow_their_start():
+    items = [
+        _counter(60),
+        dto.ZoneStart(stack_ptr=4064, tid=1, timestamp=50, locid=1),
+        dto.ZoneParam(stack_ptr=4064, name="param", value=1),
+        dto.ZoneName(stack_ptr=4064, name="name"),
+        dto.ZoneEnd(stack_ptr=4064, timestamp=70),
+    ]
+    batches, stats = _reorder(items, max_delay_ns=100)
+    assert [type(item).__name__ for batch in batches for item in batch] == [
+        "ZoneStart",
+        "ZoneParam",
+        "ZoneName",
+        "CounterValue",
+        "ZoneEnd",
+    ]
+    assert (stats.events, stats.late) == (3, 1)
+
+
+def test_definitions_are_not_delayed():
+    location = dto.Location(1, "zone", "f()", "file.cpp", 1)
+    batches, _ = _reorder([_counter(10), location, _counter(20)], max_delay_ns=100)
+    assert batches[0] == [location]
+
+
+def test_events_are_released_once_older_than_the_window():
+    batches, stats = _reorder([_counter(t) for t in (100, 120, 160, 300)], max_delay_ns=50)
+    # 160 releases 100, and 300 releases 120 and 160; 300 is released at the end.
+    assert [[item.timestamp for item in batch] for batch in batches] == [[100], [120, 160], [300]]
+    assert stats.max_held == 3
+
+
+def test_events_later_than_the_window_are_unfixed():
+    batches, stats = _reorder([_counter(t) for t in (100, 200, 300, 150)], max_items=1)
+    assert _timestamps(batches) == [100, 200, 150, 300]
+    assert (stats.late, stats.unfixed, stats.max_lateness) == (1, 1, 150)
+    assert stats.max_held == 2
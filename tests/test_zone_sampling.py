@@ -0,0 +1,55 @@
+import pytest
+from lib.zone_sampling import CappedRandom, EveryNth, MaxRate, parse_sampling_policy
+
+
+def _kept(policy, timestamps):
+    keep = policy.sampler()
+    return [t for t in timestamps if keep(t)]
+
+
+def test_every_nth_keeps_the_first_of_every_n_zones():
+    assert _kept(EveryNth(3), range(10)) == [0, 3, 6, 9]
+    assert _kept(EveryNth(1), range(3)) == [0, 1, 2]
+
+
+def test_max_rate_keeps_zones_at_least_an_interval_apart():
+    # 2 zones per second: at least 500ms apart.
+    timestamps = [0, 100_000_000, 499_999_999, 500_000_000, 900_000_000, 1_200_000_000]
+    assert _kept(MaxRate(2), timestamps) == [0, 500_000_000, 1_200_000_000]
+
+
+def test_capped_random_keeps_at_most_size_zones_per_window():
+    # 100 zones per window of 1000ns, over 10 windows.
+    timestamps = range(0, 10_000, 10)
+    kept = _kept(CappedRandom(5, window_ns=1000), timestamps)
+    per_window = [sum(1 for t in kept if t // 1000 == w) for w in range(10)]
+    assert all(count <= 5 for count in per_window)
+    assert sum(per_window) >= 30
+    # The first window keeps its first zones.
+    assert kept[:5] == [0, 10, 20, 30, 40]
+
+
+def test_capped_random_is_deterministic():
+    policy = CappedRandom(5, window_ns=1000)
+    timestamps = range(0, 10_000, 10)
+    assert _kept(policy, timestamps) == _kept(policy, timestamps)
+
+
+def test_samplers_have_their_own_state():
+    policy = EveryNth(2)
+    first, second = policy.sampler(), policy.sampler()
+    assert [first(0), first(1), second(2)] == [True, False, True]
+
+
+def test_parse_sampling_policy():
+    assert parse_sampling_policy("every:10") == EveryNth(10)
+    assert parse_sampling_policy("rate:2.5") == MaxRate(2.5)
+    assert parse_sampling_policy("capped:5") == CappedRandom(5)
+
+
+@pytest.mark.parametrize(
+    "spec", ["every", "every:", "sometimes:3", "every:0", "rate:-1", "capped:x"]
+)
+def test_parse_sampling_policy_rejects_invalid_policies(spec):
+    with pytest.raises(ValueError):
+        parse_sampling_policy(spec)
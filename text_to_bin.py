@@ -0,0 +1,33 @@
+#!env python3
+
+import argparse
+from lib.bin_trace_writer import text_to_bin
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transform a textual trace to a binary trace, readable by bin_to_perfetto.py."
+    )
+    parser.add_argument("filename", type=str, help="The filename of the text trace")
+    parser.add_argument(
+        "-o",
+        "--out",
+        type=str,
+        help="The output filename (binary trace)",
+        default="capture.bin-trace",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="The number of processes used to parse the text trace",
+        default=1,
+    )
+    args = parser.parse_args()
+
+    count = text_to_bin(args.filename, args.out, args.jobs)
+    print(f"Wrote {count:,} items to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
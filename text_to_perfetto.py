@@ -2,8 +2,13 @@
 
 import argparse
 from lib.perfetto_writer import PerfettoWriter
-from lib.parse_text_trace import parse_text_trace
-from lib.emit_trace import emit_trace
+from lib.perfetto_direct_writer import DirectPerfettoWriter
+from lib.parse_text_trace import parse_text_trace_batches
+from lib.emit_trace import emit_trace_batches
+from lib.pipeline import run_pipeline
+
+
+_WRITERS = {"pb2": PerfettoWriter, "direct": DirectPerfettoWriter}
 
 
 def main():
@@ -18,13 +23,39 @@ def main():
         help="The output filename (Perfetto trace)",
         default="out.perfetto-trace",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="The number of processes used to parse the text trace",
+        default=1,
+    )
+    parser.add_argument(
+        "--writer",
+        choices=["pb2", "direct"],
+        default="pb2",
+        help="How to encode the Perfetto trace: through the pb2 classes, or directly",
+    )
+    parser.add_argument(
+        "--delta-timestamps",
+        action="store_true",
+        help="Encode the timestamps as deltas on an incremental clock (smaller traces)",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Run parsing, emitting and writing as concurrent stages, and report their utilization",
+    )
     args = parser.parse_args()
 
-    parse_items = parse_text_trace(args.filename)
-    emit_dtos = emit_trace(parse_items)
-    writer = PerfettoWriter(args.out)
-    for obj in emit_dtos:
-        writer.add(obj)
+    parse_batches = parse_text_trace_batches(args.filename, args.jobs)
+    writer = _WRITERS[args.writer](args.out, delta_timestamps=args.delta_timestamps)
+    if args.pipeline:
+        for stage in run_pipeline(parse_batches, emit_trace_batches, writer):
+            print(stage)
+    else:
+        for batch in emit_trace_batches(parse_batches):
+            writer.add_batch(batch)
     writer.close()
 
 